@@ -0,0 +1,49 @@
+"""
+# 合并执行基准测试
+并发调用逐个执行与`batch=True`合并为一次执行的吞吐量对比，注册函数每次执行有固定的开销
+运行: python tests/bench_batch.py
+"""
+import os
+import time
+import asyncio
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.register import Register
+
+
+def setup_cost():
+    """模拟每次执行的固定开销，例如加载模型的参数或者建立向量化计算"""
+    time.sleep(0.0005)
+
+
+def score(x: float):
+    setup_cost()
+    return x * 2
+
+
+def score_batch(items: list):
+    setup_cost()
+    return [x * 2 for x in items]
+
+
+async def bench(rm, calls: int, concurrency: int):
+    t = time.perf_counter()
+    for i in range(0, calls, concurrency):
+        await asyncio.gather(*[rm.execute((j,), {}) for j in range(i, i + concurrency)])
+    total = time.perf_counter() - t
+    mode = f'batch({rm.maxBatchSize})' if rm.batch else 'single'
+    print(f'{mode:<12} concurrency:{concurrency:>5} | calls/s:{calls/total:>10.0f}')
+
+
+async def main(calls: int = 20000):
+    register = Register(checkParams=False, checkReturn=False)
+    register.rpc(score, name='score')
+    register.rpc(score_batch, name='score_batch', batch=True, batchWindow=0.001, maxBatchSize=256)
+    for concurrency in (10, 100, 1000):
+        await bench(register.methods_of_rpc['score'], calls // 10, concurrency)
+        await bench(register.methods_of_rpc['score_batch'], calls, concurrency)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+"""
+# 编解码器基准测试
+典型消息(rpc请求、rpc响应、publish推送、较大的结果列表)在各编解码器下的编码大小和编解码耗时
+运行: python tests/bench_codec.py
+"""
+import os
+import time
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.codec import JSON, MSGPACK, _msgpack
+
+
+PAYLOADS = {
+    'rpc request': dict(id=123456, requestType='rpc', methodName='add', args=[1, 2], dicts={}),
+    'rpc response': dict(id=123456, responseType='rpc', state=1, methodName='add', result=3),
+    'publish': dict(id=0, responseType='publish', state=1,
+                    result=dict(topic='market.btc', msg=dict(symbol='BTCUSDT', price=67321.25, qty=0.0153, side='buy', ts=1718000000123), seq=8812)),
+    'list 10k': dict(id=1, responseType='rpc', state=1, methodName='range', result=[i * 0.5 for i in range(10000)]),
+}
+
+
+def bench(codec, name: str, obj, rounds: int):
+    data = codec.dumps(obj)
+    size = len(data.encode('utf-8')) if isinstance(data, str) else len(data)
+    t = time.perf_counter()
+    for _ in range(rounds):
+        codec.dumps(obj)
+    enc = time.perf_counter() - t
+    t = time.perf_counter()
+    for _ in range(rounds):
+        codec.loads(data)
+    dec = time.perf_counter() - t
+    print(f'{codec.name:<8} {name:<13} | bytes:{size:>7} | us/encode:{enc/rounds*1e6:>9.2f} | us/decode:{dec/rounds*1e6:>9.2f}')
+
+
+def main():
+    print(f'msgpack: {"C extension" if _msgpack else "pure Python"}')
+    for name, obj in PAYLOADS.items():
+        rounds = 50 if name == 'list 10k' else 20000
+        for codec in (JSON, MSGPACK):
+            bench(codec, name, obj, rounds)
+
+
+if __name__ == '__main__':
+    main()
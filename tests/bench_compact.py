@@ -0,0 +1,55 @@
+"""
+# 紧凑格式基准测试
+小参数的rpc请求和响应，完整格式(字典)与紧凑格式(数组和方法编号)在各编解码器下的编码大小和服务端的编解码耗时
+运行: python tests/bench_compact.py
+"""
+import os
+import time
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.codec import JSON, MSGPACK
+from utran.object import (TYPE_CODES, EncodedResponse, UtResponse, UtState, UtType,
+                          create_UtRequest, create_compact_UtRequest)
+
+
+METHODS = ('get_position', 'place_order', 'cancel_order')
+
+
+def full_request(i: int) -> dict:
+    return dict(id=i, requestType='rpc', methodName='place_order', args=['BTCUSDT', 0.5], dicts={})
+
+
+def compact_request(i: int) -> list:
+    return [TYPE_CODES[UtType.RPC], i, METHODS.index('place_order'), ['BTCUSDT', 0.5]]
+
+
+def server_roundtrip(codec, data, compact: bool, i: int):
+    """服务端解析请求，生成并编码响应"""
+    res = codec.loads(data)
+    request = create_compact_UtRequest(res, METHODS) if compact else create_UtRequest(res, res.get('id'))
+    response = UtResponse(id=request.id, state=UtState.SUCCESS, methodName=request.methodName,
+                          responseType=request.requestType, result=i, compact=request.compact)
+    return EncodedResponse(response).encoded(codec)
+
+
+def bench(codec, compact: bool, rounds: int):
+    data = codec.dumps(compact_request(1) if compact else full_request(1))
+    out = server_roundtrip(codec, data, compact, 1)
+    frames = [codec.dumps(compact_request(i) if compact else full_request(i)) for i in range(rounds)]
+    t = time.perf_counter()
+    for i, data in enumerate(frames):
+        server_roundtrip(codec, data, compact, i)
+    total = time.perf_counter() - t
+    mode = 'compact' if compact else 'full'
+    print(f'{codec.name:<8} {mode:<8} | request bytes:{len(data):>4} | response bytes:{len(out):>4} | us/request:{total/rounds*1e6:>7.2f}')
+
+
+def main(rounds: int = 50000):
+    for codec in (JSON, MSGPACK):
+        bench(codec, False, rounds)
+        bench(codec, True, rounds)
+
+
+if __name__ == '__main__':
+    main()
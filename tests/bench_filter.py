@@ -0,0 +1,59 @@
+"""
+# 订阅过滤器基准测试
+大量订阅者使用少量不同的过滤条件，条件相同的订阅者归为一组，每条消息每组只判断一次
+运行: python tests/bench_filter.py
+"""
+import os
+import time
+import asyncio
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.filter import Filter
+from utran.object import ClientConnection, SubscriptionContainer
+from utran.handler import publish_messages
+from aiohttp.web_ws import WebSocketResponse
+
+
+class NullWebSocket(WebSocketResponse):
+    """丢弃所有数据的websocket"""
+    async def send_str(self, data: str, compress=None) -> None:
+        pass
+
+
+class CountingFilter(Filter):
+    """统计过滤器的判断次数"""
+    __slots__ = ()
+    calls = 0
+
+    def __call__(self, msg) -> bool:
+        CountingFilter.calls += 1
+        return super().__call__(msg)
+
+
+async def bench(subscribers: int, symbols: int = 10, messages: int = 1000):
+    container = SubscriptionContainer()
+    connections = [ClientConnection(NullWebSocket(), queueMaxsize=messages) for _ in range(subscribers)]
+    for i, cc in enumerate(connections):
+        container.add_sub(cc, 'market.trade')
+        container.set_filter(cc.id, 'market.trade', CountingFilter({'symbol': f'S{i % symbols}', 'price': {'gte': 0}}))
+
+    batch = [('market.trade', dict(symbol=f'S{i % symbols}', price=i)) for i in range(messages)]
+    CountingFilter.calls = 0
+    t = time.perf_counter()
+    publish_messages(None, batch, container)
+    total = time.perf_counter() - t
+    pushed = sum(cc.pending for cc in connections)
+    for cc in connections:
+        cc.close()
+    print(f'subscribers:{subscribers:>6} | filter calls/msg:{CountingFilter.calls/messages:>5.1f} | '
+          f'pushed/msg:{pushed/messages:>7.1f} | total us/msg:{total/messages*1e6:>9.2f}')
+
+
+async def main():
+    for n in (10, 100, 1000, 10000):
+        await bench(n)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""
+# publish扇出基准测试
+每条消息只编码一次，编码次数和编码耗时不随订阅者数量增长
+运行: python tests/bench_publish.py
+"""
+import os
+import time
+import asyncio
+import ujson
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+import utran.object
+from utran.object import ClientConnection, SubscriptionContainer, UtRequest, UtType
+from utran.handler import process_publish_request
+from aiohttp.web_ws import WebSocketResponse
+
+
+class NullWebSocket(WebSocketResponse):
+    """丢弃所有数据的websocket"""
+    async def send_str(self, data: str, compress=None) -> None:
+        pass
+
+
+class CountingJson:
+    """统计编码次数和编码耗时"""
+    calls = 0
+    cost = 0.0
+
+    @classmethod
+    def dumps(cls, obj):
+        t = time.perf_counter()
+        s = ujson.dumps(obj)
+        cls.cost += time.perf_counter() - t
+        cls.calls += 1
+        return s
+
+
+async def bench(subscribers: int, messages: int = 100):
+    container = SubscriptionContainer()
+    connections = [ClientConnection(NullWebSocket()) for _ in range(subscribers)]
+    for cc in connections:
+        container.add_sub(cc, 'market.btc.trade')
+
+    msg = dict(symbol='BTC', price=30000.5, size=0.25, side='buy', ts=time.time())
+    CountingJson.calls = 0
+    CountingJson.cost = 0.0
+    t = time.perf_counter()
+    for i in range(messages):
+        await process_publish_request(UtRequest(i, UtType.PUBLISH, topics='market.btc.trade', msg=msg), container)
+    total = time.perf_counter() - t
+    for cc in connections:
+        cc.close()
+    print(f'subscribers:{subscribers:>6} | encodes/msg:{CountingJson.calls/messages:>5.1f} | '
+          f'encode us/msg:{CountingJson.cost/messages*1e6:>7.2f} | total us/msg:{total/messages*1e6:>10.2f}')
+
+
+async def main():
+    utran.object.ujson = CountingJson
+    for n in (1, 10, 100, 1000, 5000):
+        await bench(n)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
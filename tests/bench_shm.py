@@ -0,0 +1,52 @@
+"""
+# 共享内存传输基准测试
+进程池中执行的注册函数，对比参数和返回值通过执行器管道传递与通过共享内存传递的往返耗时
+运行: python tests/bench_shm.py
+"""
+import os
+import time
+import asyncio
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.register import Register
+from utran.worker import WorkerPool
+
+
+def echo(data: bytes):
+    return data
+
+
+async def bench(pool, rm, name: str, value, size: int, rounds: int):
+    await rm.execute((value,), {}, pool)
+    t = time.perf_counter()
+    for _ in range(rounds):
+        state, res, error = await rm.execute((value,), {}, pool)
+        assert not error, error
+    total = time.perf_counter() - t
+    mode = 'shm ' if rm.shmThreshold else 'pipe'
+    print(f'{name:<6} {size:>4} MB | {mode} | ms/round trip:{total/rounds*1e3:>9.2f}')
+
+
+async def main(workers: int = 2):
+    register = Register(checkParams=False, checkReturn=False)
+    register.rpc(echo, name='pipe_echo', useProcess=True, shmThreshold=None)
+    register.rpc(echo, name='shm_echo', useProcess=True)
+    register.rpc(echo, name='pipe_str', useProcess=True, shmThreshold=None)
+    register.rpc(echo, name='shm_str', useProcess=True)
+    pool = WorkerPool(workers, register.process_registry())
+    await pool.prewarm()
+
+    for size in (1, 10, 100):
+        data = os.urandom(size << 20)
+        rounds = max(3, 200 // size)
+        await bench(pool, register.methods_of_rpc['pipe_echo'], 'bytes', data, size, rounds)
+        await bench(pool, register.methods_of_rpc['shm_echo'], 'bytes', data, size, rounds)
+        text = 'x' * (size << 20)
+        await bench(pool, register.methods_of_rpc['pipe_str'], 'str', text, size, rounds)
+        await bench(pool, register.methods_of_rpc['shm_str'], 'str', text, size, rounds)
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
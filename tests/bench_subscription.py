@@ -0,0 +1,54 @@
+"""
+# SubscriptionContainer基准测试
+模拟10万个连接订阅、发布查询以及断线风暴(全部断开)
+运行: python tests/bench_subscription.py
+"""
+import os
+import time
+import random
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.object import ClientConnection, SubscriptionContainer
+
+
+def timeit(name: str, fn):
+    t = time.perf_counter()
+    res = fn()
+    print(f'{name:<28}{(time.perf_counter() - t) * 1000:>10.1f} ms')
+    return res
+
+
+def main(connections: int = 100_000, topics: int = 1000, topicsPerConnection: int = 5):
+    random.seed(0)
+    container = SubscriptionContainer()
+    all_topics = [f'market.sym{i}.trade' for i in range(topics)]
+    ccs = [ClientConnection(None) for _ in range(connections)]
+    subs = [random.sample(all_topics, topicsPerConnection) for _ in range(connections)]
+    print(f'connections:{connections} topics:{topics} topics/connection:{topicsPerConnection}')
+
+    def subscribe():
+        for cc, ts in zip(ccs, subs):
+            container.add_sub(cc, ts)
+    timeit('subscribe', subscribe)
+
+    def lookup():
+        for t in all_topics:
+            container.get_subId_by_topic(t)
+    timeit(f'lookup x{topics}', lookup)
+
+    def unsubscribe_half():
+        for cc, ts in zip(ccs[::2], subs[::2]):
+            container.remove_topic(cc.id, ts[:2])
+    timeit('unsubscribe 2 topics x50%', unsubscribe_half)
+
+    timeit('disconnect storm', lambda: container.del_subs([cc.id for cc in ccs]))
+    print('remaining topics:', len(container.topics))
+
+    timeit('bulk subscribe', lambda: container.add_subs(ccs, all_topics[:topicsPerConnection]))
+    timeit('bulk unsubscribe', lambda: container.remove_topics([cc.id for cc in ccs], all_topics[:topicsPerConnection]))
+    print('remaining topics:', len(container.topics))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+# TopicLog基准测试
+追加写入(批量写盘)和重启后读取的吞吐量，默认写入tmpfs(/dev/shm)
+运行: python tests/bench_topiclog.py [目录]
+"""
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.object import EncodedResponse, UtResponse, UtType, UtState
+from utran.topiclog import TopicLog
+
+
+async def main(root: str, messages: int = 200_000, topics: int = 10):
+    path = tempfile.mkdtemp(dir=root)
+    try:
+        log = TopicLog(path, segmentBytes=8*1024**2)
+        msg = dict(symbol='BTC', price=30000.5, size=0.25, side='buy')
+        frames = [EncodedResponse(UtResponse(id=None, responseType=UtType.PUBLISH, state=UtState.SUCCESS,
+                                             result=dict(topic=f'topic{i%topics}', msg=msg, seq=i//topics+1)))
+                  for i in range(messages)]
+        t = time.perf_counter()
+        for i, frame in enumerate(frames):
+            log.append(f'topic{i%topics}', i//topics+1, frame)
+        append = time.perf_counter() - t
+        await log.close()
+        total = time.perf_counter() - t
+        print(f'append  {messages/append:>12,.0f} msgs/s')
+        print(f'flush   {messages/total:>12,.0f} msgs/s (append+write)')
+
+        t = time.perf_counter()
+        log = TopicLog(path)
+        print(f'recover {(time.perf_counter()-t)*1000:>12.1f} ms')
+        t = time.perf_counter()
+        n = 0
+        for i in range(topics):
+            n += len(await log.read(f'topic{i}', 0))
+        print(f'read    {n/(time.perf_counter()-t):>12,.0f} msgs/s')
+        await log.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    root = os.sys.argv[1] if len(os.sys.argv) > 1 else ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+    asyncio.run(main(root))
@@ -0,0 +1,59 @@
+"""
+# 进程池调用基准测试
+对比每次调用序列化函数(类方法连同实例)并新建事件循环，与工作进程常驻注册函数和事件循环的单次调用耗时
+运行: python tests/bench_worker.py
+"""
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.utils import asyncfn_runner
+from utran.worker import WorkerPool
+from utran import worker
+
+
+class Model:
+    """带有较大状态的实例"""
+    def __init__(self, size: int) -> None:
+        self.table = list(range(size))
+
+    def lookup(self, i: int):
+        return self.table[i % len(self.table)]
+
+
+async def aadd(a: int, b: int):
+    return a + b
+
+
+async def bench(name: str, pool, make, calls: int = 2000, concurrency: int = 8):
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*[loop.run_in_executor(pool, make(i)) for i in range(concurrency)])
+    t = time.perf_counter()
+    for i in range(0, calls, concurrency):
+        await asyncio.gather(*[loop.run_in_executor(pool, make(i + j)) for j in range(concurrency)])
+    total = time.perf_counter() - t
+    print(f'{name:<28} | us/call:{total/calls*1e6:>9.1f}')
+
+
+async def main(workers: int = 4):
+    model = Model(200_000)
+    registry = {'rpc:lookup': model.lookup, 'rpc:aadd': aadd}
+
+    legacy = ProcessPoolExecutor(workers)
+    await bench('legacy bound method', legacy, lambda i: partial(model.lookup, i), calls=200)
+    await bench('legacy async function', legacy, lambda i: partial(asyncfn_runner, aadd, i, 1))
+    legacy.shutdown()
+
+    pool = WorkerPool(workers, registry)
+    await pool.prewarm()
+    await bench('worker bound method', pool, lambda i: partial(worker.call, 'rpc:lookup', (i,), {}), calls=200)
+    await bench('worker async function', pool, lambda i: partial(worker.call, 'rpc:aadd', (i, 1), {}))
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
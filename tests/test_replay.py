@@ -0,0 +1,61 @@
+"""
+# 重放测试
+重放的消息数量大于发送队列的长度`queueMaxsize`时，错过的消息不会被溢出策略丢弃，
+分别从内存中的重放缓冲区和服务重启后的话题日志重放
+运行: python tests/test_replay.py
+"""
+import os
+import shutil
+import asyncio
+import tempfile
+os.sys.path.append(os.path.abspath('./'))
+os.sys.path.append(os.path.abspath('../'))
+
+from utran.server import Server
+from utran.client.baseclient import BaseClient
+from utran.topiclog import TopicLog
+
+
+async def replay(server: Server, port: int, messages: int, expect: int):
+    """启动服务并发布`messages`条消息，新的订阅者从序号0开始重放，等待收到`expect`条消息"""
+    st = asyncio.create_task(server.start(port=port))
+    await asyncio.sleep(0.5)
+    for i in range(messages):
+        await server.publish(i, i, 'replay')
+
+    got = []
+    client = BaseClient(f'ws://127.0.0.1:{port}')
+    await client.start()
+    res = await client.subscribe('replay', lambda msg, topic: got.append(msg), lastSeq={'replay': 0})
+    for _ in range(50):
+        if len(got) >= expect:
+            break
+        await asyncio.sleep(0.1)
+    print('replay', res.get('replay'), 'received', len(got))
+    await client.exit()
+    server.exit()
+    await st
+    return res, got
+
+
+async def main(messages: int = 3000, port: int = 8082):
+    # 内存中的重放缓冲区
+    server = Server(workers=0, replaySize=5000, queueMaxsize=1024, overflowPolicy='disconnect')
+    res, got = await replay(server, port, messages, messages)
+    assert res['replay']['replay'] == dict(count=messages, complete=True), res
+    assert got == list(range(messages)), len(got)
+
+    # 话题日志，重启后从序号0开始重放
+    path = tempfile.mkdtemp()
+    try:
+        await replay(Server(workers=0, topicLog=TopicLog(path)), port+1, messages, messages)
+        server = Server(workers=0, queueMaxsize=1024, topicLog=TopicLog(path))
+        res, got = await replay(server, port+2, 0, messages)
+        assert res['replay']['replay'] == dict(count=messages, complete=True), res
+        assert got == list(range(messages)), len(got)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
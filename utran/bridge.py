@@ -0,0 +1,141 @@
+"""# 跨线程、跨进程发布
+`Server.publish`是协程，只能在服务所在的事件循环中调用。
+通过`publish`函数可以在任意线程以及进程池(useProcess=True)的工作进程中发布消息:
+
+    ```
+    from utran import Server
+    from utran.bridge import publish
+
+    server = Server()
+
+    @server.register.rpc(useProcess=True)
+    def compute(n:int):
+        for i in range(n):
+            publish(dict(progress=i),'compute.progress')
+        return n
+    ```
+
+消息先放入线程安全的缓冲区，再由事件循环批量取出推送；工作进程中的消息经由`multiprocessing.Queue`转发到服务所在的进程。
+"""
+import asyncio
+import threading
+import multiprocessing
+from collections import deque
+
+from utran.handler import publish_messages
+from utran.log import logger
+from utran.object import SubscriptionContainer
+
+
+_publisher = None      # 当前进程的发布函数，服务启动后或工作进程初始化时设置
+
+
+def publish(msg:any,*topics:str)->None:
+    """
+    # 发布消息，可以在任意线程和进程池的工作进程中调用，不等待推送完成
+    Args:
+        msg: 消息
+        topics: 话题
+    """
+    if _publisher is None:
+        raise RuntimeError('The server is not running, unable to publish.')
+    _publisher(msg,topics)
+
+
+def init_worker(queue)->None:
+    """进程池工作进程的初始化函数，将发布的消息转发到服务所在的进程"""
+    global _publisher
+    _publisher = lambda msg,topics: queue.put((msg,topics))
+
+
+class PublishBridge:
+    """# 发布桥
+    将其他线程和工作进程发布的消息转交给事件循环，事件循环每次最多取出`batchSize`条消息推送，
+    缓冲区不为空时只会唤醒一次事件循环
+    Args:
+        sub_container: 存放订阅者的容器实例
+        batchSize: 每批推送的最大消息数量，超过后让出控制权，避免阻塞事件循环
+    """
+    __slots__ = ('_sub_container','_batchSize','_buffer','_scheduled','_loop','_queue','_reader')
+
+    def __init__(self,sub_container:SubscriptionContainer,batchSize:int=1024) -> None:
+        self._sub_container = sub_container
+        self._batchSize = batchSize
+        self._buffer = deque()            # deque的append和popleft是线程安全的
+        self._scheduled = False
+        self._loop:asyncio.AbstractEventLoop = None
+        self._queue = None
+        self._reader:threading.Thread = None
+
+    @property
+    def queue(self):
+        """工作进程发布消息使用的队列"""
+        if self._queue is None:
+            self._queue = multiprocessing.Queue()
+        return self._queue
+
+    def start(self)->None:
+        """绑定当前的事件循环，并启动转发工作进程消息的线程"""
+        global _publisher
+        self._loop = asyncio.get_running_loop()
+        _publisher = self.put
+        if self._buffer and not self._scheduled:
+            self._scheduled = True
+            self._loop.call_soon(self.__drain)
+        if self._queue is not None and self._reader is None:
+            self._reader = threading.Thread(target=self.__read_queue,name='utran-publish-bridge',daemon=True)
+            self._reader.start()
+
+    def close(self)->None:
+        """停止转发线程，推送缓冲区中剩余的消息"""
+        global _publisher
+        if _publisher == self.put:
+            _publisher = None
+        if self._reader is not None:
+            self._queue.put(None)
+            self._reader.join(1)
+            self._reader = None
+        messages = []
+        while self._buffer:
+            msg,topics = self._buffer.popleft()
+            messages.extend((topic,msg) for topic in topics)
+        publish_messages(None,messages,self._sub_container)
+        self._loop = None
+
+    def put(self,msg:any,topics:tuple)->None:
+        """线程安全，将消息放入缓冲区"""
+        self._buffer.append((msg,topics))
+        if not self._scheduled and self._loop is not None:
+            self._scheduled = True
+            self._loop.call_soon_threadsafe(self.__drain)
+
+    def __drain(self)->None:
+        if self._loop is None:
+            return
+        buffer = self._buffer
+        messages = []
+        for _ in range(min(len(buffer),self._batchSize)):
+            msg,topics = buffer.popleft()
+            messages.extend((topic,msg) for topic in topics)
+        try:
+            # 整批一次推送，同一批次中每个话题的订阅者只查询一次
+            publish_messages(None,messages,self._sub_container)
+        except Exception as e:
+            logger.error(f'Publish error: {e}')
+        if buffer:
+            # 还有剩余的消息，让出控制权后继续
+            self._loop.call_soon(self.__drain)
+            return
+        self._scheduled = False
+        if buffer and not self._scheduled:
+            # 其他线程在重置标记前放入了消息
+            self._scheduled = True
+            self._loop.call_soon(self.__drain)
+
+    def __read_queue(self)->None:
+        queue = self._queue
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+            self.put(*item)
@@ -0,0 +1,122 @@
+"""# 结果缓存
+注册选项`cache=True`的函数会缓存执行结果，相同参数的调用直接返回缓存，适用于幂等的查询函数。
+缓存的是已经编码的json，命中时响应直接拼接该json，不再重复序列化。
+
+    ```
+    @server.register.rpc(cache=True,cacheTtl=10,cacheMaxsize=1024)
+    def get_price(symbol:str):
+        ...
+
+    server.register.invalidate_cache('get_price',('BTC',))   # 删除指定参数的缓存
+    server.register.invalidate_cache('get_price')            # 删除全部缓存
+    ```
+"""
+import time
+import inspect
+from collections import OrderedDict
+from typing import Union
+import ujson
+
+
+class RawJson(str):
+    """# 已编码的json
+    作为响应结果时不再序列化，直接拼接到响应中
+    Attributes:
+        value: 编码前的值
+    """
+
+    def __new__(cls,text:str,value:any=None):
+        obj = super().__new__(cls,text)
+        obj.value = value
+        return obj
+
+
+def dumps_with_raw(d:dict,key:str='result')->str:
+    """# 编码字典，其中`key`的值为RawJson时直接拼接
+    `key`必须是字典的最后一项
+    """
+    raw = d.get(key)
+    if not isinstance(raw,RawJson):
+        return ujson.dumps(d)
+    d[key] = None
+    text = ujson.dumps(d)
+    d[key] = raw
+    tail = f'"{key}":null}}'
+    if not text.endswith(tail):
+        d = dict(d)
+        d[key] = raw.value
+        return ujson.dumps(d)
+    return text[:-len('null}')]+raw+'}'
+
+
+class ResultCache:
+    """# LRU结果缓存
+    Args:
+        maxsize: 最多缓存的结果数量，超过后淘汰最久未使用的结果
+        ttl: 缓存的有效时间(单位:秒)，为None时不过期
+    """
+    __slots__ = ('maxsize','ttl','hits','misses','_data')
+
+    def __init__(self,maxsize:int=1024,ttl:float=None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data:OrderedDict = OrderedDict()       # {key:(过期时间,RawJson)}
+
+    def __len__(self)->int:
+        return len(self._data)
+
+    @staticmethod
+    def make_key(signature:inspect.Signature,args:tuple,dicts:dict)->Union[str,None]:
+        """# 生成缓存的键
+        参数按函数签名绑定并填充默认值，位置参数和关键字参数的不同写法得到相同的键。参数无法绑定或编码时返回None
+        """
+        try:
+            bound = signature.bind(*args,**dicts)
+            bound.apply_defaults()
+            return ujson.dumps(bound.arguments,sort_keys=True)
+        except (TypeError,ValueError,OverflowError):
+            return None
+
+    def get(self,key:str)->Union[RawJson,None]:
+        """获取缓存，不存在或已过期时返回None"""
+        item = self._data.get(key)
+        if item is not None:
+            expire,value = item
+            if expire is None or expire > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return None
+
+    def put(self,key:str,result:any)->any:
+        """# 缓存结果
+        Returns:
+            返回已编码的RawJson，结果无法编码为json时不缓存，返回原结果
+        """
+        if isinstance(result,RawJson):
+            value = result
+        else:
+            try:
+                value = RawJson(ujson.dumps(result),result)
+            except (TypeError,OverflowError):
+                return result
+        self._data[key] = (time.monotonic()+self.ttl if self.ttl else None,value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        return value
+
+    def invalidate(self,key:str=None)->None:
+        """删除指定键的缓存，key为None时删除全部缓存"""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key,None)
+
+    def stats(self)->dict:
+        """缓存状态 {'size':缓存数量,'hits':命中次数,'misses':未命中次数}"""
+        return dict(size=len(self._data),hits=self.hits,misses=self.misses)
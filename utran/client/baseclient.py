@@ -2,8 +2,11 @@ from typing import Any,Union
 import aiohttp
 import asyncio
 
-from utran.object import UtType, gen_requestId
+from utran.object import UtType, UtState, TYPE_CODES, gen_requestId, expand_compact_response
+from utran.topic import TopicTrie, is_pattern
 from utran.log import logger
+from utran import codec as codecs
+from utran.codec import Codec
 
 
 
@@ -17,9 +20,12 @@ class BaseClient:
         max_msg_size: 表示接收消息的最大大小（以字节为单位）。如果接收到的消息大小超过该值，则会引发异常。
         username: 用户名
         password: 密码
+        codec: 首选的编解码器名称，见`utran.codec`，服务端不支持时使用json
+        compact: 是否使用紧凑格式发送rpc请求，连接时获取方法名称表，请求使用数组和方法编号代替字典和方法名称
     """
-    __slots__ = ('_url','_session','_ws','_rpc_requests','_isclosed','_maxReconnectNum','_reconnect_attempts','_topics_handler','_ignore',
-                 '_exitEvent','_compress','_max_msg_size','_receive_task','__auth')
+    __slots__ = ('_url','_session','_ws','_rpc_requests','_isclosed','_maxReconnectNum','_reconnect_attempts','_topics_handler','_topics_trie','_ignore',
+                 '_exitEvent','_compress','_max_msg_size','_receive_task','__auth','_topics_seq','_maxRate','_topics_filter','_map_streams',
+                 '_codec','_preferCodec','_compact','_methodIds')
     def __init__(self,
                  url:str='ws://localhost:8080',
                  maxReconnectNum:int=10,
@@ -27,20 +33,31 @@ class BaseClient:
                  compress: int = 0,
                  max_msg_size: int = 4 * 1024 * 1024,
                  username:str=None,
-                 password:str=None) -> None:
+                 password:str=None,
+                 codec:str='json',
+                 compact:bool=False) -> None:
         self._url = url
         self._session:aiohttp.ClientSession = None
         self._ws:aiohttp.ClientWebSocketResponse = None
         self._rpc_requests = dict()
+        self._map_streams = dict()                                      # {请求id:asyncio.Queue}，map请求的流式响应
         self._isclosed:int = -1       # -1表示还未初始化，0表示已连接，1表示断开连接
         self._maxReconnectNum = maxReconnectNum
         self._reconnect_attempts = 0
         self._topics_handler = dict()
+        self._topics_trie = TopicTrie()                                 # 订阅的通配符话题
+        self._topics_seq = dict()                                       # {话题:最后收到的消息序号}，用于断线重连后获取错过的消息
+        self._topics_filter = dict()                                    # {话题:过滤条件}
+        self._maxRate:float = None
         self._ignore = ignore
         self._exitEvent = asyncio.Event()                               # 用于等待退出
         self._compress = compress
         self._max_msg_size = max_msg_size
         self._receive_task = None
+        self._preferCodec:Codec = codecs.get_codec(codec)
+        self._codec:Codec = codecs.JSON                                 # 连接时协商的编解码器
+        self._compact = compact
+        self._methodIds = dict()                                        # {方法名称:方法编号}，连接时握手获取
 
 
         if username!=None or password!=None:
@@ -69,7 +86,7 @@ class BaseClient:
             items = self._topics_handler.items()
             topics = [k for k,v in items]
             callbacks = [v for k,v in items]
-            await self.subscribe(topics,callbacks,ignore=True)
+            await self.subscribe(topics,callbacks,ignore=True,maxRate=self._maxRate,lastSeq=dict(self._topics_seq),filters=dict(self._topics_filter))
             logger.success(f"已重新订阅话题: {topics}.")
             self._exitEvent.clear()
 
@@ -81,15 +98,32 @@ class BaseClient:
 
 
     async def connect(self):
-        self._ws = await self._session.ws_connect(self._url,compress=self._compress,max_msg_size=self._max_msg_size,auth=self.__auth)        
+        # 方法编号只对握手的那个连接有效，重连后在新的方法名称表返回之前使用完整格式
+        self._methodIds = dict()
+        protocols = tuple(dict.fromkeys((self._preferCodec.subprotocol,codecs.JSON.subprotocol)))
+        self._ws = await self._session.ws_connect(self._url,compress=self._compress,max_msg_size=self._max_msg_size,auth=self.__auth,protocols=protocols)        
         msg = await self._ws.receive()
-        if msg.data != 'ok':
+        # 服务端以bytes发送'ok'，同时兼容以str发送的服务端
+        if msg.data not in (b'ok','ok'):
             await self.exit()
             raise ConnectionError(msg.data)
+        self._codec = codecs.from_subprotocol(self._ws.protocol)
             
         logger.success(f"连接成功.")
         self._receive_task = asyncio.create_task(self.__receive())  
         self._isclosed = 0
+        if self._compact:
+            await self.__handshake_methods()
+
+
+    async def __handshake_methods(self):
+        """获取服务端的方法名称表，失败时使用完整格式"""
+        try:
+            response = await self._send(dict(id=gen_requestId(),requestType=UtType.METHODS.value),timeout=5)
+            self._methodIds = {name:i for i,name in enumerate(response.get('result') or [])}
+        except Exception as e:
+            self._methodIds = dict()
+            logger.warning(f'获取方法名称表失败，使用完整格式: {e}')
 
 
     async def _reconnecting(self):
@@ -119,46 +153,78 @@ class BaseClient:
         # print('接收开启')
         while True:
             msg = await self._ws.receive()
-            if msg.type == aiohttp.WSMsgType.TEXT:
-                response:dict = msg.json()
+            if msg.type == aiohttp.WSMsgType.TEXT or msg.type == aiohttp.WSMsgType.BINARY:
+                # TEXT帧始终为json，BINARY帧使用协商的编解码器
+                response:dict = msg.json() if msg.type == aiohttp.WSMsgType.TEXT else self._codec.loads(msg.data)
+                if type(response) == list:
+                    # 紧凑格式的rpc响应
+                    response = expand_compact_response(response)
                 if response['responseType'] == UtType.PUBLISH.value:
-                    asyncio.create_task(self._handler_publish(**response.get('result')))
-                elif response['responseType'] in [UtType.RPC.value,UtType.SUBSCRIBE.value,UtType.UNSUBSCRIBE.value]:
-                    request_id = response['id']
-                    future,request = self._rpc_requests.pop(request_id)
-                    future.set_result(response)
+                    result:dict = response.get('result')
+                    seq = result.pop('seq',None)
+                    if seq is not None:
+                        self._topics_seq[result['topic']] = seq
+                    asyncio.create_task(self._handler_publish(**result))
+                elif response['responseType'] == UtType.MAP.value:
+                    queue = self._map_streams.get(response['id'])
+                    if queue is not None:
+                        queue.put_nowait(response)
+                elif response['responseType'] in [UtType.RPC.value,UtType.SUBSCRIBE.value,UtType.UNSUBSCRIBE.value,UtType.METHODS.value]:
+                    # 本地等待超时的请求已经移除，忽略其响应
+                    item = self._rpc_requests.pop(response['id'],None)
+                    if item is not None and not item[0].done():
+                        item[0].set_result(response)
 
             elif msg.type == aiohttp.WSMsgType.CLOSED:
                 break
+
+        # 断线后map请求的流式响应无法继续
+        for queue in self._map_streams.values():
+            queue.put_nowait(ConnectionResetError('disconnection'))
         
         if self._isclosed==0:
             asyncio.create_task(self._reconnecting())
         # print('接收关闭')
 
 
-    async def _send(self,request:dict,timeout:int=None)->dict:
+    async def _send(self,request:dict,timeout:int=None,frame:list=None)->dict:
+        """发送请求并等待响应，frame为紧凑格式时发送frame"""
         try:
-            await self._ws.send_json(request)
+            await self.__send_frame(request if frame is None else frame)
         except Exception as e:
             # logger.error(e)
             pass
         futrue = asyncio.Future()
         self._rpc_requests[request['id']] = (futrue,request)
-        response = await asyncio.wait_for(futrue,timeout)
+        try:
+            response = await asyncio.wait_for(futrue,timeout)
+        except asyncio.TimeoutError:
+            # 本地等待超时，通知服务端取消执行，不再重发该请求
+            self._rpc_requests.pop(request['id'],None)
+            if request.get('requestType') == UtType.RPC.value:
+                if frame is None:
+                    await self.__send_nowait(dict(id=request['id'],requestType=UtType.CANCEL.value))
+                else:
+                    await self.__send_nowait([TYPE_CODES[UtType.CANCEL],request['id']])
+            raise
         return response
     
 
 
     async def _handler_publish(self,topic:str,msg:any):
-        """处理话题推流"""
+        """处理话题推流，话题本身以及匹配该话题的通配符话题的回调都会被调用"""
+        callbacks = []
         callback =  self._topics_handler.get(topic)
-        if not callable:            
-            # print(f"推送【{topic}】话题:",msg)
-            return
-        if asyncio.iscoroutinefunction(callback):
-            await callback(msg,topic)                
-        else:
-            callback(msg,topic)
+        if callback:
+            callbacks.append(callback)
+        for pattern in self._topics_trie.match(topic):
+            callbacks.append(self._topics_handler[pattern])
+
+        for callback in callbacks:
+            if asyncio.iscoroutinefunction(callback):
+                await callback(msg,topic)                
+            else:
+                callback(msg,topic)
 
 
     async def subscribe(self,
@@ -166,14 +232,22 @@ class BaseClient:
                         callback:callable,
                         *,
                         timeout:int=None,
-                        ignore:bool=None)->dict:
+                        ignore:bool=None,
+                        maxRate:float=None,
+                        lastSeq:dict=None,
+                        filter:dict=None,
+                        filters:dict=None)->dict:
         """# 订阅话题
         存在订阅的话题时，程序会一直等待话题的推送，无订阅话题时程序在执行完入口函数`main`后自动退出
         Args:
-            topic: 话题
+            topic: 话题，支持通配符 `*`匹配一个层级，`#`匹配零个或多个层级，例如 `market.*.trade`、`market.#`
             callback: 回调函数，有两个参数 msg,topic。支持异步和同步回调函数, 
             timeout: 本地等待响应超时，抛出TimeoutError错误（单位：秒）
             ignore: 是否忽略远程执行结果的错误，忽略错误则值用None填充
+            maxRate: 可选，服务端开启了合并推送(conflate)的话题，每秒最多推送的消息数量
+            lastSeq: 可选，每个话题最后收到的消息序号 {话题:序号}，服务端开启了重放缓冲区时会推送该序号之后的消息。断线重连时会自动携带
+            filter: 可选，本次订阅的所有话题使用的过滤条件，服务端只推送满足条件的消息，例如 `{'symbol':'BTC','price':{'gte':100}}`，见`utran.filter`
+            filters: 可选，为每个话题分别指定过滤条件 {话题:过滤条件}，优先于`filter`
         
         Returns:
             {'allTopics': ['topic1','topic2'], 'subTopics': ['topic2']}
@@ -197,19 +271,33 @@ class BaseClient:
             if not callable(c):
                 raise ValueError(f'Subscribe Error "{type(c)}" is not callable!')
             
+            if is_pattern(t):
+                self._topics_trie.add(t)
             self._topics_handler[t] = c
 
+        filters = dict((t,filters[t] if filters and t in filters else filter) for t in topic)
+        for t,f in filters.items():
+            if f: self._topics_filter[t] = f
+            else: self._topics_filter.pop(t,None)
+
         request = dict(id=gen_requestId(),requestType=UtType.SUBSCRIBE.value,topics=topic)
+        if maxRate:
+            request['maxRate'] = self._maxRate = maxRate
+        if lastSeq:
+            request['lastSeq'] = lastSeq
+        filters = dict((t,f) for t,f in filters.items() if f)
+        if filters:
+            request['filters'] = filters
         try:
             response:dict = await self._send(request,timeout=timeout)
         except Exception as e:
             if str(e)=='disconnection':
-                return await self.subscribe(topic,callback,timeout=timeout,ignore=ignore)
+                return await self.subscribe(topic,callback,timeout=timeout,ignore=ignore,maxRate=maxRate,lastSeq=lastSeq,filters=filters)
             else:
                 raise e
         
         ignore = self._ignore if ignore== None else ignore
-        if response.get('state') or ignore:
+        if response.get('state') == UtState.SUCCESS.value or ignore:
             self._exitEvent.clear()
             result:dict = response.get('result')    
             logger.success(f'成功订阅:{result.get("subTopics")}')
@@ -237,6 +325,9 @@ class BaseClient:
         """
         if topic:
             [self._topics_handler.pop(t) for t in topic if t in self._topics_handler]              
+            [self._topics_trie.remove(t) for t in topic if is_pattern(t)]
+            [self._topics_seq.pop(t) for t in topic if t in self._topics_seq]
+            [self._topics_filter.pop(t) for t in topic if t in self._topics_filter]
 
         request = dict(id=gen_requestId(),requestType=UtType.UNSUBSCRIBE.value,topics=topic)
 
@@ -249,7 +340,7 @@ class BaseClient:
                 raise e
             
         ignore = self._ignore if ignore== None else ignore
-        if response.get('state') or ignore:
+        if response.get('state') == UtState.SUCCESS.value or ignore:
             result:dict = response.get('result')
             if result!=None:logger.success(f'取消订阅:{result.get("unSubTopics")}')
             if not self._topics_handler:
@@ -260,6 +351,56 @@ class BaseClient:
 
     
 
+    async def publish(self,msg:any,*topics:str)->bool:
+        """# 发布消息
+        不等待服务端的响应(fire-and-forget)，服务端不会返回发布结果
+        Args:
+            msg: 消息
+            topics: 话题，不能为通配符话题
+
+        Returns:
+            消息是否已发送
+        """
+        request = dict(id=gen_requestId(),requestType=UtType.PUBLISH.value,topics=topics,msg=msg)
+        return await self.__send_nowait(request)
+
+
+    async def publish_many(self,messages:Union[dict,list[tuple[str,any]]],*,batchSize:int=1000)->bool:
+        """# 批量发布消息
+        每`batchSize`条消息合并为一个multipublish请求发送，不等待服务端的响应(fire-and-forget)
+        Args:
+            messages: [(话题,消息),...] 或者 {话题:消息}
+            batchSize: 每个请求最多携带的消息数量
+
+        Returns:
+            消息是否全部已发送
+        """
+        if type(messages) == dict:
+            messages = list(messages.items())
+        ok = True
+        for i in range(0,len(messages),batchSize):
+            request = dict(id=gen_requestId(),requestType=UtType.MULTIPUBLISH.value,messages=messages[i:i+batchSize])
+            ok = await self.__send_nowait(request) and ok
+        return ok
+
+
+    async def __send_frame(self,request:Union[dict,list]):
+        """使用协商的编解码器编码并发送请求"""
+        if self._codec.binary:
+            await self._ws.send_bytes(self._codec.dumps(request))
+        else:
+            await self._ws.send_str(self._codec.dumps(request))
+
+
+    async def __send_nowait(self,request:Union[dict,list])->bool:
+        try:
+            await self.__send_frame(request)
+            return True
+        except Exception as e:
+            logger.warning(f'发送失败:{e}')
+            return False
+
+
     async def call(self,
                    methodName:str,
                    args:list=tuple(),
@@ -282,21 +423,91 @@ class BaseClient:
         if multicall:
             return request,timeout,ignore
         else:
+            frame = None
+            methodId = self._methodIds.get(methodName) if self._compact else None
+            if methodId is not None:
+                frame = [TYPE_CODES[UtType.RPC],request['id'],methodId,args]
+                if dicts:
+                    frame.append(dicts)
             try:
-                response:dict = await self._send(request,timeout=timeout)
+                response:dict = await self._send(request,timeout=timeout,frame=frame)
             except Exception as e:
                 if str(e)=='disconnection':
                     return await self.call(methodName,args,dicts,timeout=timeout,ignore=ignore)
                 else:
                     raise e
                 
-            if response.get('state') or ignore:
+            if response.get('state') == UtState.SUCCESS.value or ignore:
                 return response.get('result')
             else:
                 raise RuntimeError(f"Response '{response.get('responseType')}' Error，"+response.get('error'))
 
 
 
+    async def imap(self,
+                   methodName:str,
+                   iterable,
+                   *,
+                   chunksize:int=None,
+                   timeout:int=None):
+        """# 并行map，异步生成器
+        参数列表通过一个map请求发送，服务端划分为多组并行执行，按顺序流式返回结果，
+        每组结果到达后即可迭代，不需要等待全部执行完成。提前结束迭代时通知服务端取消执行
+        Args:
+            methodName: 远程的方法或函数的名称
+            iterable: 参数，每个元素作为一次调用的唯一参数
+            chunksize: 每组参数的数量，为None时由服务端按进程数量划分
+            timeout: 本地等待每组结果的超时，抛出TimeoutError错误（单位：秒）
+
+        Yields:
+            按顺序返回每个参数的执行结果
+        """
+        request = dict(id=gen_requestId(),requestType=UtType.MAP.value,methodName=methodName,items=list(iterable))
+        if chunksize:
+            request['chunksize'] = chunksize
+        queue = asyncio.Queue()
+        self._map_streams[request['id']] = queue
+        done = False
+        try:
+            if not await self.__send_nowait(request):
+                raise ConnectionError(f'The map request of "{methodName}" could not be sent')
+            while not done:
+                response = await asyncio.wait_for(queue.get(),timeout)
+                if isinstance(response,Exception):
+                    raise response
+                if response.get('state') != UtState.SUCCESS.value:
+                    done = True
+                    raise RuntimeError(f"Response '{response.get('responseType')}' Error，"+response.get('error'))
+                result:dict = response.get('result')
+                done = result.get('done')
+                for r in result.get('results'):
+                    yield r
+        finally:
+            self._map_streams.pop(request['id'],None)
+            if not done:
+                await self.__send_nowait(dict(id=request['id'],requestType=UtType.CANCEL.value))
+
+
+    async def map(self,
+                  methodName:str,
+                  iterable,
+                  *,
+                  chunksize:int=None,
+                  timeout:int=None)->list:
+        """# 并行map
+        参数列表通过一个map请求发送，服务端划分为多组，进程中执行的注册函数分布到进程池的所有工作进程执行
+        Args:
+            methodName: 远程的方法或函数的名称
+            iterable: 参数，每个元素作为一次调用的唯一参数
+            chunksize: 每组参数的数量，为None时由服务端按进程数量划分
+            timeout: 本地等待每组结果的超时，抛出TimeoutError错误（单位：秒）
+
+        Returns:
+            执行结果按顺序放在列表中返回
+        """
+        return [r async for r in self.imap(methodName,iterable,chunksize=chunksize,timeout=timeout)]
+
+
     async def multicall(self,*calls,retransmitFull:bool=False)->list:
         """# 合并多次调用远程方法或函数
         Args:
@@ -333,7 +544,7 @@ class BaseClient:
                     raise response
             else:
                 # 处理成功响应
-                if response.get('state') or ignore:
+                if response.get('state') == UtState.SUCCESS.value or ignore:
                     success.append(response.get('result'))
                 else:
                     raise RuntimeError(f"Response '{response.get('responseType')}' Error，"+response.get('error'))
@@ -77,6 +77,8 @@ class Client:
         username: 用户名
         password: 密码
         loop: 指定事件循环
+        codec: 首选的编解码器名称，见`utran.codec`，服务端不支持时使用json
+        compact: 是否使用紧凑格式发送rpc请求
     """
     __slots__ = ('_loop','_thread','_bsclient','_is_loop_autogen')
     
@@ -88,9 +90,11 @@ class Client:
                  max_msg_size: int = 4 * 1024 * 1024, 
                  username: str = None, 
                  password: str = None,
-                 loop:asyncio.AbstractEventLoop = None) -> None:
+                 loop:asyncio.AbstractEventLoop = None,
+                 codec: str = 'json',
+                 compact: bool = False) -> None:
         
-        self._bsclient = BaseClient(url, maxReconnectNum, ignore, compress, max_msg_size, username, password)
+        self._bsclient = BaseClient(url, maxReconnectNum, ignore, compress, max_msg_size, username, password, codec, compact)
         self._loop:asyncio.AbstractEventLoop = loop
         self._is_loop_autogen = False
 
@@ -175,16 +179,20 @@ class Client:
                 callback:callable,
                 *,
                 timeout:int=None,
-                ignore:bool=None)->Union[Coroutine,dict]:
+                ignore:bool=None,
+                maxRate:float=None,
+                filter:dict=None)->Union[Coroutine,dict]:
         """# 订阅话题
         支持同步和异步的调用，
         存在订阅的话题时，程序会一直等待话题的推送，无订阅话题时程序在执行完入口函数`main`后自动退出
         
         Args:
-            topic: 话题
+            topic: 话题，支持通配符 `*`匹配一个层级，`#`匹配零个或多个层级，例如 `market.*.trade`、`market.#`
             callback: 回调函数，有两个参数 msg,topic。支持异步和同步回调函数, 
             timeout: 本地等待响应超时，抛出TimeoutError错误（单位：秒）
             ignore: 是否忽略远程执行结果的错误，忽略错误则值用None填充
+            maxRate: 可选，服务端开启了合并推送(conflate)的话题，每秒最多推送的消息数量
+            filter: 可选，过滤条件，服务端只推送满足条件的消息，例如 `{'symbol':'BTC','price':{'gte':100}}`
         
         Returns:
             {'allTopics': ['topic1','topic2'], 'subTopics': ['topic2']}
@@ -196,7 +204,7 @@ class Client:
         if not self._has_start():
             logger.warning(f'程序已经关闭,无法执行:"subscribe"方法')
             return
-        coro = self._bsclient.subscribe(topic=topic,callback=callback,timeout=timeout,ignore=ignore)
+        coro = self._bsclient.subscribe(topic=topic,callback=callback,timeout=timeout,ignore=ignore,maxRate=maxRate,filter=filter)
         if self._loop:
             return self._use_sync(coro)
         else:
@@ -233,6 +241,68 @@ class Client:
     
 
 
+    def publish(self,msg:any,*topics:str)->Union[Coroutine,bool]:
+        """# 发布消息
+        支持同步和异步的调用，不等待服务端的响应
+        Args:
+            msg: 消息
+            topics: 话题，不能为通配符话题
+
+        Returns:
+            消息是否已发送
+        """
+        if not self._has_start():
+            logger.warning(f'程序已经关闭,无法执行:"publish"方法')
+            return
+        coro = self._bsclient.publish(msg,*topics)
+        if self._loop:
+            return self._use_sync(coro)
+        else:
+            return coro
+
+
+    def publish_many(self,messages:Union[dict,list],*,batchSize:int=1000)->Union[Coroutine,bool]:
+        """# 批量发布消息
+        支持同步和异步的调用，每`batchSize`条消息合并为一个请求发送，不等待服务端的响应
+        Args:
+            messages: [(话题,消息),...] 或者 {话题:消息}
+            batchSize: 每个请求最多携带的消息数量
+
+        Returns:
+            消息是否全部已发送
+        """
+        if not self._has_start():
+            logger.warning(f'程序已经关闭,无法执行:"publish_many"方法')
+            return
+        coro = self._bsclient.publish_many(messages,batchSize=batchSize)
+        if self._loop:
+            return self._use_sync(coro)
+        else:
+            return coro
+
+
+    def map(self,methodName:str,iterable,*,chunksize:int=None,timeout:int=None)->Union[list,Coroutine]:
+        """# 并行map
+        支持同步和异步的调用，参数列表通过一个请求发送，服务端划分为多组并行执行，异步迭代结果请使用`BaseClient.imap`
+        Args:
+            methodName: 远程的方法或函数的名称
+            iterable: 参数，每个元素作为一次调用的唯一参数
+            chunksize: 每组参数的数量，为None时由服务端按进程数量划分
+            timeout: 本地等待每组结果的超时，抛出TimeoutError错误（单位：秒）
+
+        Returns:
+            执行结果按顺序放在列表中返回
+        """
+        if not self._has_start():
+            logger.warning(f'程序已经关闭,无法执行:"map"方法')
+            return
+        coro = self._bsclient.map(methodName,iterable,chunksize=chunksize,timeout=timeout)
+        if self._loop:
+            return self._use_sync(coro)
+        else:
+            return coro
+
+
     def multicall(self,*calls:Coroutine,retransmitFull:bool=False)->Union[list,Coroutine]:
         """# 合并多次调用远程方法或函数
         支持同步和异步的调用，
@@ -0,0 +1,280 @@
+"""# 编解码器
+websocket连接使用的序列化格式，建立连接时通过websocket子协议协商，每个连接可以使用不同的编解码器:
+
+|编解码器|子协议|帧类型|说明|
+|-|-|-|-|
+|json|`utran.json`|TEXT|默认，使用ujson|
+|msgpack|`utran.msgpack`|BINARY|安装了`msgpack`时使用其C扩展，否则使用纯Python实现|
+
+客户端按优先顺序提供子协议，服务端选择第一个支持的编解码器，未提供子协议时使用json。
+纯Python实现的msgpack编码结果更小，但编解码耗时明显高于ujson，只建议在带宽受限时使用，见`tests/bench_codec.py`。
+可以通过`register_codec`注册新的编解码器:
+
+    ```
+    client = BaseClient(codec='msgpack')
+    ```
+"""
+import struct
+from abc import ABC, abstractmethod
+from typing import Union
+import ujson
+
+try:
+    import msgpack as _msgpack
+except ImportError:
+    _msgpack = None
+
+
+SUBPROTOCOL_PREFIX = 'utran.'
+
+
+class Codec(ABC):
+    """# 编解码器基类
+    Attributes:
+        name: 名称，子协议为`utran.名称`
+        binary: 编码结果是否为bytes，是则使用BINARY帧发送，否则使用TEXT帧发送
+    """
+    __slots__ = ()
+    name:str = ''
+    binary:bool = False
+
+    @property
+    def subprotocol(self)->str:
+        return SUBPROTOCOL_PREFIX+self.name
+
+    @abstractmethod
+    def dumps(self,obj)->Union[str,bytes]:
+        """编码"""
+
+    @abstractmethod
+    def loads(self,data:Union[str,bytes]):
+        """解码"""
+
+    def __repr__(self) -> str:
+        return f'<Codec {self.name}>'
+
+
+class JsonCodec(Codec):
+    """json编解码器"""
+    __slots__ = ()
+    name = 'json'
+    binary = False
+
+    def dumps(self,obj)->str:
+        return ujson.dumps(obj)
+
+    def loads(self,data:Union[str,bytes]):
+        return ujson.loads(data)
+
+
+def _pack(obj,buf:bytearray)->None:
+    """纯Python的msgpack编码"""
+    t = type(obj)
+    if obj is None:
+        buf.append(0xc0)
+    elif t == bool:
+        buf.append(0xc3 if obj else 0xc2)
+    elif t == int:
+        if 0 <= obj < 0x80:
+            buf.append(obj)
+        elif -0x20 <= obj < 0:
+            buf.append(obj & 0xff)
+        elif 0 <= obj <= 0xffffffffffffffff:
+            if obj <= 0xff:
+                buf += struct.pack('>BB',0xcc,obj)
+            elif obj <= 0xffff:
+                buf += struct.pack('>BH',0xcd,obj)
+            elif obj <= 0xffffffff:
+                buf += struct.pack('>BI',0xce,obj)
+            else:
+                buf += struct.pack('>BQ',0xcf,obj)
+        elif -0x8000000000000000 <= obj < 0:
+            if obj >= -0x80:
+                buf += struct.pack('>Bb',0xd0,obj)
+            elif obj >= -0x8000:
+                buf += struct.pack('>Bh',0xd1,obj)
+            elif obj >= -0x80000000:
+                buf += struct.pack('>Bi',0xd2,obj)
+            else:
+                buf += struct.pack('>Bq',0xd3,obj)
+        else:
+            raise OverflowError(f'Integer {obj} is out of the msgpack range')
+    elif t == float:
+        buf += struct.pack('>Bd',0xcb,obj)
+    elif isinstance(obj,str):
+        data = obj.encode('utf-8')
+        n = len(data)
+        if n < 32:
+            buf.append(0xa0|n)
+        elif n <= 0xff:
+            buf += struct.pack('>BB',0xd9,n)
+        elif n <= 0xffff:
+            buf += struct.pack('>BH',0xda,n)
+        else:
+            buf += struct.pack('>BI',0xdb,n)
+        buf += data
+    elif t in (bytes,bytearray,memoryview):
+        n = len(obj)
+        if n <= 0xff:
+            buf += struct.pack('>BB',0xc4,n)
+        elif n <= 0xffff:
+            buf += struct.pack('>BH',0xc5,n)
+        else:
+            buf += struct.pack('>BI',0xc6,n)
+        buf += obj
+    elif t in (list,tuple):
+        n = len(obj)
+        if n < 16:
+            buf.append(0x90|n)
+        elif n <= 0xffff:
+            buf += struct.pack('>BH',0xdc,n)
+        else:
+            buf += struct.pack('>BI',0xdd,n)
+        for v in obj:
+            _pack(v,buf)
+    elif isinstance(obj,dict):
+        n = len(obj)
+        if n < 16:
+            buf.append(0x80|n)
+        elif n <= 0xffff:
+            buf += struct.pack('>BH',0xde,n)
+        else:
+            buf += struct.pack('>BI',0xdf,n)
+        for k,v in obj.items():
+            _pack(k,buf)
+            _pack(v,buf)
+    elif isinstance(obj,int):
+        _pack(int(obj),buf)
+    elif isinstance(obj,float):
+        _pack(float(obj),buf)
+    elif isinstance(obj,(list,tuple)):
+        _pack(list(obj),buf)
+    else:
+        raise TypeError(f'{obj!r} is not msgpack serializable')
+
+
+_FIXED = {
+    0xcc:('>B',1),0xcd:('>H',2),0xce:('>I',4),0xcf:('>Q',8),
+    0xd0:('>b',1),0xd1:('>h',2),0xd2:('>i',4),0xd3:('>q',8),
+    0xca:('>f',4),0xcb:('>d',8),
+}
+_SIZED = {
+    0xd9:('>B',1),0xda:('>H',2),0xdb:('>I',4),      # str
+    0xc4:('>B',1),0xc5:('>H',2),0xc6:('>I',4),      # bin
+}
+
+
+def _unpack(data:bytes,i:int)->tuple:
+    """纯Python的msgpack解码，返回 (对象,下一个位置)"""
+    b = data[i]
+    i += 1
+    if b <= 0x7f:
+        return b,i
+    if b >= 0xe0:
+        return b-0x100,i
+    if 0xa0 <= b <= 0xbf:
+        n = b & 0x1f
+        return data[i:i+n].decode('utf-8'),i+n
+    if 0x90 <= b <= 0x9f:
+        return _unpack_array(data,i,b & 0x0f)
+    if 0x80 <= b <= 0x8f:
+        return _unpack_map(data,i,b & 0x0f)
+    if b == 0xc0:
+        return None,i
+    if b == 0xc2:
+        return False,i
+    if b == 0xc3:
+        return True,i
+    if b in _FIXED:
+        fmt,size = _FIXED[b]
+        return struct.unpack_from(fmt,data,i)[0],i+size
+    if b in _SIZED:
+        fmt,size = _SIZED[b]
+        n = struct.unpack_from(fmt,data,i)[0]
+        i += size
+        raw = data[i:i+n]
+        return (raw.decode('utf-8') if b >= 0xd9 else bytes(raw)),i+n
+    if b in (0xdc,0xdd):
+        fmt,size = ('>H',2) if b == 0xdc else ('>I',4)
+        return _unpack_array(data,i+size,struct.unpack_from(fmt,data,i)[0])
+    if b in (0xde,0xdf):
+        fmt,size = ('>H',2) if b == 0xde else ('>I',4)
+        return _unpack_map(data,i+size,struct.unpack_from(fmt,data,i)[0])
+    raise ValueError(f'Unsupported msgpack type 0x{b:02x}')
+
+
+def _unpack_array(data:bytes,i:int,n:int)->tuple[list,int]:
+    res = []
+    for _ in range(n):
+        v,i = _unpack(data,i)
+        res.append(v)
+    return res,i
+
+
+def _unpack_map(data:bytes,i:int,n:int)->tuple[dict,int]:
+    res = dict()
+    for _ in range(n):
+        k,i = _unpack(data,i)
+        v,i = _unpack(data,i)
+        res[k] = v
+    return res,i
+
+
+class MsgpackCodec(Codec):
+    """msgpack编解码器，安装了`msgpack`时使用其C扩展，否则使用纯Python实现"""
+    __slots__ = ()
+    name = 'msgpack'
+    binary = True
+
+    def dumps(self,obj)->bytes:
+        if _msgpack is not None:
+            return _msgpack.packb(obj,use_bin_type=True)
+        buf = bytearray()
+        _pack(obj,buf)
+        return bytes(buf)
+
+    def loads(self,data:Union[str,bytes]):
+        if isinstance(data,str):
+            data = data.encode('utf-8')
+        if _msgpack is not None:
+            return _msgpack.unpackb(data,raw=False,strict_map_key=False)
+        obj,i = _unpack(data,0)
+        if i != len(data):
+            raise ValueError('Extra data after the msgpack object')
+        return obj
+
+
+JSON = JsonCodec()
+MSGPACK = MsgpackCodec()
+_codecs:dict = {JSON.name:JSON,MSGPACK.name:MSGPACK}      # {名称:编解码器}，按服务端的优先顺序
+
+
+def register_codec(codec:Codec)->None:
+    """注册编解码器"""
+    if not codec.name:
+        raise ValueError('Codec error,the codec must have a name')
+    _codecs[codec.name] = codec
+
+
+def get_codec(name:str=None)->Codec:
+    """通过名称获取编解码器，name为None时返回json编解码器"""
+    if name is None:
+        return JSON
+    codec = _codecs.get(name)
+    if codec is None:
+        raise ValueError(f'Codec error,unsupported codec "{name}"')
+    return codec
+
+
+def subprotocols()->tuple[str]:
+    """服务端支持的websocket子协议"""
+    return tuple(c.subprotocol for c in _codecs.values())
+
+
+def from_subprotocol(protocol:str=None)->Codec:
+    """通过协商的websocket子协议获取编解码器，未协商时返回json编解码器"""
+    if protocol and protocol.startswith(SUBPROTOCOL_PREFIX):
+        codec = _codecs.get(protocol[len(SUBPROTOCOL_PREFIX):])
+        if codec is not None:
+            return codec
+    return JSON
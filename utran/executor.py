@@ -0,0 +1,247 @@
+"""# 执行器
+注册选项`useThread=True`的同步函数在线程池中执行，阻塞的IO操作不会阻塞事件循环。
+线程池与进程池的大小分别配置，调用时会复制当前的`contextvars`上下文到执行线程。
+
+`ElasticPool`为弹性进程池，进程数量在最小值和最大值之间按排队的调用数量伸缩:
+
+    ```
+    server = Server(workers=2,maxWorkers=8,workerIdleTimeout=60,workerGrowThreshold=0)
+    server.pool.stats()
+    ```
+"""
+import time
+import asyncio
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, Future
+
+from utran.worker import WorkerPool
+from utran.log import logger
+
+
+class ThreadPool(ThreadPoolExecutor):
+    """# 线程池
+    在`ThreadPoolExecutor`的基础上统计排队中和执行中的任务数量
+    Args:
+        threads: 线程数量，为None时使用`ThreadPoolExecutor`的默认值
+    """
+
+    def __init__(self,threads:int=None) -> None:
+        super().__init__(max_workers=threads,thread_name_prefix='utran-thread')
+        self._statLock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+
+    @property
+    def threads(self)->int:
+        """线程数量"""
+        return self._max_workers
+
+    @property
+    def queued(self)->int:
+        """排队等待执行的任务数量"""
+        return self._queued
+
+    @property
+    def active(self)->int:
+        """正在执行的任务数量"""
+        return self._active
+
+    def stats(self)->dict:
+        """线程池状态 {'threads':线程数量,'active':执行中,'queued':排队中,'completed':已完成}"""
+        return dict(threads=self.threads,active=self._active,queued=self._queued,completed=self._completed)
+
+    def submit(self,fn,/,*args,**kwargs)->Future:
+        with self._statLock:
+            self._queued += 1
+        try:
+            future = super().submit(self.__run,fn,args,kwargs)
+        except BaseException:
+            with self._statLock:
+                self._queued -= 1
+            raise
+        future.add_done_callback(self.__cancelled)
+        return future
+
+    def __cancelled(self,future:Future)->None:
+        # 排队中被取消的任务不会执行
+        if future.cancelled():
+            with self._statLock:
+                self._queued -= 1
+
+    def __run(self,fn,args,kwargs):
+        with self._statLock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            return fn(*args,**kwargs)
+        finally:
+            with self._statLock:
+                self._active -= 1
+                self._completed += 1
+
+
+class _Worker:
+    """弹性进程池中的一个工作进程"""
+    __slots__ = ('pool','active','busy','busySince','lastUsed','started')
+
+    def __init__(self,pool:WorkerPool) -> None:
+        self.pool = pool
+        self.active = 0             # 已提交未完成的调用数量
+        self.busy = 0.0             # 累计的忙碌时间
+        self.busySince = 0.0
+        self.lastUsed = self.started = time.monotonic()
+
+    def utilization(self,now:float)->float:
+        """启动以来处于忙碌状态的时间占比"""
+        busy = self.busy + (now-self.busySince if self.active else 0)
+        return busy/max(now-self.started,1e-9)
+
+
+class ElasticPool(Executor):
+    """# 弹性进程池
+    每个工作进程是一个单进程的`WorkerPool`，调用分配给未完成调用最少的进程。
+    所有进程都在忙且排队的调用数量超过`growThreshold`时启动新的进程，空闲超过`idleTimeout`的进程在数量大于最小值时关闭。
+    Args:
+        minWorkers: 最少进程数量
+        maxWorkers: 最多进程数量
+        registry: 需要在进程中执行的注册函数 {键:可调用对象}
+        publishQueue: 工作进程发布消息使用的队列，见`utran.bridge`
+        onWorkerStart: 每个工作进程启动时执行一次，返回资源 {名称:资源}
+        onWorkerStop: 每个工作进程退出时执行一次，参数为资源 {名称:资源}
+        growThreshold: 排队的调用数量超过该值时扩容
+        idleTimeout: 进程空闲超过该时间(单位:秒)后缩容
+    """
+
+    def __init__(self,
+                 minWorkers:int,
+                 maxWorkers:int,
+                 registry:dict,
+                 publishQueue=None,
+                 onWorkerStart=None,
+                 onWorkerStop=None,
+                 growThreshold:int=0,
+                 idleTimeout:float=60) -> None:
+        if minWorkers < 1 or maxWorkers < minWorkers:
+            raise ValueError(f'ElasticPool error,invalid workers range [{minWorkers},{maxWorkers}]')
+        self.minWorkers = minWorkers
+        self.maxWorkers = maxWorkers
+        self.growThreshold = growThreshold
+        self.idleTimeout = idleTimeout
+        self._initargs = (registry,publishQueue,onWorkerStart,onWorkerStop)
+        self._keys = frozenset(registry.keys())
+        self._lock = threading.Lock()
+        self._completed = 0
+        self._workers:list[_Worker] = [self.__spawn() for _ in range(minWorkers)]
+        self._shutdown = threading.Event()
+        self._reaper = threading.Thread(target=self.__reap,name='utran-elastic',daemon=True)
+        self._reaper.start()
+
+    def __spawn(self)->_Worker:
+        registry,publishQueue,onWorkerStart,onWorkerStop = self._initargs
+        return _Worker(WorkerPool(1,registry,publishQueue,onWorkerStart,onWorkerStop))
+
+    @property
+    def size(self)->int:
+        """当前的进程数量"""
+        return len(self._workers)
+
+    @property
+    def queued(self)->int:
+        """排队等待执行的调用数量"""
+        return sum(max(w.active-1,0) for w in self._workers)
+
+    def has(self,key:str)->bool:
+        """工作进程中是否存在该注册函数，启动后注册的函数不存在"""
+        return key in self._keys
+
+    def submit(self,fn,/,*args,**kwargs)->Future:
+        with self._lock:
+            if self._shutdown.is_set():
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            worker = min(self._workers,key=lambda w:w.active)
+            # 所有进程都在忙时本次调用也需要排队，排队的调用数量(包括本次)超过growThreshold时扩容
+            if worker.active and len(self._workers) < self.maxWorkers and self.queued+1 > self.growThreshold:
+                worker = self.__spawn()
+                self._workers.append(worker)
+                logger.debug(f'ElasticPool grows to {len(self._workers)} workers')
+            future = worker.pool.submit(fn,*args,**kwargs)
+            if not worker.active:
+                worker.busySince = time.monotonic()
+            worker.active += 1
+        future.add_done_callback(lambda f:self.__done(worker))
+        return future
+
+    def __done(self,worker:_Worker)->None:
+        with self._lock:
+            worker.active -= 1
+            self._completed += 1
+            now = time.monotonic()
+            worker.lastUsed = now
+            if not worker.active:
+                worker.busy += now-worker.busySince
+
+    def __reap(self)->None:
+        """关闭空闲超时的进程"""
+        interval = min(max(self.idleTimeout/2,0.05),1)
+        while not self._shutdown.wait(interval):
+            idle = []
+            with self._lock:
+                now = time.monotonic()
+                for w in list(self._workers):
+                    if len(self._workers) <= self.minWorkers:
+                        break
+                    if not w.active and now-w.lastUsed > self.idleTimeout:
+                        self._workers.remove(w)
+                        idle.append(w)
+            for w in idle:
+                w.pool.shutdown(wait=False)
+            if idle:
+                logger.debug(f'ElasticPool shrinks to {len(self._workers)} workers')
+
+    def stats(self)->dict:
+        """# 进程池状态
+        Returns:
+            {'workers':进程数量,'min':最少进程数量,'max':最多进程数量,'active':执行中,'queued':排队中,
+            'completed':已完成,'utilization':[每个进程的忙碌时间占比]}
+        """
+        with self._lock:
+            now = time.monotonic()
+            return dict(workers=len(self._workers),
+                        min=self.minWorkers,
+                        max=self.maxWorkers,
+                        active=sum(min(w.active,1) for w in self._workers),
+                        queued=self.queued,
+                        completed=self._completed,
+                        utilization=[round(w.utilization(now),4) for w in self._workers])
+
+    async def prewarm(self,delay:float=0.05)->list:
+        """# 预先启动最少数量的工作进程
+        Returns:
+            工作进程的pid
+        """
+        return await asyncio.gather(*[w.pool.prewarm(delay) for w in list(self._workers)])
+
+    def shutdown(self,wait:bool=True,*,cancel_futures:bool=False)->None:
+        self._shutdown.set()
+        with self._lock:
+            workers = list(self._workers)
+        for w in workers:
+            w.pool.shutdown(wait=wait,cancel_futures=cancel_futures)
+
+
+def create_process_pool(register,workers:int,publishQueue=None,maxWorkers:int=None,idleTimeout:float=60,growThreshold:int=0):
+    """# 创建进程池
+    `maxWorkers`大于`workers`时创建弹性进程池，否则创建固定数量的`WorkerPool`
+    Args:
+        register: 注册类的实例，提供需要在进程中执行的注册函数和工作进程的生命周期钩子
+        workers: 进程数量，弹性进程池的最少进程数量
+        publishQueue: 工作进程发布消息使用的队列，见`utran.bridge`
+        maxWorkers: 弹性进程池的最多进程数量
+        idleTimeout: 弹性进程池中进程空闲超过该时间(单位:秒)后缩容
+        growThreshold: 弹性进程池中排队的调用数量超过该值时扩容
+    """
+    args = (register.process_registry(),publishQueue,register.onWorkerStart,register.onWorkerStop)
+    if maxWorkers and maxWorkers > workers:
+        return ElasticPool(workers,maxWorkers,*args,growThreshold=growThreshold,idleTimeout=idleTimeout)
+    return WorkerPool(workers,*args)
@@ -0,0 +1,112 @@
+"""# 订阅过滤器
+订阅时可以为话题指定过滤条件，服务端只推送满足条件的消息，条件之间为"并且"的关系:
+
+|条件|说明|示例|
+|-|-|-|
+|`值`|等于|`{'symbol':'BTC'}`|
+|`{'eq':值}`|等于|`{'side':{'eq':'buy'}}`|
+|`{'ne':值}`|不等于|`{'side':{'ne':'sell'}}`|
+|`{'in':[值,...]}`|属于集合|`{'symbol':{'in':['BTC','ETH']}}`|
+|`{'gt'/'gte'/'lt'/'lte':数字}`|数值范围|`{'price':{'gte':100,'lt':200}}`|
+
+字段支持使用`.`访问嵌套的字典，例如 `{'book.bid':{'gt':0}}`。
+消息不是字典、缺少字段或类型无法比较时视为不满足条件。
+"""
+import operator
+import ujson
+
+
+OPERATORS = {
+    'eq': operator.eq,
+    'ne': operator.ne,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+_MISSING = object()
+
+
+def _getter(field:str):
+    """生成读取字段的函数"""
+    if '.' not in field:
+        return lambda msg: msg.get(field,_MISSING) if type(msg) == dict else _MISSING
+    path = field.split('.')
+    def get(msg):
+        for p in path:
+            if type(msg) != dict:
+                return _MISSING
+            msg = msg.get(p,_MISSING)
+        return msg
+    return get
+
+
+def _compile_condition(field:str,cond)->list:
+    """将一个字段的条件编译为判断函数"""
+    get = _getter(field)
+    if type(cond) != dict:
+        return [lambda msg: get(msg) == cond]
+    if not cond:
+        raise ValueError(f'Filter error,the condition of "{field}" is empty')
+    res = []
+    for op,value in cond.items():
+        if op == 'in':
+            if type(value) not in (list,tuple):
+                raise ValueError(f'Filter error,"in" of "{field}" must be a list')
+            try:
+                values = frozenset(value)
+            except TypeError:
+                values = tuple(value)
+            def contains(msg,values=values):
+                try:
+                    return get(msg) in values
+                except TypeError:
+                    return False
+            res.append(contains)
+        elif op in OPERATORS:
+            if op not in ('eq','ne') and type(value) not in (int,float):
+                raise ValueError(f'Filter error,"{op}" of "{field}" must be a number')
+            fn = OPERATORS[op]
+            def check(msg,fn=fn,value=value):
+                v = get(msg)
+                if v is _MISSING:
+                    return False
+                try:
+                    return fn(v,value)
+                except TypeError:
+                    return False
+            res.append(check)
+        else:
+            raise ValueError(f'Filter error,unsupported operator "{op}" of "{field}"')
+    return res
+
+
+class Filter:
+    """# 编译后的过滤器
+    条件不合法时抛出ValueError，过滤条件只编译一次，`key`为条件的规范化字符串，条件相同的过滤器`key`相同
+    Args:
+        spec: 过滤条件 {字段:条件}
+    """
+    __slots__ = ('spec','key','_checks')
+
+    def __init__(self,spec:dict) -> None:
+        if type(spec) != dict:
+            raise ValueError('Filter error,the filter must be a dict')
+        checks = []
+        for field,cond in spec.items():
+            if type(field) != str or not field:
+                raise ValueError(f'Filter error,invalid field "{field}"')
+            checks.extend(_compile_condition(field,cond))
+        self.spec = spec
+        self.key:str = ujson.dumps(spec,sort_keys=True)
+        self._checks = tuple(checks)
+
+    def __call__(self,msg)->bool:
+        for check in self._checks:
+            if not check(msg):
+                return False
+        return True
+
+    def __repr__(self) -> str:
+        return f'<Filter {self.key}>'
@@ -2,23 +2,30 @@
 
 
 import asyncio
+from collections import deque
+from typing import Union
 from utran.object import UtRequest, UtType, UtResponse, UtState, create_UtRequest
 from utran.register import RMethod, Register
-from utran.object import ClientConnection, SubscriptionContainer
-from concurrent.futures import ProcessPoolExecutor
+from utran.object import ClientConnection, EncodedResponse, SubscriptionContainer, TopicOption, normalize_topic
+from utran.topic import is_pattern
+from utran.filter import Filter
+from utran.log import logger
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 
 
 
 
-async def process_request(request:UtRequest,connection:ClientConnection,register:Register,sub_container:SubscriptionContainer,pool:ProcessPoolExecutor)->bool:
+async def process_request(request:UtRequest,connection:ClientConnection,register:Register,sub_container:SubscriptionContainer,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor=None)->bool:
     """# 处理请求总入口
     Args:
         request (UtRequest): 请求体
         connection (ClientConnection): 客户端连接
         register (Register): 注册类实例
         sub_container (SubscriptionContainer): 存放订阅者的容器实例
+        pool: 进程池
+        threadPool: 线程池
 
     Returns:
         返回一个布尔值,是否结束连接
@@ -26,7 +33,7 @@ async def process_request(request:UtRequest,connection:ClientConnection,register
     try:
         if UtType.RPC==request.requestType:
             #  Rpc请求
-            t = asyncio.create_task(process_rpc_request(request,connection,register,pool=pool))
+            t = asyncio.create_task(process_rpc_request(request,connection,register,pool=pool,threadPool=threadPool))
             return await t
         
         elif UtType.UNSUBSCRIBE==request.requestType:
@@ -42,7 +49,23 @@ async def process_request(request:UtRequest,connection:ClientConnection,register
             return await process_publish_request(request,sub_container)
 
         elif UtType.MULTICALL == request.requestType:
-            return await process_multicall_request(request,connection,register,sub_container,pool=pool)
+            return await process_multicall_request(request,connection,register,sub_container,pool=pool,threadPool=threadPool)
+
+        elif UtType.MULTIPUBLISH == request.requestType:
+            # 批量发布
+            return await process_multipublish_request(request,sub_container)
+
+        elif UtType.MAP == request.requestType:
+            # 并行map
+            return await process_map_request(request,connection,register,pool=pool,threadPool=threadPool)
+
+        elif UtType.CANCEL == request.requestType:
+            # 取消执行中的请求
+            return await process_cancel_request(request,connection)
+
+        elif UtType.METHODS == request.requestType:
+            # 紧凑格式的方法名称表握手
+            return await process_methods_request(request,connection,register)
 
         else:
             # logging.log(f"处理请求时,出现不受支持的请求,请求的内容：{request}")
@@ -51,7 +74,7 @@ async def process_request(request:UtRequest,connection:ClientConnection,register
         raise e
 
 
-async def process_multicall_request(request:UtRequest,connection:ClientConnection,register:Register,sub_container:SubscriptionContainer,pool:ProcessPoolExecutor=None)->bool:
+async def process_multicall_request(request:UtRequest,connection:ClientConnection,register:Register,sub_container:SubscriptionContainer,pool:ProcessPoolExecutor=None,threadPool:ThreadPoolExecutor=None)->bool:
     """处理multicall请求"""
   
     tasks = []
@@ -59,7 +82,7 @@ async def process_multicall_request(request:UtRequest,connection:ClientConnectio
         r:UtRequest = create_UtRequest(_r)
         if UtType.RPC==r.requestType:
             #  Rpc请求
-            tasks.append(asyncio.create_task(process_rpc_request(r,connection,register,to_send=False,pool=pool)))
+            tasks.append(asyncio.create_task(process_rpc_request(r,connection,register,to_send=False,pool=pool,threadPool=threadPool)))
 
             continue
         
@@ -93,7 +116,7 @@ async def process_multicall_request(request:UtRequest,connection:ClientConnectio
 
     
 
-async def process_rpc_request(request:UtRequest,connection:ClientConnection,register:Register,to_send:bool=True,pool:ProcessPoolExecutor=None)->bool:
+async def process_rpc_request(request:UtRequest,connection:ClientConnection,register:Register,to_send:bool=True,pool:ProcessPoolExecutor=None,threadPool:ThreadPoolExecutor=None)->bool:
     """
     # 处理rpc请求
     Args:
@@ -106,7 +129,7 @@ async def process_rpc_request(request:UtRequest,connection:ClientConnection,regi
     Attributes:
         id (int):  本次请求的id
         responseType (str): 'rpc'
-        state (int):  状态 0为失败，1为成功
+        state (int):  状态 0为失败，1为成功，2为被拒绝(超过并发限制，未执行)
         methodName (str): 需要执行的方法或函数名
         result (any): 执行结果
         error (str): 失败信息，订阅失败时才会有该项 
@@ -123,11 +146,12 @@ async def process_rpc_request(request:UtRequest,connection:ClientConnection,regi
     response = UtResponse(id=request.id,
                         state=UtState.SUCCESS,
                         methodName=method_name,
-                        responseType=request.requestType)
+                        responseType=request.requestType,
+                        compact=request.compact)
     if rm:
-        state,result,error = await rm.execute(args,dicts,pool)
-        if state == UtState.FAILED:
-            response.state = UtState.FAILED
+        state,result,error = await rm.execute(args,dicts,pool,threadPool)
+        if state != UtState.SUCCESS:
+            response.state = state
             response.error = error
         else:
             response.result = result
@@ -156,7 +180,8 @@ async def process_subscribe_request(request:UtRequest,connection:ClientConnectio
         id (int):  本次请求的id
         responseType (str): 'subscribe'
         state (int):  订阅状态 0为失败，1为成功
-        result (dict): 返回一个字典 {'subTopics':[本次成功订阅的话题],'allTopics'[该订阅者所有订阅的话题]:}
+        result (dict): 返回一个字典 {'subTopics':[本次成功订阅的话题],'allTopics'[该订阅者所有订阅的话题]:}，
+            请求携带lastSeq时还会有 'replay':{话题:{'count':重放的消息数量,'complete':重放是否完整}}
         error (str): 失败信息，订阅失败时才会有该项
         methodName (str): None
 
@@ -173,15 +198,38 @@ async def process_subscribe_request(request:UtRequest,connection:ClientConnectio
 
     if not topics:
         response.state = UtState.FAILED
-        response.result = dict(allTopics=connection.topics,subTopics=[])
+        response.result = dict(allTopics=list(connection.topics),subTopics=[])
         response.error = '没有指定topics'
     else:
-        if not sub_container.has_sub(connection.id):
-            t_ = sub_container.add_sub(connection,topics)
-            response.result = dict(allTopics=connection.topics,subTopics=t_)
+        try:
+            # 推送频率、重放序号和过滤器在订阅之前检查，不合法时不会订阅
+            maxRate = request.maxRate
+            if maxRate is not None and (type(maxRate) not in (int,float) or not maxRate > 0):
+                raise ValueError('Subscribe error,"maxRate" must be a positive number')
+            lastSeq = parse_last_seq(request.lastSeq)
+            if request.filters and type(request.filters) != dict:
+                raise ValueError('Filter error,"filters" must be a dict')
+            filters = dict((normalize_topic(t),Filter(spec)) for t,spec in request.filters.items() if spec) if request.filters else dict()
+            # 需要从磁盘读取的重放消息，在订阅之前读取，读取完成后订阅和重放同步完成，保证消息不会丢失或乱序
+            preload = await sub_container.load_replay(lastSeq) if lastSeq else None
+            if not sub_container.has_sub(connection.id):
+                t_ = sub_container.add_sub(connection,topics)
+                response.result = dict(allTopics=list(connection.topics),subTopics=t_)
+            else:
+                t_ = sub_container.add_topic(connection.id,topics)
+                response.result = dict(allTopics=list(connection.topics),subTopics=t_)
+        except ValueError as e:
+            response.state = UtState.FAILED
+            response.result = dict(allTopics=list(connection.topics),subTopics=[])
+            response.error = str(e)
         else:
-            t_ = sub_container.add_topic(connection.id,topics)
-            response.result = dict(allTopics=connection.topics,subTopics=t_)
+            for t in topics:
+                sub_container.set_filter(connection.id,t,filters.get(normalize_topic(t)))
+            if maxRate:
+                connection.maxRate = maxRate
+            if lastSeq:
+                response.result['replay'] = push_replay(lastSeq,connection,sub_container,preload)
+            push_last_values(t_ or [],connection,sub_container,exclude=lastSeq)
 
     if to_send:
         await connection.send(response)
@@ -190,6 +238,50 @@ async def process_subscribe_request(request:UtRequest,connection:ClientConnectio
         return response
     
 
+def parse_last_seq(lastSeq:dict)->Union[dict,None]:
+    """检查客户端提供的 {话题:序号}，序号转为int，不合法时抛出ValueError"""
+    if not lastSeq:
+        return None
+    if type(lastSeq) != dict or not all(type(t) == str for t in lastSeq):
+        raise ValueError('Replay error,"lastSeq" must be a dict of {topic:seq}')
+    try:
+        return dict((t,int(s)) for t,s in lastSeq.items())
+    except (TypeError,ValueError):
+        raise ValueError('Replay error,the seq in "lastSeq" must be an integer')
+
+
+def push_last_values(topics:list,connection:ClientConnection,sub_container:SubscriptionContainer,exclude:dict=None)->None:
+    """向新的订阅者推送话题缓存的最后一条消息，`exclude`中的话题已经重放过，不再推送"""
+    exclude = set(normalize_topic(t) for t in exclude) if exclude else ()
+    for topic in topics:
+        for t,frame in sub_container.get_last_values(topic):
+            if t in exclude or not sub_container.accepts(connection.id,t,frame.response.result.get('msg')):
+                continue
+            opt:TopicOption = sub_container.get_topic_option(t)
+            connection.push(frame,t if opt and opt.conflate else None)
+
+
+def push_replay(lastSeq:dict,connection:ClientConnection,sub_container:SubscriptionContainer,preload:dict=None)->dict:
+    """# 向断线重连的订阅者重放错过的消息
+    Args:
+        lastSeq: 每个话题最后收到的序号 {话题:序号}
+        preload: 从话题日志中预先读取的消息 {话题:[(序号,消息),...]}
+    Returns:
+        {话题:{'count':重放的消息数量,'complete':重放是否完整}}
+    """
+    res = dict()
+    for topic,seq in lastSeq.items():
+        key = normalize_topic(topic)
+        if connection.id not in sub_container.get_subId_by_topic(key):
+            continue
+        frames,complete = sub_container.get_replay(key,seq,preload.get(key) if preload else None)
+        frames = [f for f in frames if sub_container.accepts(connection.id,key,f.response.result.get('msg'))]
+        # 重放的消息不经过有界的推送队列，错过的消息较多时也不会被溢出策略丢弃
+        connection.replay(frames)
+        res[topic] = dict(count=len(frames),complete=complete)
+    return res
+
+
 async def process_unsubscribe_request(request:UtRequest,connection:ClientConnection,sub_container:SubscriptionContainer,to_send:bool=True)->bool:
     """
     # 处理unsubscribe取消订阅请求
@@ -219,7 +311,7 @@ async def process_unsubscribe_request(request:UtRequest,connection:ClientConnect
 
     if sub_container.has_sub(connection.id):
         t_ = sub_container.remove_topic(connection.id,topics)
-        response.result = dict(unSubTopics=t_,allTopics=connection.topics)
+        response.result = dict(unSubTopics=t_,allTopics=list(connection.topics))
     else:
         response.state = UtState.FAILED
         response.error = '非订阅者，无法执行该操作，服务器将关闭连接！'        
@@ -245,34 +337,212 @@ async def process_publish_request(request:UtRequest,sub_container:SubscriptionCo
         id (int):  本次请求的id
         responseType (str): 'publish'
         state (int):  状态 0为失败，1为成功        
-        result (dict): 返回一个字典 {'topic':话题,'msg':话题消息}
+        result (dict): 返回一个字典 {'topic':话题,'msg':话题消息,'seq':该话题的消息序号}
         error (str): 失败信息
         methodName (str): None
 
     Returns:
         返回一个布尔值,是否结束连接
     """
-    topics:tuple[str] = request.topics
-    msg:dict = request.msg
-    response =UtResponse(id=request.id,responseType=request.requestType,state=UtState.SUCCESS)
+    publish_message(request.id,request.msg,request.topics,sub_container)
 
     # asyncio.sleep(0) 释放控制权，用于防止publish被持续不间断调用而导致的阻塞问题
-    for topic in topics:
-        if not topic:
+    await asyncio.sleep(0)
+    return False
+
+
+def publish_message(id:int,msg:any,topics:tuple,sub_container:SubscriptionContainer)->None:
+    """# 向话题的订阅者推送消息
+    同步执行，只入队不等待发送，必须在事件循环所在的线程中调用
+    Args:
+        id: id标识
+        msg: 消息
+        topics: 话题
+        sub_container (SubscriptionContainer): 存放订阅者的容器实例
+    """
+    publish_messages(id,[(topic,msg) for topic in topics],sub_container)
+
+
+def publish_messages(id:int,messages:list,sub_container:SubscriptionContainer)->int:
+    """# 批量推送消息
+    同步执行，只入队不等待发送，必须在事件循环所在的线程中调用。
+    同一批次中每个话题的选项和订阅者只查询一次
+    Args:
+        id: id标识
+        messages: [(话题,消息),...]
+        sub_container (SubscriptionContainer): 存放订阅者的容器实例
+    Returns:
+        发布成功的消息数量
+    """
+    resolved = dict()       # {话题:(选项,重放缓冲区大小,无需过滤的订阅者,过滤器分组,合并推送的键)}
+    count = 0
+    for topic,msg in messages:
+        if not topic or type(topic)!=str or is_pattern(topic):
+            # 不能向通配符话题发布消息
             continue
-        
-        subIds:list = sub_container.get_subId_by_topic(topic)
-        for subid in subIds:
-            sub:ClientConnection = sub_container.get_sub_by_id(subid)
-            response.result = dict(topic=topic,msg=msg)
-            if sub:await sub.send(response)
-        
+
+        key = normalize_topic(topic)
+        r = resolved.get(key)
+        if r is None:
+            opt:TopicOption = sub_container.get_topic_option(key)
+            groups = sub_container.get_filter_groups(key)
+            if groups is None:
+                subs = [sub_container.get_sub_by_id(subid) for subid in sub_container.get_subId_by_topic(key)]
+                fgroups = ()
+            else:
+                plain,fg = groups
+                subs = [sub_container.get_sub_by_id(subid) for subid in plain]
+                fgroups = [(f,[sub_container.get_sub_by_id(subid) for subid in ids]) for f,ids in fg]
+            r = resolved[key] = (opt,sub_container.replay_size(key,opt),subs,fgroups,key if opt and opt.conflate else None)
+        opt,replaySize,subs,fgroups,conflateKey = r
+        if not subs and not fgroups and not replaySize and not (opt and opt.lastValue) and sub_container.topicLog is None:
+            sub_container.next_seq(key)
+            count += 1
+            continue
+
+        # 每个话题的消息只编码一次，所有订阅者共享同一份编码结果
+        seq:int = sub_container.get_seq(key)+1
+        response =UtResponse(id=id,responseType=UtType.PUBLISH,state=UtState.SUCCESS,result=dict(topic=topic,msg=msg,seq=seq))
+        frame = EncodedResponse(response)
+        try:
+            # 先编码，无法编码的消息不占用序号，不影响同一批次的其他消息
+            frame.text
+        except Exception as e:
+            logger.warning(f'Publish error, the message of topic "{topic}" is skipped: {e}')
+            continue
+        sub_container.next_seq(key)
+        count += 1
+        try:
+            if opt and opt.lastValue:
+                sub_container.set_last_value(key,frame)
+            if replaySize:
+                sub_container.add_replay(key,seq,frame,opt)
+            sub_container.persist(key,seq,frame)
+
+            for sub in subs:
+                if sub:sub.push(frame,conflateKey)    # 只入队不等待发送，慢速订阅者不会阻塞发布
+            if fgroups:
+                # 每组过滤器每条消息只判断一次，订阅者可能通过多个订阅属于多个分组，需要去重
+                sent = set() if len(fgroups) > 1 else None
+                for f,group in fgroups:
+                    if not f(msg):
+                        continue
+                    for sub in group:
+                        if sent is not None:
+                            if sub in sent: continue
+                            sent.add(sub)
+                        if sub:sub.push(frame,conflateKey)
+        except Exception as e:
+            logger.error(f'Publish error, topic "{topic}" seq {seq}: {e}')
+    return count
+
+
+async def process_multipublish_request(request:UtRequest,sub_container:SubscriptionContainer)->bool:
+    """
+    # 处理multipublish批量发布请求
+    一个请求携带多条 [话题,消息]，一次遍历完成推送，不返回响应
+    Args:
+        request: 请求体
+        sub_container (SubscriptionContainer): 存放订阅者的容器实例
+
+    Returns:
+        返回一个布尔值,是否结束连接
+    """
+    publish_messages(request.id,request.messages,sub_container)
     await asyncio.sleep(0)
     return False
 
 
+async def process_map_request(request:UtRequest,connection:ClientConnection,register:Register,pool:ProcessPoolExecutor=None,threadPool:ThreadPoolExecutor=None)->bool:
+    """
+    # 处理map请求
+    参数列表划分为多组，每组作为一个任务并发执行(进程中执行的注册函数分布到进程池的所有工作进程)，
+    同时执行的分组不超过进程数量的2倍和注册函数的并发限制，前面的分组返回后再提交后续的分组。
+    按顺序流式返回每组的结果，任意一组执行失败时返回失败的响应并取消其余的任务
+    Args:
+        request: 请求体
+        connection (ClientConnection): 客户端连接
+        register (Register): 注册类实例
 
+    ## response 响应体格式↓
+    Attributes:
+        id (int):  本次请求的id
+        responseType (str): 'map'
+        state (int):  状态 0为失败，1为成功，2为被拒绝
+        result (dict): {'index':本组第一个结果的位置,'results':[结果,...],'done':是否为最后一组}
+        error (str): 失败信息
 
+    Returns:
+        返回一个布尔值,是否结束连接
+    """
+    rm:RMethod = register.methods_of_rpc.get(request.methodName) if request.methodName else None
+    items:list = request.items
+    if rm is None or type(items) != list:
+        error = f'The rpc server does not have "{request.methodName}" methods. ' if rm is None else 'The items of map must be a list'
+        await connection.send(UtResponse(id=request.id,responseType=UtType.MAP,state=UtState.FAILED,error=error))
+        return False
+    if not items:
+        await connection.send(UtResponse(id=request.id,responseType=UtType.MAP,state=UtState.SUCCESS,result=dict(index=0,results=[],done=True)))
+        return False
 
+    workers = getattr(pool,'maxWorkers',None) or getattr(pool,'_max_workers',None) or 1
+    chunksize = request.chunksize
+    if not chunksize or type(chunksize) != int or chunksize < 1:
+        chunksize = max(1,-(-len(items)//(workers*4)))
+    window = min(workers*2,rm.maxConcurrency) if rm.maxConcurrency else workers*2
+    starts = deque(range(0,len(items),chunksize))
+    tasks = deque()         # [(本组第一个参数的位置,asyncio.Task)]，执行中的分组
+    try:
+        while starts or tasks:
+            while starts and len(tasks) < window:
+                i = starts.popleft()
+                tasks.append((i,asyncio.create_task(rm.map(items[i:i+chunksize],pool,threadPool))))
+            # 按顺序发送，先完成的后续分组等待前面的分组
+            start,task = tasks.popleft()
+            state,results,error = await task
+            if state != UtState.SUCCESS:
+                await connection.send(UtResponse(id=request.id,responseType=UtType.MAP,state=state,error=error,result=dict(index=start)))
+                return False
+            done = not starts and not tasks
+            await connection.send(UtResponse(id=request.id,responseType=UtType.MAP,state=UtState.SUCCESS,result=dict(index=start,results=results,done=done)))
+    finally:
+        for _,task in tasks:
+            task.cancel()
+    return False
 
 
+async def process_cancel_request(request:UtRequest,connection:ClientConnection)->bool:
+    """
+    # 处理cancel请求
+    取消该连接中id相同的rpc或multicall请求，客户端本地等待超时后发送，不返回响应
+    Args:
+        request: 请求体
+        connection (ClientConnection): 客户端连接
+
+    Returns:
+        返回一个布尔值,是否结束连接
+    """
+    connection.cancel_task(request.id)
+    return False
+
+
+async def process_methods_request(request:UtRequest,connection:ClientConnection,register:Register)->bool:
+    """
+    # 处理methods请求
+    返回rpc方法名称表并保存到连接中，之后该连接的紧凑格式请求使用名称在表中的位置作为方法编号。
+    表在握手时确定，之后注册的方法不会改变已有的编号
+    Args:
+        request: 请求体
+        connection (ClientConnection): 客户端连接
+        register (Register): 注册类实例
+
+    Returns:
+        返回一个布尔值,是否结束连接
+    """
+    connection.methods = tuple(register.methods_of_rpc)
+    response = UtResponse(id=request.id,
+                          state=UtState.SUCCESS,
+                          responseType=request.requestType,
+                          result=list(connection.methods))
+    await connection.send(response)
+    return False
@@ -1,6 +1,6 @@
 from enum import Enum
 from dataclasses import field
-from collections import defaultdict
+from collections import defaultdict, deque
 from typing import List, Union
 import uuid
 from aiohttp.web_ws import WebSocketResponse
@@ -10,6 +10,12 @@ from typing import List, Union
 import ujson
 
 from utran.utils import pack_data2_utran
+from utran.log import logger
+from utran.topic import TopicTrie, check_pattern, is_pattern, match_topic
+from utran.topiclog import TopicLog
+from utran.filter import Filter
+from utran.cache import RawJson, dumps_with_raw
+from utran.codec import Codec, JSON
 
 
 class HeartBeat(Enum):
@@ -27,6 +33,10 @@ class UtType(Enum):
     UNSUBSCRIBE: str = 'unsubscribe'
     PUBLISH: str = 'publish'
     MULTICALL: str = 'multicall'
+    MULTIPUBLISH: str = 'multipublish'
+    CANCEL: str = 'cancel'
+    MAP: str = 'map'
+    METHODS: str = 'methods'
 
 def convert2_UtType(uttype: any) -> UtType:
     if type(uttype) == UtType:
@@ -46,6 +56,18 @@ def convert2_UtType(uttype: any) -> UtType:
         
         elif uttype == UtType.MULTICALL.value:
             return UtType.MULTICALL
+
+        elif uttype == UtType.MULTIPUBLISH.value:
+            return UtType.MULTIPUBLISH
+
+        elif uttype == UtType.CANCEL.value:
+            return UtType.CANCEL
+
+        elif uttype == UtType.MAP.value:
+            return UtType.MAP
+
+        elif uttype == UtType.METHODS.value:
+            return UtType.METHODS
         
         elif uttype == UtType.POST.value:
             return UtType.POST
@@ -60,6 +82,12 @@ class UtState(Enum):
     """状态"""
     FAILED: int = 0
     SUCCESS: int = 1
+    REJECTED: int = 2       # 超过注册函数的并发和排队限制，调用被拒绝，未执行
+
+
+# 紧凑格式中请求和响应类型的编号
+TYPE_CODES = {UtType.RPC:1,UtType.CANCEL:2}
+CODE_TYPES = {v:k for k,v in TYPE_CODES.items()}
 
 
 def convert2_UtState(state:any)->UtState:
@@ -70,6 +98,8 @@ def convert2_UtState(state:any)->UtState:
         return UtState.FAILED
     elif state == UtState.SUCCESS.value:
         return UtState.SUCCESS
+    elif state == UtState.REJECTED.value:
+        return UtState.REJECTED
     else:
         raise TypeError(f'"{state}",Status value error!')
 
@@ -90,6 +120,9 @@ class UtRequest:
         id (int): 请求体id
         requestType (str): 标记请求类型
         topics (Tuple[str]): 可以同时订阅一个或多个话题
+        maxRate (float): 可选，合并(conflate)话题每秒最多推送给该订阅者的消息数量
+        lastSeq (dict): 可选，断线重连时携带每个话题最后收到的序号 {话题:序号}，服务端将重放错过的消息
+        filters (dict): 可选，每个话题的过滤条件 {话题:{字段:条件}}，服务端只推送满足条件的消息，见`utran.filter`
 
     ## Unsubscribe请求体
     Attributes:
@@ -109,9 +142,35 @@ class UtRequest:
         id (int): 请求体id
         requestType (str): 标记请求类型
         multiple (List[dict]): 多次的请求体,其中dict是对应类型的请求体的字典
+
+    ## Multipublish请求体
+    Attributes:
+        id (int): 请求体id
+        requestType (str): 标记请求类型
+        messages (List[list]): 批量发布的消息 [[话题,消息],...]
+
+    ## Map请求体
+    Attributes:
+        id (int): 请求体id
+        requestType (str): 标记请求类型
+        methodName (str): 调用的方法或函数名
+        items (list): 参数列表，每个元素作为一次调用的唯一参数
+        chunksize (int): 可选，每组参数的数量，每组作为一个任务提交到进程池，为None时按进程数量自动划分
+
+    ## Cancel请求体
+    Attributes:
+        id (int): 需要取消的rpc或multicall请求的id，服务端取消该请求执行中的任务，不返回响应
+        requestType (str): 标记请求类型
+
+    ## Methods请求体
+    Attributes:
+        id (int): 请求体id
+        requestType (str): 标记请求类型，返回rpc方法名称表，紧凑格式中的方法编号即名称在表中的位置
+
+    通过紧凑格式(`create_compact_UtRequest`)生成的请求`compact`为True，其响应也使用紧凑格式
     """
 
-    __slots__ = ('id', 'requestType', 'methodName', 'args', 'dicts','topics','msg','multiple','encrypt')
+    __slots__ = ('id', 'requestType', 'methodName', 'args', 'dicts','topics','msg','multiple','encrypt','maxRate','lastSeq','messages','filters','items','chunksize','compact')
     def __init__(self,
                  id:int,
                  requestType: Union[UtType,str],
@@ -123,6 +182,13 @@ class UtRequest:
                  msg:any = None,
                  multiple:list[dict] = [],
                  encrypt:bool = False,
+                 maxRate:float = None,
+                 lastSeq:dict = None,
+                 messages:list = None,
+                 filters:dict = None,
+                 items:list = None,
+                 chunksize:int = None,
+                 compact:bool = False,
                  ) -> None:
         
         self.id = id
@@ -134,6 +200,13 @@ class UtRequest:
         self.msg = msg
         self.encrypt = encrypt
         self.multiple = multiple
+        self.maxRate = maxRate
+        self.lastSeq = lastSeq
+        self.messages = messages or []
+        self.filters = filters
+        self.items = items or []
+        self.chunksize = chunksize
+        self.compact = compact
 
     def __repr__(self) -> str:
         return '<UtRequest>' + self.__str__
@@ -145,6 +218,12 @@ class UtRequest:
             return s+f',methodName:{self.methodName}'
         if self.requestType == UtType.MULTICALL:
             return s+f',nums:{len(self.multiple)}'
+        if self.requestType == UtType.MULTIPUBLISH:
+            return s+f',nums:{len(self.messages)}'
+        if self.requestType == UtType.CANCEL or self.requestType == UtType.METHODS:
+            return s
+        if self.requestType == UtType.MAP:
+            return s+f',methodName:{self.methodName},nums:{len(self.items)}'
         if self.requestType == UtType.UNSUBSCRIBE or self.requestType == UtType.SUBSCRIBE or self.requestType == UtType.PUBLISH:
             return s+f',topics:{self.topics}'
 
@@ -159,9 +238,16 @@ class UtRequest:
                         dicts=self.dicts)
 
         elif self.requestType == UtType.SUBSCRIBE:
-            return dict(id=self.id,
-                        requestType=self.requestType.value,
-                        topics=self.topics)
+            d = dict(id=self.id,
+                     requestType=self.requestType.value,
+                     topics=self.topics)
+            if self.maxRate:
+                d['maxRate'] = self.maxRate
+            if self.lastSeq:
+                d['lastSeq'] = self.lastSeq
+            if self.filters:
+                d['filters'] = self.filters
+            return d
         
         elif self.requestType == UtType.UNSUBSCRIBE:
             return dict(id=self.id,
@@ -179,6 +265,24 @@ class UtRequest:
                         requestType=self.requestType.value,
                         multiple=self.multiple)
 
+        elif self.requestType == UtType.MULTIPUBLISH:
+            return dict(id=self.id,
+                        requestType=self.requestType.value,
+                        messages=self.messages)
+
+        elif self.requestType == UtType.CANCEL or self.requestType == UtType.METHODS:
+            return dict(id=self.id,
+                        requestType=self.requestType.value)
+
+        elif self.requestType == UtType.MAP:
+            d = dict(id=self.id,
+                     requestType=self.requestType.value,
+                     methodName=self.methodName,
+                     items=self.items)
+            if self.chunksize:
+                d['chunksize'] = self.chunksize
+            return d
+
 
     def pick_utran_request(self):
         """生成符合utran协议的请求数据"""
@@ -219,13 +323,46 @@ def create_UtRequest(msg:Union[dict,list[dict]],id=None,encrypt=False)->UtReques
     return UtRequest(**res)
 
 
+def create_compact_UtRequest(frame:list,methods:tuple)->UtRequest:
+    """# 通过紧凑格式的请求生成UtRequest实例
+    紧凑格式为数组，类型使用编号(见`TYPE_CODES`)，方法名称使用连接握手(methods请求)时返回的名称表中的位置:
+
+        rpc:    [1,id,方法编号,列表参数] 或 [1,id,方法编号,列表参数,字典参数]
+        cancel: [2,id]
+
+    Args:
+        frame: 紧凑格式的请求
+        methods: 该连接握手时的方法名称表
+    """
+    requestType = CODE_TYPES.get(frame[0])
+    if requestType == UtType.RPC:
+        i = frame[2]
+        methodName = methods[i] if type(i) == int and 0 <= i < len(methods) else f'#{i}'
+        return UtRequest(frame[1],requestType,methodName=methodName,args=frame[3],
+                         dicts=frame[4] if len(frame) > 4 else dict(),compact=True)
+    if requestType == UtType.CANCEL:
+        return UtRequest(frame[1],requestType,compact=True)
+    raise TypeError(f'"{frame[0]}",Unsupported compact request type!')
+
+
+def expand_compact_response(frame:list)->dict:
+    """# 紧凑格式的响应转为字典
+    紧凑格式为 [类型编号,id,状态,结果]，失败时为 [类型编号,id,状态,结果,错误信息]
+    """
+    return dict(id=frame[1],
+                responseType=CODE_TYPES[frame[0]].value,
+                state=frame[2],
+                result=frame[3],
+                error=frame[4] if len(frame) > 4 else '')
+
+
 
 class UtResponse:
     """# 响应体
     Args:
         id (int): 请求体id
         requestType (str): 标记请求类型
-        state (int): 0是失败，1是成功 
+        state (int): 0是失败，1是成功，2是被拒绝(超过并发限制，未执行)
         methodName (Union[str,None]): 本次被请求的方法或函数，订阅和取消订阅时此参数为None
         result (any): 执行的结果
         error (str): 存放错误异常信息，默认为''空字符串
@@ -233,12 +370,17 @@ class UtResponse:
     不同响应的result值:
         |publish                     |subscribe                                              |unsubscribe|
         |-|-|-|
-        |{'topic':话题,'msg':话题消息}|{'allTopics': ['话题1','话题2'], 'subTopics': ['话题2']}|{'allTopics': ['话题1'], 'unSubTopics': ['话题2']}|
+        |{'topic':话题,'msg':话题消息,'seq':序号}|{'allTopics': ['话题1','话题2'], 'subTopics': ['话题2']}|{'allTopics': ['话题1'], 'unSubTopics': ['话题2']}|
+
+        |map|methods|
+        |-|-|
+        |{'index':本组第一个结果的位置,'results':[结果,...],'done':是否为最后一组}|['方法名称',...]|
 
+    compact为True时(紧凑格式的请求)，使用紧凑格式编码，见`to_list`
     """
 
     __slots__ = ('id', 'responseType', 'state',
-                 'methodName', 'result', 'error')
+                 'methodName', 'result', 'error','compact')
 
     def __init__(self,
                  id: int,
@@ -246,17 +388,27 @@ class UtResponse:
                  state: UtState,
                  methodName: Union[str, None] = None,
                  result: any = None,
-                 error: str = '') -> None:
+                 error: str = '',
+                 compact: bool = False) -> None:
         self.id = id
         self.responseType = convert2_UtType(responseType)
         self.state = convert2_UtState(state)
         self.methodName = methodName
         self.result = result
         self.error = error
+        self.compact = compact
+
+    def to_list(self)->list:
+        """转为紧凑格式 [类型编号,id,状态,结果]，失败时追加错误信息，已编码的结果(RawJson)转为编码前的值"""
+        result = self.result.value if isinstance(self.result,RawJson) else self.result
+        if self.state == UtState.SUCCESS:
+            return [TYPE_CODES[self.responseType],self.id,self.state.value,result]
+        return [TYPE_CODES[self.responseType],self.id,self.state.value,result,self.error]
 
 
     def to_dict(self):
-        """转为字典"""
+        """转为字典，已编码的结果(RawJson)转为编码前的值"""
+        result = self.result.value if isinstance(self.result,RawJson) else self.result
         if self.responseType == UtType.RPC:
             if self.state == UtState.SUCCESS:
                 return dict(
@@ -264,14 +416,14 @@ class UtResponse:
                     responseType=self.responseType.value,
                     state=self.state.value,
                     methodName=self.methodName,
-                    result=self.result)
+                    result=result)
             else:
                 return dict(
                     id=self.id,
                     responseType=self.responseType.value,
                     state=self.state.value,
                     methodName=self.methodName,
-                    result=self.result,
+                    result=result,
                     error=self.error)
         else:
             if self.state == UtState.SUCCESS:
@@ -279,54 +431,347 @@ class UtResponse:
                     id=self.id,
                     responseType=self.responseType.value,
                     state=self.state.value,
-                    result=self.result)
+                    result=result)
             else:
                 return dict(
                     id=self.id,
                     responseType=self.responseType.value,
                     state=self.state.value,
-                    result=self.result,
+                    result=result,
                     error=self.error)
 
-    
-    
+
+
+
+class EncodedResponse:
+    """# 预编码的响应体
+    同一个响应需要发送给多个客户端连接时(例如publish推送)，只进行一次序列化，所有连接共享同一份编码结果
+
+    Args:
+        response (UtResponse): 响应体
+    """
+    __slots__ = ('response','_text','_packed','_encoded')
+
+    def __init__(self,response:UtResponse) -> None:
+        self.response = response
+        self._text:str = None
+        self._packed:dict = dict()  # {encrypt:bytes}
+        self._encoded:dict = dict() # {编解码器名称:编码结果}
+
+    @classmethod
+    def from_text(cls,text:str)->'EncodedResponse':
+        """通过已编码的json字符串创建，例如从持久化的话题日志中读取的消息"""
+        d:dict = ujson.loads(text)
+        frame = cls(UtResponse(id=d.get('id'),
+                               responseType=d.get('responseType'),
+                               state=d.get('state'),
+                               methodName=d.get('methodName'),
+                               result=d.get('result'),
+                               error=d.get('error','')))
+        frame._text = text
+        return frame
+
+    @property
+    def text(self)->str:
+        """websocket使用的json字符串，首次访问时编码。结果为已编码的json(RawJson)时直接拼接"""
+        if self._text is None:
+            if self.response.compact:
+                self._text = self.__compact_text()
+                return self._text
+            d = self.response.to_dict()
+            if isinstance(self.response.result,RawJson) and self.response.state == UtState.SUCCESS:
+                d['result'] = self.response.result
+                self._text = dumps_with_raw(d)
+            else:
+                self._text = ujson.dumps(d)
+        return self._text
+
+    def __compact_text(self)->str:
+        """紧凑格式的json字符串，成功时结果为最后一项，结果为RawJson时直接拼接"""
+        l = self.response.to_list()
+        if isinstance(self.response.result,RawJson) and self.response.state == UtState.SUCCESS:
+            l[-1] = None
+            return ujson.dumps(l)[:-5]+self.response.result+']'
+        return ujson.dumps(l)
+
+    def encoded(self,codec:Codec)->Union[str,bytes]:
+        """websocket连接协商的编解码器编码的数据，首次访问时编码，json编码即`text`"""
+        if codec is JSON:
+            return self.text
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = codec.dumps(self.response.to_list() if self.response.compact else self.response.to_dict())
+            self._encoded[codec.name] = data
+        return data
+
+    def packed(self,encrypt:bool=False)->bytes:
+        """StreamWriter使用的utran协议数据，首次访问时编码"""
+        data = self._packed.get(encrypt)
+        if data is None:
+            data = pack_data2_utran(self.response.id,self.response.responseType.value,self.text.encode('utf-8'),encrypt)
+            self._packed[encrypt] = data
+        return data
+
+
+class OverflowPolicy(Enum):
+    """发送队列溢出策略"""
+    DROP_OLDEST: str = 'drop_oldest'        # 丢弃队列中最旧的消息
+    DROP_NEWEST: str = 'drop_newest'        # 丢弃本次的新消息
+    DISCONNECT: str = 'disconnect'          # 断开该客户端连接
+
+
 class ClientConnection:
-    """客户端连接"""
-    __slots__=('topics','sender','__id','_encrypt','_single_semaphore','_isclose')
-    def __init__(self,sender:Union[StreamWriter,WebSocketResponse],encrypt:bool=False):
-        self.topics = []
+    """# 客户端连接
+    每个连接拥有独立的有界发送队列和写入任务，推送消息时只需入队即可返回，
+    单个慢速客户端不会阻塞发布者和其他订阅者。
+    发送顺序为: 请求的响应、重放的消息、推送消息，前两者不受溢出策略影响。
+
+    Args:
+        sender: StreamWriter或WebSocketResponse
+        encrypt: 是否加密传输数据
+        queueMaxsize: 推送消息发送队列的最大长度
+        overflowPolicy: 发送队列已满时的处理策略，见`OverflowPolicy`
+        codec: websocket连接协商的编解码器，见`utran.codec`
+    """
+    __slots__=('topics','sender','__id','_encrypt','_isclose','_queue','_responses','_replays','_replayPending',
+               '_queueMaxsize','_overflowPolicy','_wakeup','_writer_task','_dropped',
+               '_conflated','_lastSent','maxRate','_tasks','codec','methods')
+    def __init__(self,
+                 sender:Union[StreamWriter,WebSocketResponse],
+                 encrypt:bool=False,
+                 queueMaxsize:int=1024,
+                 overflowPolicy:Union[OverflowPolicy,str]=OverflowPolicy.DROP_OLDEST,
+                 codec:Codec=JSON):
+        self.topics:set = set()
         self.__id = str(uuid.uuid4())
         self.sender = sender
         self._encrypt=encrypt
-        self._single_semaphore = asyncio.Semaphore(1)
         self._isclose = False
+        self._queue:deque = deque()             # 推送消息，受溢出策略约束
+        self._responses:deque = deque()         # 请求的响应，不会被丢弃，优先发送
+        self._replays:deque = deque()           # 重放的消息的迭代器，不会被丢弃，在推送消息之前发送
+        self._replayPending = 0                 # 等待重放的消息数量
+        self._queueMaxsize = queueMaxsize
+        self._overflowPolicy = OverflowPolicy(overflowPolicy)
+        self._wakeup = asyncio.Event()
+        self._writer_task:asyncio.Task = None
+        self._dropped = 0
+        self._conflated:dict = dict()           # {合并键:最新的消息}，队列中只存放合并键
+        self._lastSent:dict = dict()            # {合并键:最后发送时间}
+        self.maxRate:float = None               # 合并话题每秒最多推送的消息数量
+        self._tasks:dict = dict()               # {请求id:asyncio.Task}，执行中的请求
+        self.codec = codec
+        self.methods:tuple = tuple()            # 握手时的rpc方法名称表，紧凑格式的方法编号即其中的位置
         
     @property
     def id(self):
         return self.__id
+
+    @property
+    def pending(self)->int:
+        """发送队列中等待发送的消息数量"""
+        return len(self._queue)+len(self._responses)+self._replayPending
+
+    @property
+    def dropped(self)->int:
+        """因队列溢出被丢弃的推送消息数量"""
+        return self._dropped
     
+    def track(self,id:int,task:asyncio.Task)->None:
+        """记录执行中的请求，连接关闭或收到取消请求时取消"""
+        self._tasks[id] = task
+        task.add_done_callback(lambda t:self._tasks.pop(id,None) if self._tasks.get(id) is t else None)
+
+    def cancel_task(self,id:int)->bool:
+        """取消执行中的请求，返回是否存在该请求"""
+        task:asyncio.Task = self._tasks.pop(id,None)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
     def close(self):
         self._isclose = True
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._queue.clear()
+        self._responses.clear()
+        self._replays.clear()
+        self._replayPending = 0
+        self._conflated.clear()
+        if self._writer_task is not None:
+            self._writer_task.cancel()
+            self._writer_task = None
 
-    async def send(self,response:UtResponse):
+    async def send(self,response:Union[UtResponse,EncodedResponse]):
+        """# 发送响应
+        响应会放入发送队列，由写入任务按顺序发送，不受溢出策略影响
+        Args:
+            response: 响应体，或者已经预编码的响应体(多个连接共享编码结果)
+        """
         if self._isclose:return
-        async with self._single_semaphore:     # 每次只允许一个协程调用send方法     
-            if isinstance(self.sender,StreamWriter):
-                msg = pack_data2_utran(response.id,response.responseType.value,response.to_dict(),self._encrypt)
-                await self.__send_by_sw(msg)
-            elif isinstance(self.sender,WebSocketResponse):
-                await self.__send_by_ws(response.to_dict())
+        frame = response if isinstance(response,EncodedResponse) else EncodedResponse(response)
+        try:
+            # 入队前编码，无法编码的结果转为失败的响应，不影响连接
+            self._encode(frame)
+        except Exception as e:
+            r = frame.response
+            logger.warning(f'Encode error, the response "{r.id}" is replaced with a failed response: {e}')
+            frame = EncodedResponse(UtResponse(id=r.id,
+                                               responseType=r.responseType,
+                                               state=UtState.FAILED,
+                                               methodName=r.methodName,
+                                               error=f'Response encoding error: {e}',
+                                               compact=r.compact))
+        self._responses.append(frame)
+        self._wakeup_writer()
+
+    def _encode(self,frame:EncodedResponse)->Union[str,bytes]:
+        """按连接的类型和编解码器编码，编码结果缓存在frame中"""
+        if isinstance(self.sender,StreamWriter):
+            return frame.packed(self._encrypt)
+        return frame.encoded(self.codec)
+
+    def push(self,frame:EncodedResponse,conflateKey:str=None)->bool:
+        """# 推送消息
+        非阻塞，入队后立即返回。队列已满时按照溢出策略处理
+        Args:
+            frame: 预编码的消息
+            conflateKey: 合并键，指定时同一个合并键在队列中只保留最新的一条消息
+        Returns:
+            返回是否成功入队，无法编码的消息不会入队
+        """
+        if self._isclose:return False
+        try:
+            self._encode(frame)
+        except Exception as e:
+            logger.warning(f'Encode error, the message is not pushed to the client "{self.id}": {e}')
+            return False
+        if conflateKey is not None and conflateKey in self._conflated:
+            # 已在队列中等待发送，直接替换为最新的消息
+            self._conflated[conflateKey] = frame
+            return True
+
+        if len(self._queue) >= self._queueMaxsize:
+            if self._overflowPolicy == OverflowPolicy.DROP_NEWEST:
+                self._dropped += 1
+                return False
+            elif self._overflowPolicy == OverflowPolicy.DROP_OLDEST:
+                item = self._queue.popleft()
+                if type(item) == str:
+                    self._conflated.pop(item,None)
+                self._dropped += 1
             else:
-                raise RuntimeError('Invalid sender, it must be an instance of StreamWriter or WebSocketResponse')
+                logger.warning(f'Send queue overflow, disconnect the client "{self.id}"')
+                self._abort()
+                return False
+
+        if conflateKey is not None:
+            self._conflated[conflateKey] = frame
+            self._queue.append(conflateKey)
+        else:
+            self._queue.append(frame)
+        self._wakeup_writer()
+        return True
+
+    def replay(self,frames:List[EncodedResponse])->None:
+        """# 重放消息
+        重放的消息不受溢出策略影响，全部在之后的推送消息之前按顺序发送。
+        消息不会一次性放入发送队列，写入任务每发送完一条再从列表中取出下一条并编码，
+        从话题日志重放大量的消息时，发送速度由客户端的接收速度决定
+        Args:
+            frames: 预编码的消息，按序号排列
+        """
+        if self._isclose or not frames:return
+        self._replays.append(iter(frames))
+        self._replayPending += len(frames)
+        self._wakeup_writer()
+
+    def __requeue(self,conflateKey:str):
+        """限速结束后，合并键重新入队"""
+        if not self._isclose and conflateKey in self._conflated:
+            self._queue.append(conflateKey)
+            self._wakeup_writer()
+
+    def _wakeup_writer(self):
+        self._wakeup.set()
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self.__writer())
+
+    def _abort(self):
+        """关闭连接，并关闭底层的sender"""
+        self.close()
+        if isinstance(self.sender,StreamWriter):
+            self.sender.close()
+        elif isinstance(self.sender,WebSocketResponse):
+            asyncio.create_task(self.sender.close())
+
+    async def __writer(self):
+        """写入任务，依次发送队列中的消息"""
+        try:
+            while not self._isclose:
+                if self._responses:
+                    frame:EncodedResponse = self._responses.popleft()
+                elif self._replays:
+                    frame:EncodedResponse = next(self._replays[0],None)
+                    if frame is None:
+                        self._replays.popleft()
+                        continue
+                    self._replayPending -= 1
+                elif self._queue:
+                    frame:EncodedResponse = self._queue.popleft()
+                    if type(frame) == str:
+                        # 合并键，取出最新的消息
+                        key = frame
+                        frame = self._conflated.get(key)
+                        if frame is None:
+                            continue
+                        if self.maxRate:
+                            loop = asyncio.get_running_loop()
+                            delay = self._lastSent.get(key,0) + 1/self.maxRate - loop.time()
+                            if delay > 0:
+                                # 超过最大推送频率，延迟发送，期间的新消息继续合并
+                                loop.call_later(delay,self.__requeue,key)
+                                continue
+                            self._lastSent[key] = loop.time()
+                        del self._conflated[key]
+                else:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                try:
+                    # 通常已在入队时编码，这里只读取缓存
+                    data = self._encode(frame)
+                except Exception as e:
+                    logger.warning(f'Encode error, the message is skipped: {e}')
+                    continue
+
+                if isinstance(self.sender,StreamWriter):
+                    await self.__send_by_sw(data)
+                elif isinstance(self.sender,WebSocketResponse):
+                    await self.__send_by_ws(data)
+                else:
+                    raise RuntimeError('Invalid sender, it must be an instance of StreamWriter or WebSocketResponse')
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # 传输错误，关闭连接和底层的sender
+            logger.debug(f'Send error, the client "{self.id}" is closed: {e}')
+            self._abort()
     
     async def __send_by_sw(self,msg:bytes):        
         w:StreamWriter = self.sender
         w.write(msg)
         await w.drain()
 
-    async def __send_by_ws(self,msg:dict):
+    async def __send_by_ws(self,msg:Union[str,bytes]):
         w:WebSocketResponse = self.sender
-        await w.send_str(ujson.dumps(msg))
+        if self.codec.binary:
+            await w.send_bytes(msg)
+        else:
+            await w.send_str(msg)
 
 
     def add_topic(self,topic:str)->Union[str,None]:
@@ -335,7 +780,7 @@ class ClientConnection:
             返回添加成功的topic
         """
         if topic not in self.topics:
-            self.topics.append(topic)
+            self.topics.add(topic)
             return topic
  
     def remove_topic(self,topic:str)->Union[str,None]:
@@ -344,26 +789,81 @@ class ClientConnection:
             返回移除成功的topic
         """
         if topic in self.topics:
-            self.topics.remove(topic)
+            self.topics.discard(topic)
             return  topic
 
 
+class TopicOption:
+    """# 话题选项
+    Args:
+        lastValue: 缓存话题最后一次发布的消息，新的订阅者订阅时立即收到该消息
+        conflate: 合并推送，慢速订阅者的发送队列中只保留该话题最新的一条消息
+        replay: 重放缓冲区的大小，为None时使用容器的默认值`replaySize`
+    """
+    __slots__ = ('lastValue','conflate','replay')
+
+    def __init__(self,lastValue:bool=False,conflate:bool=False,replay:int=None) -> None:
+        self.lastValue = lastValue
+        self.conflate = conflate
+        self.replay = replay
+
+
+def normalize_topic(topic:str)->str:
+    """话题统一转为去除首尾空白的纯小写"""
+    return topic.lower().strip()
+
+
 class SubscriptionContainer:
     """
     # 存放订阅者和订阅话题的容器
-        
+    订阅者和话题的索引都使用哈希集合，订阅、取消订阅、删除订阅者的复杂度只与涉及的话题数量有关，
+    与订阅者总数无关。没有订阅者的话题会被自动移除。
+
+    支持通配符订阅(见`utran.topic`)，例如 `market.*.trade`、`market.#`，通配符话题存放在前缀树中，
+    发布时查找订阅者的耗时与话题深度成正比。
+
+    每个话题发布的消息都带有递增的序号(seq)，开启重放缓冲区后，断线重连的客户端可以携带最后收到的序号，
+    只获取断线期间错过的消息。
+
+    可选的持久化话题日志`TopicLog`会保存所有发布的消息，服务重启后序号继续递增，
+    重放缓冲区不能覆盖的消息会从日志中读取。
+
+    订阅时可以指定过滤器(见`utran.filter`)，同一话题下过滤条件相同的订阅者归为一组，
+    每条消息每组只判断一次。
+
+    Args:
+        replaySize: 每个话题默认的重放缓冲区大小，0为不缓存
+        topicLog: 持久化的话题日志
     """
-    __slots__=('__subscribes','__topics') 
+    __slots__=('__subscribes','__topics','__patterns','__options','__lastValues','__seqs','__replays','__replaySize','__topicLog',
+               '__filters','__subFilters') 
 
-    def __init__(self) -> None:
-        self.__subscribes = dict()   # {客户端id1:{writer:writer,topics:[话题1,话题2,...]},客户端id2:{writer:writer,topics:[话题1,...]}}
-        self.__topics = dict()       # {话题1:[客户端id1,客户端id2,..],话题2:[客户端id1,..]}     
+    def __init__(self,replaySize:int=0,topicLog:TopicLog=None) -> None:
+        self.__subscribes = dict()   # {客户端id1:ClientConnection,客户端id2:ClientConnection}
+        self.__topics = dict()       # {话题1:{客户端id1,客户端id2,..},话题2:{客户端id1,..}}
+        self.__patterns = TopicTrie()  # 存在订阅者的通配符话题
+        self.__options = dict()      # {话题:TopicOption}
+        self.__lastValues = dict()   # {话题:EncodedResponse}
+        self.__seqs = dict()         # {话题:最后发布的序号}
+        self.__replays = dict()      # {话题:deque([(序号,EncodedResponse),...])}
+        self.__replaySize = replaySize
+        self.__topicLog = topicLog
+        self.__filters = dict()      # {话题:{过滤器key:(Filter,{客户端id1,..})}}
+        self.__subFilters = dict()   # {(客户端id,话题):过滤器key}
+
+    @property
+    def topicLog(self)->Union[TopicLog,None]:
+        """持久化的话题日志"""
+        return self.__topicLog
+
+    @property
+    def topics(self)->list:
+        """当前所有存在订阅者的话题"""
+        return list(self.__topics.keys())
 
     def has_sub(self,subId:str):
         """指定id 查询订阅者是否存在"""
-        if subId in self.__subscribes:
-            return True
-        return False
+        return subId in self.__subscribes
 
     def add_sub(self,cc:ClientConnection,topics:Union[str,list]=None)->Union[List[str],None]:
         """# 添加订阅者
@@ -375,6 +875,19 @@ class SubscriptionContainer:
         if topics != None:
             return self.add_topic(cc.id,topics)
 
+    def add_subs(self,ccs:List[ClientConnection],topics:Union[str,list])->None:
+        """# 批量添加订阅者，所有订阅者订阅相同的话题"""
+        topics = [normalize_topic(t) for t in ([topics] if type(topics)==str else topics)]
+        topics = [t for t in topics if t]
+        [check_pattern(t) for t in topics if is_pattern(t)]
+        for t in topics:
+            subIds:set = self.__get_or_create(t)
+            for cc in ccs:
+                subIds.add(cc.id)
+        for cc in ccs:
+            self.__subscribes[cc.id] = cc
+            cc.topics.update(topics)
+
     def add_sub_by_id(self,subId:str,sender:Union[StreamWriter,WebSocketResponse],topic:Union[str,list]=None):
         """通过id添加订阅者"""
         if subId not in self.__subscribes:
@@ -384,13 +897,42 @@ class SubscriptionContainer:
 
     def del_sub(self,subId:str):
         """删除订阅者,成功返回订阅者，否则返回None"""
-        s:ClientConnection = self.__subscribes.get(subId)
+        s:ClientConnection = self.__subscribes.pop(subId,None)
         if s:
-            if len(s.topics)>0:
-                for topic in s.topics:
-                    if self.__topics.get(topic) and subId in self.__topics[topic]:
-                        self.__topics[topic].remove(subId)
-            return self.__subscribes.pop(subId)
+            for topic in s.topics:
+                self.__discard(topic,subId)
+            return s
+
+    def del_subs(self,subIds:List[str])->List[ClientConnection]:
+        """# 批量删除订阅者
+        Returns:
+            返回被删除的订阅者
+        """
+        res = []
+        for subId in subIds:
+            s = self.del_sub(subId)
+            if s: res.append(s)
+        return res
+
+    def __get_or_create(self,topic:str)->set:
+        """获取话题的订阅者集合，不存在时创建"""
+        subIds:set = self.__topics.get(topic)
+        if subIds is None:
+            if is_pattern(topic):
+                self.__patterns.add(topic)
+            subIds = self.__topics[topic] = set()
+        return subIds
+
+    def __discard(self,topic:str,subId:str):
+        """从话题中移除订阅者，话题没有订阅者时移除该话题"""
+        self.__unset_filter(subId,topic)
+        subIds:set = self.__topics.get(topic)
+        if subIds is not None:
+            subIds.discard(subId)
+            if not subIds:
+                del self.__topics[topic]
+                if is_pattern(topic):
+                    self.__patterns.remove(topic)
 
     def add_topic(self,subId:str,topic:Union[str,list])->list:
         """# 为订阅者，增加订阅话题
@@ -404,14 +946,12 @@ class SubscriptionContainer:
                 t_ = self.add_topic(subId,t)
                 if t_: ok.append(t_)
         else:
-            topic = topic.lower().strip()
+            topic = normalize_topic(topic)
             if not topic: return
+            if is_pattern(topic): check_pattern(topic)
             s:ClientConnection = self.__subscribes.get(subId)
-            if s:                
-                if topic not in self.__topics:
-                    self.__topics[topic] = []
-                if subId not in self.__topics[topic]:
-                    self.__topics[topic].append(subId)
+            if s:
+                self.__get_or_create(topic).add(subId)
                 return s.add_topic(topic)
             else:
                 raise ValueError('订阅者不存在')
@@ -429,28 +969,269 @@ class SubscriptionContainer:
                 if t_: 
                     ok.append(t_)
         else:  
-            topic = topic.lower().strip()
+            topic = normalize_topic(topic)
             if not topic: return
             s:ClientConnection = self.__subscribes.get(subId)
             if s:
-                subIds:list = self.__topics.get(topic) or []
-                if s.id in subIds:
-                    self.__topics[topic].remove(s.id)
+                self.__discard(topic,subId)
                 return s.remove_topic(topic)
             else:
                 raise ValueError('订阅者不存在')
         return ok
 
+    def remove_topics(self,subIds:List[str],topics:Union[str,list])->None:
+        """# 批量为多个订阅者取消订阅相同的话题"""
+        topics = [normalize_topic(t) for t in ([topics] if type(topics)==str else topics)]
+        for subId in subIds:
+            s:ClientConnection = self.__subscribes.get(subId)
+            if s is None:
+                continue
+            for t in topics:
+                if s.remove_topic(t):
+                    self.__discard(t,subId)
+
+    def set_filter(self,subId:str,topic:str,filter:Filter=None)->None:
+        """# 设置订阅者在某个已订阅话题上的过滤器
+        Args:
+            subId: 订阅者id
+            topic: 已订阅的话题
+            filter: 过滤器，为None时取消过滤
+        """
+        topic = normalize_topic(topic)
+        self.__unset_filter(subId,topic)
+        if filter is None or subId not in self.__topics.get(topic,()):
+            return
+        groups:dict = self.__filters.setdefault(topic,dict())
+        group = groups.get(filter.key)
+        if group is None:
+            group = groups[filter.key] = (filter,set())
+        group[1].add(subId)
+        self.__subFilters[(subId,topic)] = filter.key
+
+    def __unset_filter(self,subId:str,topic:str)->None:
+        key = self.__subFilters.pop((subId,topic),None)
+        if key is None:
+            return
+        groups:dict = self.__filters[topic]
+        ids:set = groups[key][1]
+        ids.discard(subId)
+        if not ids:
+            del groups[key]
+            if not groups:
+                del self.__filters[topic]
+
+    def get_filter(self,subId:str,topic:str)->Union[Filter,None]:
+        """获取订阅者在某个已订阅话题上的过滤器"""
+        topic = normalize_topic(topic)
+        key = self.__subFilters.get((subId,topic))
+        return self.__filters[topic][key][0] if key is not None else None
+
+    def get_filter_groups(self,topic:str)->Union[tuple[set,list],None]:
+        """# 获取话题的过滤器分组
+        包括通配符话题匹配到的订阅，订阅者通过任意一个无过滤器的订阅匹配到该话题时，不需要过滤
+        Returns:
+            没有订阅者使用过滤器时返回None，否则返回 (无需过滤的订阅者id,[(Filter,{订阅者id,..}),...])，
+            不同订阅中条件相同的过滤器会合并为一组
+        """
+        if not self.__filters:
+            return None
+        topic = normalize_topic(topic)
+        matched = [topic]+self.__patterns.match(topic) if self.__patterns else [topic]
+        if not any(t in self.__filters for t in matched):
+            return None
+        plain = set()
+        merged = dict()
+        for t in matched:
+            subIds:set = self.__topics.get(t)
+            if not subIds:
+                continue
+            groups:dict = self.__filters.get(t)
+            if not groups:
+                plain.update(subIds)
+                continue
+            filtered = set()
+            for key,(f,ids) in groups.items():
+                filtered.update(ids)
+                group = merged.get(key)
+                if group is None:
+                    merged[key] = (f,set(ids))
+                else:
+                    group[1].update(ids)
+            plain.update(subIds-filtered)
+        res = []
+        for f,ids in merged.values():
+            ids -= plain
+            if ids:
+                res.append((f,ids))
+        return plain,res
+
+    def accepts(self,subId:str,topic:str,msg:any)->bool:
+        """订阅者是否接收该话题的消息，用于重放和推送缓存的消息时判断过滤器"""
+        if not self.__filters:
+            return True
+        topic = normalize_topic(topic)
+        matched = [topic]+self.__patterns.match(topic) if self.__patterns else [topic]
+        for t in matched:
+            if subId not in self.__topics.get(t,()):
+                continue
+            key = self.__subFilters.get((subId,t))
+            if key is None or self.__filters[t][key][0](msg):
+                return True
+        return False
+
+    def set_topic_option(self,topic:str,lastValue:bool=False,conflate:bool=False,replay:int=None)->TopicOption:
+        """# 设置话题选项
+        Args:
+            topic: 话题
+            lastValue: 缓存话题最后一次发布的消息，新的订阅者订阅时立即收到该消息
+            conflate: 合并推送，慢速订阅者的发送队列中只保留该话题最新的一条消息
+            replay: 重放缓冲区的大小，为None时使用容器的默认值
+        """
+        topic = normalize_topic(topic)
+        opt = TopicOption(lastValue=lastValue,conflate=conflate,replay=replay)
+        self.__options[topic] = opt
+        if not lastValue:
+            self.__lastValues.pop(topic,None)
+        buffer:deque = self.__replays.get(topic)
+        if buffer is not None:
+            # 保留已有的重放消息，缓冲区大小改变时只保留最新的消息
+            size = self.replay_size(topic,opt)
+            if not size:
+                del self.__replays[topic]
+            elif size != buffer.maxlen:
+                self.__replays[topic] = deque(buffer,maxlen=size)
+        return opt
+
+    def get_topic_option(self,topic:str)->Union[TopicOption,None]:
+        """获取话题选项"""
+        return self.__options.get(topic)
+
+    def set_last_value(self,topic:str,frame:EncodedResponse)->None:
+        """缓存话题最后一次发布的消息"""
+        self.__lastValues[topic] = frame
+
+    def get_last_values(self,topic:str)->List[tuple[str,EncodedResponse]]:
+        """# 获取话题缓存的最后一条消息
+        通配符话题会返回所有匹配话题的消息
+        Returns:
+            [(话题,消息),...]
+        """
+        if not self.__lastValues:
+            return []
+        if is_pattern(topic):
+            return [(k,v) for k,v in self.__lastValues.items() if match_topic(topic,k)]
+        frame = self.__lastValues.get(topic)
+        return [(topic,frame)] if frame else []
+
+    def next_seq(self,topic:str)->int:
+        """生成话题下一条消息的序号"""
+        seq = self.get_seq(topic) + 1
+        self.__seqs[topic] = seq
+        return seq
+
+    def get_seq(self,topic:str)->int:
+        """获取话题最后发布的序号，服务重启后从持久化的话题日志中恢复"""
+        seq = self.__seqs.get(topic)
+        if seq is None:
+            seq = self.__seqs[topic] = self.__topicLog.last_seq(topic) if self.__topicLog else 0
+        return seq
+
+    def persist(self,topic:str,seq:int,frame:EncodedResponse)->None:
+        """将消息写入持久化的话题日志(只放入内存，由后台任务批量写入磁盘)"""
+        if self.__topicLog is not None:
+            self.__topicLog.append(topic,seq,frame)
+
+    def replay_size(self,topic:str,opt:TopicOption=None)->int:
+        """获取话题的重放缓冲区大小"""
+        opt = opt or self.__options.get(topic)
+        if opt and opt.replay is not None:
+            return opt.replay
+        return self.__replaySize
+
+    def add_replay(self,topic:str,seq:int,frame:EncodedResponse,opt:TopicOption=None)->None:
+        """将消息放入话题的重放缓冲区，缓冲区已满时丢弃最旧的消息"""
+        buffer:deque = self.__replays.get(topic)
+        if buffer is None:
+            size = self.replay_size(topic,opt)
+            if not size:
+                return
+            buffer = self.__replays[topic] = deque(maxlen=size)
+        buffer.append((seq,frame))
+
+    def get_replay(self,topic:str,lastSeq:int,preload:List[tuple[int,EncodedResponse]]=None)->tuple[List[EncodedResponse],bool]:
+        """# 获取序号`lastSeq`之后的消息
+        依次从预先读取的消息、重放缓冲区、话题日志中还未写入磁盘的消息中获取
+        Args:
+            topic: 话题
+            lastSeq: 客户端最后收到的序号
+            preload: 从话题日志中预先读取的消息 [(序号,消息),...]
+        Returns:
+            消息列表, 是否完整(是否覆盖了全部错过的消息)
+        """
+        seq = self.get_seq(topic)
+        if lastSeq >= seq:
+            # lastSeq大于当前序号时，说明服务端的序号已经重置
+            return [],lastSeq == seq
+        frames = []
+        complete = True
+        if preload:
+            complete = preload[0][0] <= lastSeq+1
+            frames = [f for _,f in preload]
+            lastSeq = preload[-1][0]
+            if lastSeq >= seq:
+                return frames,complete
+
+        buffer:deque = self.__replays.get(topic)
+        if buffer and buffer[0][0] <= lastSeq+1:
+            return frames+[f for s,f in buffer if s > lastSeq],complete
+        memory = self.__topicLog.read_pending(topic,lastSeq) if self.__topicLog else None
+        if memory and memory[0][0] <= lastSeq+1:
+            return frames+[f for _,f in memory],complete
+        if buffer:
+            return frames+[f for s,f in buffer if s > lastSeq],False
+        return frames,False
+
+    async def load_replay(self,lastSeq:dict)->dict:
+        """# 从话题日志的磁盘文件中读取重放缓冲区不能覆盖的消息
+        每次读取后重新检查，直到剩余的消息都可以从内存中获取
+        Args:
+            lastSeq: 每个话题最后收到的序号 {话题:序号}
+        Returns:
+            {话题:[(序号,消息),...]}
+        """
+        res = dict()
+        if self.__topicLog is None:
+            return res
+        cursor = dict((normalize_topic(t),int(s)) for t,s in lastSeq.items())
+        while True:
+            need = [(k,s) for k,s in cursor.items() if not self.get_replay(k,s)[1]]
+            progressed = False
+            for key,after in need:
+                records = await self.__topicLog.read(key,after)
+                if records:
+                    progressed = True
+                    res.setdefault(key,[]).extend((s,EncodedResponse.from_text(text)) for s,text in records)
+                    cursor[key] = records[-1][0]
+            if not progressed:
+                return res
 
     def get_sub_by_id(self,subId:str)->ClientConnection:
         """通过id获取订阅者的客户端连接实例"""
         return self.__subscribes.get(subId)
 
-    def get_subId_by_topic(self,topic:str)->list:
-        """获取指定话题下所有的订阅者的id"""
-        all_subId:list = self.__topics.get(topic.lower().strip())
-        all_subId = all_subId or []
-        return all_subId
+    def get_subId_by_topic(self,topic:str)->set:
+        """获取指定话题下所有的订阅者的id，包括通配符话题匹配到的订阅者"""
+        topic = normalize_topic(topic)
+        subIds:set = self.__topics.get(topic) or frozenset()
+        if not self.__patterns:
+            return subIds
+        patterns = self.__patterns.match(topic)
+        if not patterns:
+            return subIds
+        subIds = set(subIds)
+        for p in patterns:
+            subIds.update(self.__topics[p])
+        return subIds
 
 
 class BaseDataModel:
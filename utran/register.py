@@ -1,13 +1,21 @@
 
 import asyncio
+import contextvars
 import inspect
+import time
 from functools import partial
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Callable
 
 from utran.object import BaseDataModel, UtState
 from utran.log import logger
-from utran.utils import asyncfn_runner
+from utran.utils import asyncfn_runner, timed_runner
+from utran.cache import ResultCache, RawJson
+from utran.worker import WorkerPool, PinnedWorker, resource_params
+from utran.executor import ElasticPool
+from utran import worker
+from utran import shm
 
 def allowType(v,t,n):
     """ 
@@ -66,6 +74,10 @@ def cheekType(params:tuple,annotations:dict,args:tuple,dicts:dict={})->tuple:
 
 
 
+OFFLOAD_ALPHA = 0.2            # 执行耗时移动平均的权重
+OFFLOAD_MIN_SAMPLES = 5        # 切换执行方式前最少的执行次数
+
+
 class RMethod:
     """
     #存放注册方法的数据类
@@ -84,6 +96,25 @@ class RMethod:
         varkw (str): 参数中**dicts的名称
         returnType (str): 返回值的类型
         asyncfunc (bool): 是否为异步函数或方法
+        useProcess (bool): 是否在进程池中执行
+        useThread (bool): 是否在线程池中执行，只对同步函数有效，适用于阻塞的IO操作
+        offloadBudget (float): 自动卸载的耗时预算(单位:秒)，只对未指定useProcess和useThread的同步函数有效。
+            平均执行耗时超过预算后自动转到执行器中执行，低于预算的一半后恢复在事件循环中直接执行，为None或0时不开启
+        offloadTarget (str): 自动卸载的目标 'thread'(线程池) / 'process'(进程池，服务端没有进程池时使用线程池)
+        cache (ResultCache): 结果缓存，注册选项`cache=True`时创建，相同参数的调用直接返回缓存的结果
+        singleFlight (bool): 合并相同参数的并发调用，只执行第一个调用，其余的调用等待并共享同一个结果或错误
+        shmThreshold (int): 进程中执行时超过该字节数的参数和返回值通过共享内存传递(见`utran.shm`)，为None或0时不使用共享内存
+        pinned (PinnedWorker): 注册类时使用选项`pinProcess=True`，方法在该类固定的工作进程中执行(见`utran.worker`)
+        maxConcurrency (int): 最多同时执行的调用数量，超过后排队等待，为None时不限制。每个注册函数单独限制，
+            繁忙的函数不会占用其他函数的执行资源
+        maxQueue (int): 最多排队等待的调用数量，超过后立即拒绝调用，返回状态`UtState.REJECTED`，为None时不限制，只在设置了maxConcurrency时有效
+        timeout (float): 执行超时(单位:秒)，包括排队等待的时间，超时后取消执行并返回失败，为None时不限制。
+            线程池和进程池中已经开始执行的同步函数无法中断，只是不再等待其结果
+        batch (bool): 合并执行，`batchWindow`时间内或达到`maxBatchSize`个的并发调用合并为一次执行。
+            注册函数只有一个参数，接收每个调用的参数组成的列表，返回相同长度的结果列表，每个调用得到对应位置的结果。
+            每个调用只能传递一个参数(列表参数或字典参数均可)，需要多个值时可以传递列表或字典
+        batchWindow (float): 合并调用的等待时间(单位:秒)，从第一个调用开始计算
+        maxBatchSize (int): 每次合并执行最多的调用数量
     """
   
     __slots__ = ('name',
@@ -100,7 +131,31 @@ class RMethod:
                  'varkw',
                  'returnType',
                  'asyncfunc',
-                 'useProcess')
+                 'useProcess',
+                 'useThread',
+                 'offloadBudget',
+                 'offloadTarget',
+                 '_cost',
+                 '_samples',
+                 '_offloaded',
+                 'cache',
+                 '_signature',
+                 'singleFlight',
+                 '_inflight',
+                 'shmThreshold',
+                 'pinned',
+                 'maxConcurrency',
+                 'maxQueue',
+                 '_semaphore',
+                 '_running',
+                 '_queued',
+                 'timeout',
+                 'batch',
+                 'batchWindow',
+                 'maxBatchSize',
+                 '_batch',
+                 '_batchTimer',
+                 '_resources')
 
     def __init__(self,
                  name:str,
@@ -108,7 +163,22 @@ class RMethod:
                  callable:callable,
                  checkParams:bool,
                  checkReturn:bool,
-                 useProcess:bool=False) -> None:
+                 useProcess:bool=False,
+                 useThread:bool=False,
+                 offloadBudget:float=None,
+                 offloadTarget:str='thread',
+                 cache:bool=False,
+                 cacheTtl:float=None,
+                 cacheMaxsize:int=1024,
+                 singleFlight:bool=False,
+                 shmThreshold:int=shm.SHM_THRESHOLD,
+                 pinned:PinnedWorker=None,
+                 maxConcurrency:int=None,
+                 maxQueue:int=None,
+                 timeout:float=None,
+                 batch:bool=False,
+                 batchWindow:float=0.005,
+                 maxBatchSize:int=256) -> None:
         """"""
         self.name = name
         self.methodType = methodType
@@ -116,6 +186,32 @@ class RMethod:
         self.checkParams = checkParams
         self.checkReturn = checkReturn     
         self.useProcess = useProcess
+        self.useThread = useThread
+        if offloadTarget not in ('thread','process'):
+            raise ValueError(f"Registration error,offloadTarget '{offloadTarget}' must be 'thread' or 'process'")
+        self.offloadBudget = offloadBudget
+        self.offloadTarget = offloadTarget
+        self._cost:float = 0.0           # 执行耗时的指数加权移动平均值
+        self._samples:int = 0
+        self._offloaded:bool = False
+        self.cache:ResultCache = ResultCache(cacheMaxsize,cacheTtl) if cache else None
+        self._signature = inspect.signature(self.callable)
+        self.singleFlight = singleFlight
+        self._inflight = dict()          # {参数的键:[asyncio.Task,等待的调用数量]}
+        self.shmThreshold = shmThreshold
+        self.pinned = pinned
+        self.maxConcurrency = maxConcurrency
+        self.maxQueue = maxQueue
+        self._semaphore:asyncio.Semaphore = None     # 在事件循环中首次调用时创建
+        self._running = 0                # 执行中的调用数量
+        self._queued = 0                 # 等待并发名额的调用数量
+        self.timeout = timeout
+        self.batch = batch
+        self.batchWindow = batchWindow
+        self.maxBatchSize = maxBatchSize
+        self._batch:list = []            # [(参数,asyncio.Future)]，等待合并执行的调用
+        self._batchTimer:asyncio.TimerHandle = None
+        self._resources:dict = resource_params(self.callable)     # {参数名:资源名称}，在工作进程中注入
         self.cls: str = '' if not inspect.ismethod(self.callable) else self.callable.__self__.__class__.__name__
         self.params:tuple = tuple(inspect.signature(self.callable).parameters.keys())        
         self.default_values:tuple= tuple([i.default for i in tuple(inspect.signature(self.callable).parameters.values()) if i.default is not inspect._empty])
@@ -129,18 +225,280 @@ class RMethod:
         self.varkw:str = sp.varkw
         self.returnType:str = sp.annotations.get('return')
         self.asyncfunc:bool = inspect.iscoroutinefunction(self.callable)
+        if self.pinned is not None:
+            self.pinned.add(self.key,self.callable.__name__)
+        if self.batch and len([p for p in self.params if p not in self._resources]) != 1:
+            raise ValueError(f"Registration error,the batch function '{self.name}' must take exactly one parameter to receive the list of arguments")
+        if not self.useProcess and self._resources:
+            raise ValueError(f"Registration error,'{self.name}' has Resource parameters and must be registered with useProcess=True")
+        if self.pinned is not None and self._resources:
+            raise ValueError(f"Registration error,'{self.name}' has Resource parameters, the pinned process does not run onWorkerStart")
+
+
+    @property
+    def key(self)->str:
+        """注册函数在工作进程中的键"""
+        return f'{self.methodType}:{self.name}'
+
+    @property
+    def runInProcess(self)->bool:
+        """是否可能在进程池中执行"""
+        if self.pinned is not None:
+            return False
+        return self.useProcess or bool(self.offloadBudget and self.offloadTarget == 'process' and not self.asyncfunc)
 
+    @property
+    def running(self)->int:
+        """执行中的调用数量"""
+        return self._running
+
+    @property
+    def queued(self)->int:
+        """等待并发名额的调用数量"""
+        return self._queued
+
+    @property
+    def offloaded(self)->bool:
+        """是否已经自动卸载到执行器中执行"""
+        return self._offloaded
+
+    @property
+    def cost(self)->float:
+        """执行耗时的移动平均值(单位:秒)"""
+        return self._cost
+
+    def __observe(self,cost:float)->None:
+        """记录一次执行耗时，根据耗时切换执行方式，切换阈值之间留有间隔，避免频繁切换"""
+        self._samples += 1
+        self._cost = cost if self._samples == 1 else self._cost+OFFLOAD_ALPHA*(cost-self._cost)
+        if self._samples < OFFLOAD_MIN_SAMPLES:
+            return
+        if not self._offloaded and self._cost > self.offloadBudget:
+            self._offloaded = True
+            logger.warning(f'"{self.name}" average cost {self._cost*1000:.2f}ms exceeds the budget, offload to {self.offloadTarget}')
+        elif self._offloaded and self._cost < self.offloadBudget/2:
+            self._offloaded = False
+            logger.info(f'"{self.name}" average cost {self._cost*1000:.2f}ms, run inline')
+
+    async def __adaptive_call(self,args:tuple,dicts:dict,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor):
+        """根据执行耗时自动选择在事件循环中直接执行或者在执行器中执行"""
+        if not self._offloaded:
+            t = time.perf_counter()
+            res = self.callable(*args,**dicts)
+            self.__observe(time.perf_counter()-t)
+            return res
+        loop = asyncio.get_running_loop()
+        if self.offloadTarget == 'process' and pool is not None:
+            if isinstance(pool,(WorkerPool,ElasticPool)) and pool.has(self.key):
+                fn = partial(worker.timed_call,self.key,args,dicts)
+            else:
+                fn = partial(timed_runner,self.callable,args,dicts)
+            res,cost = await loop.run_in_executor(pool,fn)
+        else:
+            ctx = contextvars.copy_context()
+            res,cost = await loop.run_in_executor(threadPool,partial(ctx.run,timed_runner,self.callable,args,dicts))
+        self.__observe(cost)
+        return res
 
-    async def execute(self,args:tuple,dicts:dict,pool:ProcessPoolExecutor=None)->tuple[UtState,any,str]:
+    async def execute(self,args:tuple,dicts:dict,pool:ProcessPoolExecutor=None,threadPool:ThreadPoolExecutor=None)->tuple[UtState,any,str]:
         """ 执行注册的函数或方法
         Args:
             args: 列表参数
             dicts: 字典参数
             pool: 进程池
+            threadPool: 线程池，为None时使用事件循环默认的线程池
             
         Returns:
             返回值：状态，结果，错误信息
         """
+        # 使用转换前的参数生成缓存和合并调用的键
+        key = ResultCache.make_key(self._signature,args,dicts) if self.cache is not None or self.singleFlight else None
+        if key is not None and self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return UtState.SUCCESS,cached,''
+        if key is not None and self.singleFlight:
+            coro = self.__single_flight(key,args,dicts,pool,threadPool)
+        elif self.batch:
+            coro = self.__batched(args,dicts,pool,threadPool)
+        else:
+            coro = self.__limited(key,args,dicts,pool,threadPool)
+        state,result,error = await self.__with_timeout(coro)
+        if self.batch and key is not None and self.cache is not None and state == UtState.SUCCESS:
+            # 合并执行时按每个调用的参数缓存结果
+            result = self.cache.put(key,result)
+        return state,result,error
+
+    async def __with_timeout(self,coro)->tuple[UtState,any,str]:
+        """超过timeout时取消执行，返回失败的结果"""
+        if not self.timeout:
+            return await coro
+        try:
+            return await asyncio.wait_for(coro,self.timeout)
+        except asyncio.TimeoutError:
+            return UtState.FAILED,None,f'The call of "{self.name}" timed out after {self.timeout}s'
+
+    async def map(self,chunk:list,pool:ProcessPoolExecutor=None,threadPool:ThreadPoolExecutor=None)->tuple[UtState,list,str]:
+        """# 对一组参数逐个执行
+        - 合并执行(batch)的函数，整组参数作为列表参数执行一次
+        - 进程中执行的注册函数，整组参数只提交一次到进程池
+        - 其他的逐个调用`execute`
+
+        前两种情况整组作为一次调用，受并发限制和timeout约束，并检查参数和返回值
+        Args:
+            chunk: 参数列表，每个元素作为一次调用的唯一参数
+
+        Returns:
+            返回值：状态，结果列表，错误信息
+        """
+        if self.batch:
+            state,results,error = await self.__with_timeout(self.__limited(None,(list(chunk),),dict(),pool,threadPool))
+            if state == UtState.SUCCESS and (type(results) not in (list,tuple) or len(results) != len(chunk)):
+                return UtState.FAILED,None,f'The batch function "{self.name}" must return a list of {len(chunk)} results'
+            return state,(list(results) if state == UtState.SUCCESS else None),error
+
+        if not self.useProcess:
+            results = []
+            for x in chunk:
+                state,result,error = await self.execute((x,),dict(),pool,threadPool)
+                if state != UtState.SUCCESS:
+                    return state,None,error
+                results.append(result.value if isinstance(result,RawJson) else result)
+            return UtState.SUCCESS,results,''
+
+        return await self.__with_timeout(self.__limited(None,(chunk,),dict(),pool,threadPool,self.__execute_chunk))
+
+    def __process_pool(self,pool:ProcessPoolExecutor)->tuple[ProcessPoolExecutor,bool]:
+        """进程中执行时使用的进程池，以及工作进程中是否已有该注册函数"""
+        if self.pinned is not None:
+            return self.pinned.executor,True
+        if pool is None:
+            logger.error(f'The function "{self.name}" runs in a child process, but the server has no worker process')
+            raise RuntimeError(f'The function "{self.name}" runs in a child process, but the server has no worker process')
+        inWorker = isinstance(pool,(WorkerPool,ElasticPool)) and pool.has(self.key)
+        if self._resources and not inWorker:
+            # 资源只在工作进程的注册表中注入，例如自定义的进程池或者启动后注册的函数
+            raise RuntimeError(f'The function "{self.name}" has Resource parameters {tuple(self._resources.values())}, but the process pool does not have it in the worker registry')
+        return pool,inWorker
+
+    def __broken(self,pool:ProcessPoolExecutor,e:BrokenProcessPool)->str:
+        """进程意外退出，固定的工作进程重新启动，之后的调用不受影响。返回错误信息"""
+        if self.pinned is not None:
+            self.pinned.restart(pool)
+        return f'The process of "{self.name}" exited unexpectedly: {e}'
+
+    async def __execute_chunk(self,key:str,args:tuple,dicts:dict,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor)->tuple[UtState,list,str]:
+        """整组参数提交一次到进程池，逐个检查参数和返回值"""
+        chunk:list = args[0]
+        try:
+            if self.checkParams:
+                chunk = [cheekType(self.params,self.annotations,(x,))[0][0] for x in chunk]
+            pool,inWorker = self.__process_pool(pool)
+            loop = asyncio.get_running_loop()
+            results = await loop.run_in_executor(pool,partial(worker.map_call,self.key if inWorker else self.callable,chunk))
+        except BrokenProcessPool as e:
+            return UtState.FAILED,None,self.__broken(pool,e)
+        except Exception as e:
+            return UtState.FAILED,None,str(e)
+        if self.checkReturn and self.returnType:
+            try:
+                results = [allowType(res,self.returnType,self.name) for res in results]
+            except:
+                return UtState.FAILED,None,f"Return value error.The results are not of '{self.returnType}' type"
+        return UtState.SUCCESS,results,''
+
+    async def __batched(self,args:tuple,dicts:dict,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor)->tuple[UtState,any,str]:
+        """等待合并执行，返回该调用对应位置的结果"""
+        if len(args)+len(dicts) != 1:
+            return UtState.FAILED,None,f'The batch function "{self.name}" takes exactly one argument per call'
+        item = args[0] if args else next(iter(dicts.values()))
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((item,future))
+        if len(self._batch) >= self.maxBatchSize:
+            self.__flush(pool,threadPool)
+        elif self._batchTimer is None:
+            self._batchTimer = loop.call_later(self.batchWindow,self.__flush,pool,threadPool)
+        return await future
+
+    def __flush(self,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor)->None:
+        """取出等待中的调用，合并执行"""
+        if self._batchTimer is not None:
+            self._batchTimer.cancel()
+            self._batchTimer = None
+        batch,self._batch = self._batch,[]
+        if batch:
+            asyncio.create_task(self.__run_batch(batch,pool,threadPool))
+
+    async def __run_batch(self,batch:list,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor)->None:
+        items = [item for item,_ in batch]
+        try:
+            state,result,error = await self.__limited(None,(items,),dict(),pool,threadPool)
+        except BaseException as e:
+            state,result,error = UtState.FAILED,None,f'The batch call of "{self.name}" was cancelled' if isinstance(e,asyncio.CancelledError) else str(e)
+        if state == UtState.SUCCESS and (type(result) not in (list,tuple) or len(result) != len(items)):
+            state,result,error = UtState.FAILED,None,f'The batch function "{self.name}" must return a list of {len(items)} results'
+        for i,(_,future) in enumerate(batch):
+            if future.done():
+                continue
+            if state == UtState.SUCCESS:
+                future.set_result((state,result[i],''))
+            else:
+                future.set_result((state,None,error))
+
+    async def __limited(self,key:str,args:tuple,dicts:dict,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor,run=None)->tuple[UtState,any,str]:
+        """限制并发执行的调用数量，排队已满时拒绝调用。run为实际执行的协程函数，默认为`__execute`"""
+        run = run or self.__execute
+        if not self.maxConcurrency:
+            self._running += 1
+            try:
+                return await run(key,args,dicts,pool,threadPool)
+            finally:
+                self._running -= 1
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.maxConcurrency)
+        if self._semaphore.locked():
+            if self.maxQueue is not None and self._queued >= self.maxQueue:
+                return UtState.REJECTED,None,f'The call of "{self.name}" was rejected, {self._running} running and {self._queued} queued'
+        self._queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+        self._running += 1
+        try:
+            return await run(key,args,dicts,pool,threadPool)
+        finally:
+            self._running -= 1
+            self._semaphore.release()
+
+    async def __single_flight(self,key:str,args:tuple,dicts:dict,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor)->tuple[UtState,any,str]:
+        """相同参数的并发调用只执行一次，其余的调用等待并共享同一个结果。
+        执行在独立的任务中，单个调用被取消不影响其他等待的调用，所有调用都被取消时才取消执行"""
+        flight:list = self._inflight.get(key)
+        if flight is None:
+            if self.batch:
+                task = asyncio.create_task(self.__batched(args,dicts,pool,threadPool))
+            else:
+                task = asyncio.create_task(self.__limited(key,args,dicts,pool,threadPool))
+            flight = self._inflight[key] = [task,0]     # [执行的任务,等待的调用数量]
+            task.add_done_callback(lambda t:self._inflight.pop(key,None) if self._inflight.get(key) is flight else None)
+        task:asyncio.Task = flight[0]
+        flight[1] += 1
+        try:
+            # shield: 等待中的调用被取消时不影响执行中的任务
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                return UtState.FAILED,None,f'The call of "{self.name}" was cancelled'
+            raise
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not task.done():
+                task.cancel()
+
+    async def __execute(self,key:str,args:tuple,dicts:dict,pool:ProcessPoolExecutor,threadPool:ThreadPoolExecutor)->tuple[UtState,any,str]:
         result = None
         state = UtState.SUCCESS
         error = ''
@@ -157,17 +515,46 @@ class RMethod:
             # 2.执行注册函数
             if self.useProcess:
                 # 进程中执行
-                if pool is None: 
-                    logger.error(f'The function "{self.name}" runs in a child process, but the server has no worker process')
-                    raise RuntimeError(f'The function "{self.name}" runs in a child process, but the server has no worker process')
-
-                if self.asyncfunc:
+                pool,inWorker = self.__process_pool(pool)
+                if self.shmThreshold:
+                    # 超过阈值的参数和返回值通过共享内存传递
+                    args,dicts,segments = shm.share(args,dicts,self.shmThreshold)
+                    fn = partial(shm.shared_call,self.key if inWorker else self.callable,args,dicts,self.shmThreshold)
+                elif inWorker:
+                    # 工作进程中已有该注册函数，只发送键和参数
+                    fn = partial(worker.call,self.key,args,dicts)
+                elif self.asyncfunc:
                     fn = partial(asyncfn_runner,self.callable,*args,**dicts)
                 else:
                     fn = partial(self.callable,*args,**dicts)
 
                 loop = asyncio.get_event_loop()
-                res = await loop.run_in_executor(pool,fn)
+                if self.shmThreshold:
+                    future = pool.submit(fn)
+                    abandoned = False
+                    try:
+                        res = shm.receive(await asyncio.wrap_future(future))
+                    except asyncio.CancelledError:
+                        # 不再等待结果，执行结束后再删除参数和返回值的共享内存
+                        abandoned = True
+                        future.add_done_callback(partial(shm.discard,segments=segments))
+                        raise
+                    finally:
+                        if not abandoned:
+                            shm.release(segments)
+                else:
+                    res = await loop.run_in_executor(pool,fn)
+
+            elif self.useThread and not self.asyncfunc:
+                # 线程中执行，复制当前的上下文变量到执行线程
+                ctx = contextvars.copy_context()
+                fn = partial(ctx.run,self.callable,*args,**dicts)
+                loop = asyncio.get_running_loop()
+                res = await loop.run_in_executor(threadPool,fn)
+
+            elif self.offloadBudget and not self.asyncfunc:
+                # 根据执行耗时自动卸载
+                res = await self.__adaptive_call(args,dicts,pool,threadPool)
 
             else:
                 if self.asyncfunc:
@@ -187,9 +574,16 @@ class RMethod:
                     error = f"Return value error.'{type(res)}' is not of '{self.returnType}' type"
             else:                
                 result = res
+        except BrokenProcessPool as e:
+            state = UtState.FAILED
+            error = self.__broken(pool,e)
         except Exception as e:
             state = UtState.FAILED
             error = str(e)
+
+        # 4.缓存成功的结果
+        if key is not None and self.cache is not None and state == UtState.SUCCESS:
+            result = self.cache.put(key,result)
         
         return state,result,error
 
@@ -203,11 +597,14 @@ class Register:
         checkParams (bool): 调用注册函数或方法时，是否检查参数类型，开启后当类型为数据模型时可以自动转换
         checkReturn (bool): 调用注册函数或方法时，是否检查返回值类型，开启后当类型为数据模型时可以自动转换
         pool: 进程池对象
+        offloadBudget (float): 同步函数自动卸载的默认耗时预算(单位:秒)，可在注册时通过选项覆盖，为None时不开启
+        onWorkerStart (callable): 每个工作进程启动时执行一次，返回资源 {名称:资源}，注册函数通过默认值为`Resource(名称)`的参数获取资源
+        onWorkerStop (callable): 每个工作进程退出时执行一次，参数为资源 {名称:资源}
     注:只有注册函数或方法指定了类型时以上参数才会起作用
     """
-    __slots__ = ('__rpc_methods','__get_methods','__post_methods','__checkParams','__checkReturn','_temp_opts','_workers')
+    __slots__ = ('__rpc_methods','__get_methods','__post_methods','__checkParams','__checkReturn','_temp_opts','_workers','__offloadBudget','__pinned','onWorkerStart','onWorkerStop')
 
-    def __init__(self,checkParams:bool=True,checkReturn:bool=True,workers:int=0) -> None:
+    def __init__(self,checkParams:bool=True,checkReturn:bool=True,workers:int=0,offloadBudget:float=None,onWorkerStart=None,onWorkerStop=None) -> None:
         self.__rpc_methods = dict()     # {method_name:{callable:callable,}}
         self.__get_methods = dict()     # {path:{callable:callable,info:{}}}
         self.__post_methods = dict()    # {path:{callable:callable,info:{}}}
@@ -215,6 +612,10 @@ class Register:
         self.__checkReturn = checkReturn
         self._temp_opts = dict()
         self._workers = workers
+        self.__offloadBudget = offloadBudget
+        self.__pinned = dict()          # {类注册的名称:PinnedWorker}
+        self.onWorkerStart = onWorkerStart
+        self.onWorkerStop = onWorkerStop
 
     @property
     def methods_of_get(self):
@@ -227,6 +628,11 @@ class Register:
     @property
     def methods_of_rpc(self):
         return self.__rpc_methods
+
+    @property
+    def pinned_workers(self)->list[PinnedWorker]:
+        """注册类时使用选项`pinProcess=True`创建的固定工作进程"""
+        return list(self.__pinned.values())
     
 
     def rpc(self,*fn,name=None,ins_args:tuple=tuple(),ins_kwds:dict=dict(),**opts):
@@ -239,7 +645,7 @@ class Register:
             name (str): 被远程调用的方法名称，非`class`为可选，`class`为必填
             ins_args (tuple): 只有注册`class`时才有这个选项，为类实例化的参数
             ins_kwds (dict): 只有注册`class`时才有这个选项，为类实例化的关键字参数
-            **opts: 选项。例如: useProcess = True 使用子进程执行，还有 checkParams、checkReturn等
+            **opts: 选项。例如: useProcess = True 使用子进程执行，useThread = True 使用线程池执行，cache = True 缓存结果，singleFlight = True 合并相同参数的并发调用，pinProcess = True 注册类时在固定的工作进程中实例化，maxConcurrency = 4 最多同时执行4个调用，timeout = 5 执行超时，batch = True 合并并发的调用，还有 offloadBudget、checkParams、checkReturn等
 
         注: 注册非`class`或`class`实例时，可支持无参调用 `@register.rpc`
             
@@ -250,7 +656,7 @@ class Register:
             name (str): 被远程调用的方法名称
             ins_args (tuple): 只有注册`class`时才有这个选项，为类实例化的参数
             ins_kwds (dict): 只有注册`class`时才有这个选项，为类实例化的关键字参数
-            **opts: 选项。例如: useProcess = True 使用子进程执行，还有 checkParams、checkReturn等
+            **opts: 选项。例如: useProcess = True 使用子进程执行，useThread = True 使用线程池执行，cache = True 缓存结果，singleFlight = True 合并相同参数的并发调用，pinProcess = True 注册类时在固定的工作进程中实例化，maxConcurrency = 4 最多同时执行4个调用，timeout = 5 执行超时，batch = True 合并并发的调用，还有 offloadBudget、checkParams、checkReturn等
 
         """  
         fn = fn[0] if fn else None
@@ -273,7 +679,7 @@ class Register:
             path (str): 注册的路径名称，非`class`为可选，`class`为必填
             ins_args (tuple): 只有注册`class`时才有这个选项，为类实例化的参数
             ins_kwds (dict): 只有注册`class`时才有这个选项，为类实例化的关键字参数
-            **opts: 选项。例如: useProcess = True 使用子进程执行，还有 checkParams、checkReturn等
+            **opts: 选项。例如: useProcess = True 使用子进程执行，useThread = True 使用线程池执行，cache = True 缓存结果，singleFlight = True 合并相同参数的并发调用，pinProcess = True 注册类时在固定的工作进程中实例化，maxConcurrency = 4 最多同时执行4个调用，timeout = 5 执行超时，batch = True 合并并发的调用，还有 offloadBudget、checkParams、checkReturn等
 
 
         注: 注册非`class`或`class`实例时，可支持无参调用 `@register.get`
@@ -285,7 +691,7 @@ class Register:
             path (str): 注册的路径名称
             ins_args (tuple): 只有注册`class`时才有这个选项，为类实例化的参数
             ins_kwds (dict): 只有注册`class`时才有这个选项，为类实例化的关键字参数
-            **opts: 选项。例如: useProcess = True 使用子进程执行，还有 checkParams、checkReturn等
+            **opts: 选项。例如: useProcess = True 使用子进程执行，useThread = True 使用线程池执行，cache = True 缓存结果，singleFlight = True 合并相同参数的并发调用，pinProcess = True 注册类时在固定的工作进程中实例化，maxConcurrency = 4 最多同时执行4个调用，timeout = 5 执行超时，batch = True 合并并发的调用，还有 offloadBudget、checkParams、checkReturn等
 
         """
         fn = fn[0] if fn else None
@@ -306,7 +712,7 @@ class Register:
             path (str): 注册的路径名称，非`class`为可选，`class`为必填
             ins_args (tuple): 只有注册`class`时才有这个选项，为类实例化的参数
             ins_kwds (dict): 只有注册`class`时才有这个选项，为类实例化的关键字参数
-            **opts: 选项。例如: useProcess = True 使用子进程执行，还有 checkParams、checkReturn等
+            **opts: 选项。例如: useProcess = True 使用子进程执行，useThread = True 使用线程池执行，cache = True 缓存结果，singleFlight = True 合并相同参数的并发调用，pinProcess = True 注册类时在固定的工作进程中实例化，maxConcurrency = 4 最多同时执行4个调用，timeout = 5 执行超时，batch = True 合并并发的调用，还有 offloadBudget、checkParams、checkReturn等
 
         注: 注册非`class`或`class`实例时，可支持无参调用 `@register.post`
             
@@ -317,13 +723,49 @@ class Register:
             path (str): 注册的路径名称
             ins_args (tuple): 只有注册`class`时才有这个选项，为类实例化的参数
             ins_kwds (dict): 只有注册`class`时才有这个选项，为类实例化的关键字参数
-            **opts: 选项。例如: useProcess = True 使用子进程执行，还有 checkParams、checkReturn等
+            **opts: 选项。例如: useProcess = True 使用子进程执行，useThread = True 使用线程池执行，cache = True 缓存结果，singleFlight = True 合并相同参数的并发调用，pinProcess = True 注册类时在固定的工作进程中实例化，maxConcurrency = 4 最多同时执行4个调用，timeout = 5 执行超时，batch = True 合并并发的调用，还有 offloadBudget、checkParams、checkReturn等
 
         """ 
         fn = fn[0] if fn else None
         return self._register(fn,path,'post',ins_args=ins_args,ins_kwds=ins_kwds,opts=opts)
 
 
+    def process_registry(self)->dict:
+        """# 需要在进程池中执行的注册函数
+        创建进程池时发送给工作进程
+        Returns:
+            {键:可调用对象}
+        """
+        res = dict()
+        for methods in (self.__rpc_methods,self.__get_methods,self.__post_methods):
+            for rm in methods.values():
+                if rm.runInProcess:
+                    res[rm.key] = rm.callable
+        return res
+
+
+    def invalidate_cache(self,name:str,args:tuple=None,dicts:dict=None,methodType:str='rpc')->None:
+        """# 删除注册函数的缓存结果
+        Args:
+            name: 注册的名称或路径
+            args: 列表参数，args和dicts都为None时删除该函数全部的缓存
+            dicts: 字典参数
+            methodType: 注册类型 rpc / get / post
+        """
+        methods = {'rpc':self.__rpc_methods,'get':self.__get_methods,'post':self.__post_methods}.get(methodType)
+        if methods is None:
+            raise ValueError(f"methodType '{methodType}' must be rpc, get or post")
+        rm:RMethod = methods.get(name if methodType == 'rpc' else '/'+name.replace('.','/').lstrip('/').lower())
+        if rm is None or rm.cache is None:
+            return
+        if args is None and dicts is None:
+            rm.cache.invalidate()
+        else:
+            key = ResultCache.make_key(rm._signature,tuple(args or ()),dict(dicts or {}))
+            if key is not None:
+                rm.cache.invalidate(key)
+
+
     def creatRMethod(self,**opts):
         """# 创建RMethod实例，并保存到对应容器中。
         ## opts参数字段
@@ -334,11 +776,31 @@ class Register:
             checkParams? (bool): 可选，是否检查参数
             checkReturn? (bool): 可选，是否检查返回值
             useProcess? (bool):  可选，是否使用子进程执行
+            useThread? (bool):  可选，是否使用线程池执行(只对同步函数有效)
+            offloadBudget? (float): 可选，自动卸载的耗时预算(单位:秒)，为0时不开启
+            offloadTarget? (str): 可选，自动卸载的目标 'thread' / 'process'
+            cache? (bool): 可选，是否缓存执行结果，适用于幂等的查询函数
+            cacheTtl? (float): 可选，缓存的有效时间(单位:秒)，为None时不过期
+            cacheMaxsize? (int): 可选，最多缓存的结果数量，超过后淘汰最久未使用的结果
+            singleFlight? (bool): 可选，是否合并相同参数的并发调用
+            shmThreshold? (int): 可选，进程中执行时超过该字节数的参数和返回值通过共享内存传递，为0或None时不使用共享内存
+            pinned? (PinnedWorker): 可选，方法所属类固定的工作进程
+            maxConcurrency? (int): 可选，最多同时执行的调用数量，超过后排队等待
+            maxQueue? (int): 可选，最多排队等待的调用数量，超过后拒绝调用
+            timeout? (float): 可选，执行超时(单位:秒)，超时后取消执行并返回失败
+            batch? (bool): 可选，是否合并并发的调用，注册函数接收参数列表，返回结果列表
+            batchWindow? (float): 可选，合并调用的等待时间(单位:秒)
+            maxBatchSize? (int): 可选，每次合并执行最多的调用数量
         """
         name:str = opts.get('name')
         methodType:str = opts.get('methodType')
+        opts.pop('pinProcess',None)
 
         opts['useProcess'] = False if opts.get('useProcess') == None else opts.get('useProcess')
+        opts['useThread'] = False if opts.get('useThread') == None else opts.get('useThread')
+        if opts['useProcess'] and opts['useThread']:
+            raise ValueError(f"Registration error,'{name}' cannot use both useProcess and useThread")
+        opts['offloadBudget'] = self.__offloadBudget if opts.get('offloadBudget') == None else opts.get('offloadBudget')
         opts['checkParams'] = self.__checkParams if opts.get('checkParams') == None else opts.get('checkParams')
         opts['checkReturn'] = self.__checkReturn if opts.get('checkReturn') == None else opts.get('checkReturn')
 
@@ -383,7 +845,10 @@ class Register:
             else:
                 raise ValueError(f"Registration error,'{_f_}' cannot be used as a registered name!")
             
+        pinProcess = opts.get('pinProcess')
         if inspect.isfunction(_f_) or inspect.ismethod(_f_):
+            if pinProcess:
+                raise ValueError(f"Registration error,'{_n_ or _f_.__name__}' is a function, pinProcess can only be used to register a class or instance")
             if not _n_:
                 _n_ = _f_.__name__
             
@@ -404,7 +869,13 @@ class Register:
             if type(_n_)!=str:
                 raise ValueError(f"Registration error,The name '{_n_}' is not a string!")
             
-            if inspect.isclass(_f_):
+            pinned = None
+            if pinProcess:
+                # 在固定的工作进程中实例化，主进程中只创建未初始化的实例，用于读取方法的签名
+                pinned = PinnedWorker(_n_,_f_,ins_args,ins_kwds)
+                self.__pinned[_n_] = pinned
+                _instance = object.__new__(_f_) if inspect.isclass(_f_) else _f_
+            elif inspect.isclass(_f_):
                 _instance = _f_(*ins_args,**ins_kwds)
             else:
                 _instance = _f_
@@ -418,6 +889,8 @@ class Register:
                     method_name = f'{_n_}.{i}'
                     opts_:dict = dict(name=method_name,methodType=_t_,callable=_f)
                     opts_.update(opts)
+                    if pinned is not None:
+                        opts_.update(pinned=pinned,useProcess=True)
                     self.creatRMethod(**opts_)
                     
         return _f_
\ No newline at end of file
@@ -4,7 +4,10 @@ import asyncio
 from concurrent.futures import ProcessPoolExecutor
 
 from utran.register import Register
-from utran.object import SubscriptionContainer
+from utran.object import OverflowPolicy, SubscriptionContainer
+from utran.topiclog import TopicLog
+from utran.bridge import PublishBridge
+from utran.executor import ThreadPool
 
 
 class BaseServer(ABC):
@@ -18,14 +21,27 @@ class BaseServer(ABC):
         dataMaxsize (int):  传输数据支持的最大字节数
         limitHeartbeatInterval (int): 心跳检测的极限值(单位为:秒)。为了防止心跳攻击，默认为1s,两次心跳的间隔小于该值则会断开连接。
         dataEncrypt: 是否加密传输数据
-        workers: 进程数量
+        workers: 进程数量，弹性进程池的最少进程数量
+        maxWorkers: 弹性进程池的最多进程数量，大于workers时进程数量按排队的调用数量伸缩
+        workerIdleTimeout: 弹性进程池中进程空闲超过该时间(单位:秒)后缩容
+        workerGrowThreshold: 弹性进程池中排队的调用数量超过该值时扩容
         pool: 进程池对象
+        threads: 线程池的线程数量，注册选项为useThread的同步函数在线程池中执行，为None时使用默认数量
+        threadPool: 线程池对象
+        offloadBudget: 同步函数自动卸载的耗时预算(单位:秒)，为None时不开启
+        onWorkerStart: 每个工作进程启动时执行一次，返回资源 {名称:资源}
+        onWorkerStop: 每个工作进程退出时执行一次，参数为资源 {名称:资源}
+        queueMaxsize: 每个客户端连接推送消息发送队列的最大长度
+        overflowPolicy: 发送队列已满时的处理策略 drop_oldest / drop_newest / disconnect
+        replaySize: 每个话题默认的重放缓冲区大小，0为不缓存
+        topicLog: 可选，持久化的话题日志
+        bridge: 发布桥，用于其他线程和进程池的工作进程发布消息
 
     备注: 心跳需要客户端主动发起PING，服务端会被动响应PONG
     """
     __slots__=('_host','_port','_register','_sub_container','_severName','_checkParams','_checkReturn',
                '_dataMaxsize','_dataEncrypt','_limitHeartbeatInterval','_server','_exitEvent',
-               '_workers','_pool')
+               '_workers','_maxWorkers','_workerIdleTimeout','_workerGrowThreshold','_pool','_threadPool','_queueMaxsize','_overflowPolicy','_bridge')
     def __init__(
             self,
             *,
@@ -38,19 +54,40 @@ class BaseServer(ABC):
             limitHeartbeatInterval: int = 1,
             dataEncrypt: bool = False,
             workers:int=0,
-            pool:ProcessPoolExecutor = None) -> None:
+            maxWorkers:int = None,
+            workerIdleTimeout:float = 60,
+            workerGrowThreshold:int = 0,
+            pool:ProcessPoolExecutor = None,
+            threads:int = None,
+            threadPool:ThreadPool = None,
+            offloadBudget:float = None,
+            onWorkerStart = None,
+            onWorkerStop = None,
+            queueMaxsize:int = 1024,
+            overflowPolicy:OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+            replaySize:int = 0,
+            topicLog:TopicLog = None,
+            bridge:PublishBridge = None) -> None:
 
         self._checkParams = checkParams
         self._checkReturn = checkReturn
         self._workers = workers
+        self._maxWorkers = maxWorkers
+        self._workerIdleTimeout = workerIdleTimeout
+        self._workerGrowThreshold = workerGrowThreshold
         self._pool = pool
-        self._register = register or Register(checkParams=checkParams,checkReturn=checkReturn,workers=workers)
-        self._sub_container = sub_container or SubscriptionContainer()
+        self._threadPool = threadPool or ThreadPool(threads)
+        self._register = register or Register(checkParams=checkParams,checkReturn=checkReturn,workers=workers,offloadBudget=offloadBudget,
+                                              onWorkerStart=onWorkerStart,onWorkerStop=onWorkerStop)
+        self._sub_container = sub_container or SubscriptionContainer(replaySize=replaySize,topicLog=topicLog)
+        self._bridge = bridge or PublishBridge(self._sub_container)
         self._severName = severName
         self._dataMaxsize = dataMaxsize
         self._dataEncrypt = dataEncrypt
         self._limitHeartbeatInterval = limitHeartbeatInterval
         self._exitEvent = asyncio.Event()
+        self._queueMaxsize = queueMaxsize
+        self._overflowPolicy = OverflowPolicy(overflowPolicy)
 
         self._server = None
 
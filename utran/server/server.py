@@ -1,11 +1,15 @@
 import asyncio
+from functools import partial
 from concurrent.futures import ProcessPoolExecutor
 
 from multiprocessing import Pool
 from utran.handler import process_publish_request
-from utran.object import UtRequest, UtType
+from utran.object import OverflowPolicy, UtRequest, UtType
 from utran.register import Register
 from utran.server.webserver import WebServer
+from utran.topiclog import TopicLog
+from utran.bridge import PublishBridge
+from utran.executor import ThreadPool, create_process_pool
 
 from utran.object import SubscriptionContainer
 
@@ -21,6 +25,20 @@ class Server:
         checkReturn (bool): 调用注册函数或方法时，是否检查返回值类型，开启后当类型为数据模型时可以自动转换
         dataMaxsize (int):  支持最大数据字节数
         limitHeartbeatInterval (int): 心跳检测的极限值，为了防止心跳攻击，默认为1s,两次心跳的间隔小于该值则会断开连接。
+        queueMaxsize (int): 每个客户端连接推送消息发送队列的最大长度
+        overflowPolicy (str): 发送队列已满时的处理策略 drop_oldest(丢弃最旧) / drop_newest(丢弃最新) / disconnect(断开连接)
+        replaySize (int): 每个话题默认的重放缓冲区大小，断线重连的客户端可以获取断线期间错过的消息，0为不缓存
+        topicLog (TopicLog): 可选，持久化的话题日志，服务重启后订阅者仍然可以从指定的序号开始重放消息
+        maxWorkers (int): 弹性进程池的最多进程数量，大于进程数量`workers`时，所有进程都在忙且有调用排队时启动新的进程，
+            空闲超过`workerIdleTimeout`(单位:秒)的进程关闭，进程数量不少于`workers`。为None时进程数量固定
+        workerGrowThreshold (int): 弹性进程池中排队的调用数量超过该值时才启动新的进程，默认为0(有调用排队即扩容)
+        threads (int): 线程池的线程数量，与进程数量`workers`分别配置。注册选项为useThread的同步函数在线程池中执行，为None时使用默认数量
+        offloadBudget (float): 同步函数自动卸载的耗时预算(单位:秒)，例如0.002。平均执行耗时超过预算的同步函数自动转到线程池中执行，
+            恢复到预算的一半以下后回到事件循环中直接执行。可在注册时通过选项`offloadBudget`覆盖，为None时不开启
+        onWorkerStart (callable): 每个工作进程启动时执行一次，返回资源 {名称:资源}，
+            注册函数通过默认值为`Resource(名称)`的参数获取资源，见`utran.worker`
+        onWorkerStop (callable): 每个工作进程退出时执行一次，参数为资源 {名称:资源}。
+            两个钩子会发送到工作进程中，需要可以被pickle序列化，请使用模块级别的函数而不是lambda
     """
     __slots__=(
         '_host',
@@ -37,7 +55,14 @@ class Server:
         '_rpcServer',
         '__isruning',
         '_workers',
-        '_pool')
+        '_maxWorkers',
+        '_workerIdleTimeout',
+        '_workerGrowThreshold',
+        '_pool',
+        '_threadPool',
+        '_queueMaxsize',
+        '_overflowPolicy',
+        '_bridge')
     
     def __init__(
             self,
@@ -50,22 +75,42 @@ class Server:
             dataMaxsize: int = 1024**2*10,   # 默认最大支持10M的数据传输
             limitHeartbeatInterval: int = 1,
             dataEncrypt: bool = False,
-            workers:int = 1) -> None:
+            workers:int = 1,
+            maxWorkers:int = None,
+            workerIdleTimeout:float = 60,
+            workerGrowThreshold:int = 0,
+            queueMaxsize:int = 1024,
+            overflowPolicy:OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+            replaySize:int = 0,
+            topicLog:TopicLog = None,
+            threads:int = None,
+            offloadBudget:float = None,
+            onWorkerStart = None,
+            onWorkerStop = None) -> None:
 
         self._checkParams = checkParams
         self._checkReturn = checkReturn
         
         self._workers = workers                             # 进程池数量        
-        self._register = register or Register(checkParams=checkParams,checkReturn=checkReturn,workers=workers)
-        self._sub_container = sub_container or SubscriptionContainer()
+        self._maxWorkers = maxWorkers
+        self._workerIdleTimeout = workerIdleTimeout
+        self._workerGrowThreshold = workerGrowThreshold
+        self._register = register or Register(checkParams=checkParams,checkReturn=checkReturn,workers=workers,offloadBudget=offloadBudget,
+                                              onWorkerStart=onWorkerStart,onWorkerStop=onWorkerStop)
+        self._sub_container = sub_container or SubscriptionContainer(replaySize=replaySize,topicLog=topicLog)
+        self._bridge = PublishBridge(self._sub_container)
         
         self._severName = severName
         self._dataMaxsize = dataMaxsize        
         self._limitHeartbeatInterval = limitHeartbeatInterval
         self._dataEncrypt = dataEncrypt
 
+        self._queueMaxsize = queueMaxsize
+        self._overflowPolicy = OverflowPolicy(overflowPolicy)
+
         self.__isruning=False
         self._pool = None
+        self._threadPool = ThreadPool(threads)
 
 
     async def start(self,
@@ -84,8 +129,11 @@ class Server:
         else: self.__isruning = True
 
         # 创建进程池
+        ownPool = False
         if self._workers>0 and self._pool is None:
-            self._pool = ProcessPoolExecutor(self._workers)
+            self._pool = create_process_pool(self._register,self._workers,self._bridge.queue,
+                                             self._maxWorkers,self._workerIdleTimeout,self._workerGrowThreshold)
+            ownPool = True
 
         self._host = host
         self._port= port
@@ -99,9 +147,18 @@ class Server:
             limitHeartbeatInterval= self._limitHeartbeatInterval, 
             dataEncrypt= self._dataEncrypt,
             workers=self._workers,
-            pool=self._pool)
+            pool=self._pool,
+            threadPool=self._threadPool,
+            queueMaxsize=self._queueMaxsize,
+            overflowPolicy=self._overflowPolicy,
+            bridge=self._bridge)
 
         await self._webServer.start(host,port,username=username,password=password)
+        if ownPool and self._pool is not None:
+            # 进程池由Server创建，WebServer退出后关闭
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None,partial(self._pool.shutdown,True,cancel_futures=True))
+            self._pool = None
 
 
     @property
@@ -113,6 +170,22 @@ class Server:
         return self._register
 
 
+    @property
+    def pool(self)->ProcessPoolExecutor:
+        """# 进程池
+        服务启动后创建，弹性进程池可以通过`pool.stats()`查看进程数量、排队中的调用数量和每个进程的利用率
+        """
+        return self._pool
+
+
+    @property
+    def threadPool(self)->ThreadPool:
+        """# 线程池
+        可以通过`threadPool.stats()`查看排队中和执行中的任务数量
+        """
+        return self._threadPool
+
+
     async def publish(self,id:int,msg:any,*topics:str)->None:
         """
         # 给指定topic推送消息
@@ -125,6 +198,30 @@ class Server:
 
 
 
+    def publish_threadsafe(self,msg:any,*topics:str)->None:
+        """
+        # 给指定topic推送消息，线程安全，不等待推送完成
+        可以在其他线程中调用，进程池的工作进程中请使用`utran.bridge.publish`
+        Args:
+            msg (dict): 消息
+            topics (str): 指定话题
+        """
+        self._bridge.put(msg,topics)
+
+
+    def set_topic_option(self,topic:str,lastValue:bool=False,conflate:bool=False,replay:int=None)->None:
+        """
+        # 设置话题选项
+        Args:
+            topic (str): 话题
+            lastValue (bool): 缓存话题最后一次发布的消息，新的订阅者订阅时立即收到该消息
+            conflate (bool): 合并推送，慢速订阅者的发送队列中只保留该话题最新的一条消息，
+                订阅者可以通过订阅时的maxRate参数限制该话题每秒最多推送的消息数量
+            replay (int): 该话题重放缓冲区的大小，为None时使用`replaySize`
+        """
+        self._sub_container.set_topic_option(topic,lastValue=lastValue,conflate=conflate,replay=replay)
+
+
     def exit(self):
         """退出程序"""
         self._webServer.exit()
\ No newline at end of file
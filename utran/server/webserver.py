@@ -1,5 +1,6 @@
 
 import asyncio
+from functools import partial
 from concurrent.futures import ProcessPoolExecutor
 import time
 import aiohttp
@@ -10,12 +11,18 @@ from aiohttp.web import Response as HttpResponse
 from aiohttp.web_ws import WebSocketResponse
 from aiohttp import WSMsgType,web_request
 from utran.handler import process_request
-from utran.object import HeartBeat, UtRequest, UtState, create_UtRequest
+from utran.object import HeartBeat, OverflowPolicy, UtRequest, UtState, UtType, create_UtRequest, create_compact_UtRequest
 
 from utran.register import RMethod, Register
 from utran.object import ClientConnection, SubscriptionContainer
 from utran.server.baseServer import BaseServer
 from utran.log import logger
+from utran.topiclog import TopicLog
+from utran.bridge import PublishBridge
+from utran.executor import ThreadPool, ElasticPool, create_process_pool
+from utran.worker import WorkerPool
+from utran.cache import dumps_with_raw
+from utran import codec
 
 
 
@@ -33,7 +40,20 @@ class WebServer(BaseServer):
                  limitHeartbeatInterval: int = 1, 
                  dataEncrypt: bool = False, 
                  workers: int = 0, 
-                 pool:ProcessPoolExecutor=None) -> None:
+                 maxWorkers:int = None,
+                 workerIdleTimeout:float = 60,
+                 workerGrowThreshold:int = 0,
+                 pool:ProcessPoolExecutor=None,
+                 threads:int = None,
+                 threadPool:ThreadPool = None,
+                 offloadBudget:float = None,
+                 onWorkerStart = None,
+                 onWorkerStop = None,
+                 queueMaxsize:int = 1024,
+                 overflowPolicy:OverflowPolicy = OverflowPolicy.DROP_OLDEST,
+                 replaySize:int = 0,
+                 topicLog:TopicLog = None,
+                 bridge:PublishBridge = None) -> None:
         super().__init__(
             register=register, 
             sub_container=sub_container, 
@@ -44,7 +64,20 @@ class WebServer(BaseServer):
             limitHeartbeatInterval=limitHeartbeatInterval, 
             dataEncrypt=dataEncrypt, 
             workers=workers, 
-            pool=pool)
+            maxWorkers=maxWorkers,
+            workerIdleTimeout=workerIdleTimeout,
+            workerGrowThreshold=workerGrowThreshold,
+            pool=pool,
+            threads=threads,
+            threadPool=threadPool,
+            offloadBudget=offloadBudget,
+            onWorkerStart=onWorkerStart,
+            onWorkerStop=onWorkerStop,
+            queueMaxsize=queueMaxsize,
+            overflowPolicy=overflowPolicy,
+            replaySize=replaySize,
+            topicLog=topicLog,
+            bridge=bridge)
         
         self.__auth:aiohttp.BasicAuth = aiohttp.BasicAuth('utranhost','utranhost')
 
@@ -58,8 +91,17 @@ class WebServer(BaseServer):
             self.__auth:aiohttp.BasicAuth = aiohttp.BasicAuth(username,password)
 
         # 创建进程池
+        ownPool = False
         if self._workers>0 and self._pool is None:
-            self._pool = ProcessPoolExecutor(self._workers)
+            self._pool = create_process_pool(self._register,self._workers,self._bridge.queue,
+                                             self._maxWorkers,self._workerIdleTimeout,self._workerGrowThreshold)
+            ownPool = True
+        if isinstance(self._pool,(WorkerPool,ElasticPool)):
+            # 预先启动工作进程，避免首次调用时等待进程启动
+            await self._pool.prewarm()
+        for pinned in self._register.pinned_workers:
+            pinned.start(self._bridge.queue)
+            await pinned.prewarm()
             
         server = web.Server(self.handle_request)
         runner = web.ServerRunner(server)
@@ -67,9 +109,30 @@ class WebServer(BaseServer):
         site = web.TCPSite(runner, self._host, self._port)
         await site.start()
         logger.success(f"\n{'='*6} {self._severName} on http://{site._host}:{site._port}/ {'='*6}")
+        self._bridge.start()
+        if self._sub_container.topicLog is not None:
+            self._sub_container.topicLog.start()
         await self._exitEvent.wait()
+        await self.shutdown_workers(ownPool)
+        self._bridge.close()
+        if self._sub_container.topicLog is not None:
+            await self._sub_container.topicLog.close()
         
 
+    async def shutdown_workers(self,pool:bool=True)->None:
+        """# 关闭固定进程和进程池
+        等待工作进程退出，工作进程退出时执行`onWorkerStop`
+        Args:
+            pool: 是否关闭进程池，外部传入的进程池由创建者关闭
+        """
+        loop = asyncio.get_running_loop()
+        for pinned in self._register.pinned_workers:
+            await loop.run_in_executor(None,partial(pinned.shutdown,True))
+        if pool and self._pool is not None:
+            await loop.run_in_executor(None,partial(self._pool.shutdown,True,cancel_futures=True))
+            self._pool = None
+
+
     async def handle_request(self,request:web_request.BaseRequest):
         """处理web请求,分发http请求和websocket请求"""
 
@@ -79,7 +142,8 @@ class WebServer(BaseServer):
             ticket = request.query.get('ticket')
             auth_header = request.headers.get('Authorization')
             
-            ws = WebSocketResponse(max_msg_size=self._dataMaxsize)
+            # 通过websocket子协议协商编解码器
+            ws = WebSocketResponse(max_msg_size=self._dataMaxsize,protocols=codec.subprotocols())
             await ws.prepare(request)  
 
             auth_64 = auth_header or ticket
@@ -134,12 +198,14 @@ class WebServer(BaseServer):
                 if '=' in p:
                     k,v = re.split(r"=", p, maxsplit=1)
                     dicts[k.strip()]=v.strip()
-            state,result,error = await rm.execute(args=tuple(),dicts=dicts,pool=self._pool)
+            state,result,error = await rm.execute(args=tuple(),dicts=dicts,pool=self._pool,threadPool=self._threadPool)
             execute_res['state'] = state.value
             execute_res['error'] = error
             execute_res['result'] = result
             if state == UtState.FAILED:
                 status=422
+            elif state == UtState.REJECTED:
+                status=503
         else:
             execute_res['state'] = 'failed'
             execute_res['error'] = f'Not found!'
@@ -149,14 +215,14 @@ class WebServer(BaseServer):
         if isinstance(result,HttpResponse):
             return result
         else:
-            return HttpResponse(status=status,text=ujson.dumps(execute_res),content_type='application/json')
+            return HttpResponse(status=status,text=dumps_with_raw(execute_res),content_type='application/json')
 
 
     async def websocket_handler(self,ws:WebSocketResponse,isAuth:bool=True):
         """处理websocket请求
         isAuth 是否需要身份验证
         """
-        connection = ClientConnection(ws,self._dataEncrypt)
+        connection = ClientConnection(ws,self._dataEncrypt,self._queueMaxsize,self._overflowPolicy,codec.from_subprotocol(ws.ws_protocol))
         t = float('-inf')
         async for msg in ws:
             # 心跳检测
@@ -179,10 +245,19 @@ class WebServer(BaseServer):
             if msg.type == WSMsgType.TEXT or msg.type == WSMsgType.BINARY:
                 try:
                     if msg.data:
-                        res:dict = ujson.loads(msg.data)
-                        if type(res)!=dict:break
-                        # 处理请求
-                        asyncio.create_task(process_request(create_UtRequest(res,res.get('id'),res.get('encrypt')),connection,self._register,self._sub_container,pool=self._pool))
+                        # TEXT帧始终为json，BINARY帧使用协商的编解码器
+                        res:dict = ujson.loads(msg.data) if msg.type == WSMsgType.TEXT else connection.codec.loads(msg.data)
+                        # 处理请求，数组为紧凑格式
+                        if type(res)==list:
+                            request = create_compact_UtRequest(res,connection.methods)
+                        elif type(res)==dict:
+                            request = create_UtRequest(res,res.get('id'),res.get('encrypt'))
+                        else:
+                            break
+                        task = asyncio.create_task(process_request(request,connection,self._register,self._sub_container,pool=self._pool,threadPool=self._threadPool))
+                        if request.requestType in (UtType.RPC,UtType.MULTICALL,UtType.MAP):
+                            # 连接关闭或收到取消请求时取消执行
+                            connection.track(request.id,task)
                         continue
                 except:
                     break
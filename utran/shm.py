@@ -0,0 +1,206 @@
+"""# 共享内存传输
+进程池执行的注册函数，超过阈值的参数和返回值通过`multiprocessing.shared_memory`传递，
+执行器的管道中只传递共享内存的引用，不再通过管道序列化和复制大块数据。
+
+支持的类型:
+- `bytes` / `bytearray` / `memoryview` 直接复制到共享内存(memoryview接收后为bytes)
+- `str` 按utf-8编码后复制到共享内存
+- `numpy.ndarray` 复制数据，接收方按dtype和shape还原(不支持object类型)
+
+`list`、`dict`等由Python对象组成的容器无论如何都需要序列化，通过共享内存传递没有收益，仍然通过管道传递。
+
+只处理顶层的参数和返回值。共享内存都由主进程删除:
+参数在调用结束后删除，返回值在读取后删除。
+调用被取消或超时时，工作进程可能仍在执行，参数和返回值在执行结束后删除(见`discard`)。
+
+    ```
+    @server.register.rpc(useProcess=True,shmThreshold=1<<20)
+    def checksum(data:bytes):
+        ...
+    ```
+"""
+import sys
+import asyncio
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+from typing import Union
+
+from utran.utils import asyncfn_runner
+
+
+SHM_THRESHOLD = 1 << 20     # 默认阈值(单位:字节)
+
+
+class SharedRef:
+    """# 共享内存的引用
+    Attributes:
+        name: 共享内存的名称
+        size: 数据的字节数
+        kind: 数据类型 'bytes' / 'bytearray' / 'str' / 'ndarray'
+        meta: ndarray的(dtype,shape)
+    """
+    __slots__ = ('name','size','kind','meta')
+
+    def __init__(self,name:str,size:int,kind:str,meta:tuple=None) -> None:
+        self.name = name
+        self.size = size
+        self.kind = kind
+        self.meta = meta
+
+    def __getstate__(self):
+        return (self.name,self.size,self.kind,self.meta)
+
+    def __setstate__(self,state):
+        self.name,self.size,self.kind,self.meta = state
+
+    def __repr__(self) -> str:
+        return f'<SharedRef {self.name} {self.kind} {self.size}>'
+
+
+def _ndarray(obj):
+    """是否为可共享的numpy数组，未导入numpy时不会导入"""
+    np = sys.modules.get('numpy')
+    return np is not None and isinstance(obj,np.ndarray) and not obj.dtype.hasobject
+
+
+def dump(obj,threshold:int)->tuple[any,Union[shared_memory.SharedMemory,None]]:
+    """# 超过阈值的对象写入共享内存
+    Returns:
+        (SharedRef,共享内存)，未超过阈值或类型不支持时返回 (原对象,None)
+    """
+    meta = None
+    t = type(obj)
+    if t in (bytes,bytearray,memoryview):
+        size = obj.nbytes if t == memoryview else len(obj)
+        if size < threshold:
+            return obj,None
+        try:
+            data = obj.cast('B') if t == memoryview else obj
+        except TypeError:
+            return obj,None
+        kind = 'bytearray' if t == bytearray else 'bytes'
+    elif t == str:
+        if len(obj) < threshold:
+            return obj,None
+        data = obj.encode('utf-8','surrogatepass')
+        size = len(data)
+        kind = 'str'
+    elif _ndarray(obj):
+        if obj.nbytes < threshold:
+            return obj,None
+        np = sys.modules['numpy']
+        data = np.ascontiguousarray(obj)
+        size = data.nbytes
+        kind = 'ndarray'
+        meta = (data.dtype.str,data.shape)
+        data = data.reshape(-1).view('B')
+    else:
+        return obj,None
+
+    shm = shared_memory.SharedMemory(create=True,size=max(size,1))
+    shm.buf[:size] = data
+    return SharedRef(shm.name,size,kind,meta),shm
+
+
+def load(ref:SharedRef,unlink:bool=False):
+    """# 从共享内存读取对象
+    读取时复制数据，返回的对象不引用共享内存
+    Args:
+        ref: 共享内存的引用
+        unlink: 读取后是否删除共享内存
+    """
+    shm = shared_memory.SharedMemory(name=ref.name)
+    try:
+        with shm.buf[:ref.size] as view:
+            if ref.kind == 'bytes':
+                return bytes(view)
+            if ref.kind == 'bytearray':
+                return bytearray(view)
+            if ref.kind == 'str':
+                return str(view,'utf-8','surrogatepass')
+            import numpy as np
+            dtype,shape = ref.meta
+            return np.frombuffer(view,dtype=dtype).reshape(shape).copy()
+    finally:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def share(args:tuple,dicts:dict,threshold:int)->tuple[tuple,dict,list]:
+    """# 主进程中将超过阈值的参数写入共享内存
+    Returns:
+        (列表参数,字典参数,创建的共享内存)，调用结束后使用`release`删除共享内存
+    """
+    segments = []
+    args_ = []
+    for v in args:
+        v,shm = dump(v,threshold)
+        if shm is not None:
+            segments.append(shm)
+        args_.append(v)
+    dicts_ = dict()
+    for k,v in dicts.items():
+        v,shm = dump(v,threshold)
+        if shm is not None:
+            segments.append(shm)
+        dicts_[k] = v
+    return tuple(args_),dicts_,segments
+
+
+def release(segments:list)->None:
+    """关闭并删除共享内存"""
+    for shm in segments:
+        try:
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def receive(res):
+    """主进程中读取返回值，返回值在共享内存中时读取后删除共享内存"""
+    if type(res) == SharedRef:
+        return load(res,unlink=True)
+    return res
+
+
+def discard(future:Future,segments:list=None)->None:
+    """# 调用方已经不再等待时，执行结束后删除参数和未读取的返回值
+    作为执行器future的完成回调使用
+    """
+    if segments:
+        release(segments)
+    if future.cancelled() or future.exception() is not None:
+        return
+    ref = future.result()
+    if type(ref) == SharedRef:
+        try:
+            s = shared_memory.SharedMemory(name=ref.name)
+            s.close()
+            s.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def shared_call(target,args:tuple,dicts:dict,threshold:int):
+    """# 工作进程中执行注册函数
+    从共享内存读取参数，超过阈值的返回值写入共享内存后返回引用
+    Args:
+        target: 工作进程中注册函数的键(见`utran.worker`)，或可调用对象
+    """
+    args = tuple(load(v) if type(v) == SharedRef else v for v in args)
+    dicts = {k:(load(v) if type(v) == SharedRef else v) for k,v in dicts.items()}
+    if type(target) == str:
+        from utran import worker
+        res = worker.call(target,args,dicts)
+    elif asyncio.iscoroutinefunction(target):
+        res = asyncfn_runner(target,*args,**dicts)
+    else:
+        res = target(*args,**dicts)
+    ref,shm = dump(res,threshold)
+    if shm is None:
+        return res
+    # 工作进程只关闭，由主进程读取后删除
+    shm.close()
+    return ref
@@ -0,0 +1,130 @@
+"""# 话题匹配
+话题使用`.`分隔层级，例如 `market.btc.trade`。订阅时支持通配符:
+
+|通配符|说明|示例|
+|-|-|-|
+|`*`|匹配一个层级|`market.*.trade` 匹配 `market.btc.trade`|
+|`#`|匹配零个或多个层级，只能位于最后一级|`market.#` 匹配 `market`、`market.btc.trade`|
+"""
+from typing import List
+
+
+SEPARATOR = '.'
+SINGLE_WILDCARD = '*'
+MULTI_WILDCARD = '#'
+
+
+def is_pattern(topic:str)->bool:
+    """是否为包含通配符的话题"""
+    return SINGLE_WILDCARD in topic or MULTI_WILDCARD in topic
+
+
+def check_pattern(pattern:str)->None:
+    """检查通配符话题是否合法"""
+    levels = pattern.split(SEPARATOR)
+    for i,level in enumerate(levels):
+        if MULTI_WILDCARD in level and (level != MULTI_WILDCARD or i != len(levels)-1):
+            raise ValueError(f'Topic error,"{MULTI_WILDCARD}" must occupy the last level of "{pattern}"')
+        if SINGLE_WILDCARD in level and level != SINGLE_WILDCARD:
+            raise ValueError(f'Topic error,"{SINGLE_WILDCARD}" must occupy an entire level of "{pattern}"')
+
+
+def match_topic(pattern:str,topic:str)->bool:
+    """判断话题是否匹配通配符话题"""
+    levels = topic.split(SEPARATOR)
+    p_levels = pattern.split(SEPARATOR)
+    for i,p in enumerate(p_levels):
+        if p == MULTI_WILDCARD:
+            return True
+        if i >= len(levels):
+            return False
+        if p != SINGLE_WILDCARD and p != levels[i]:
+            return False
+    return len(p_levels) == len(levels)
+
+
+class _TrieNode:
+    __slots__ = ('children','pattern')
+
+    def __init__(self) -> None:
+        self.children:dict = dict()     # {层级:_TrieNode}
+        self.pattern:str = None         # 在该节点结束的通配符话题
+
+
+class TopicTrie:
+    """# 通配符话题的前缀树
+    一次匹配只需沿着话题的层级向下查找，耗时与话题深度成正比，与通配符话题的数量无关
+    """
+    __slots__ = ('_root','_size')
+
+    def __init__(self) -> None:
+        self._root = _TrieNode()
+        self._size = 0
+
+    def __len__(self)->int:
+        return self._size
+
+    def __contains__(self,pattern:str)->bool:
+        node = self._root
+        for level in pattern.split(SEPARATOR):
+            node = node.children.get(level)
+            if node is None:
+                return False
+        return node.pattern is not None
+
+    def add(self,pattern:str)->None:
+        """添加通配符话题"""
+        check_pattern(pattern)
+        node = self._root
+        for level in pattern.split(SEPARATOR):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = _TrieNode()
+            node = child
+        if node.pattern is None:
+            node.pattern = pattern
+            self._size += 1
+
+    def remove(self,pattern:str)->None:
+        """移除通配符话题，并清理不再使用的节点"""
+        path = [self._root]
+        levels = pattern.split(SEPARATOR)
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].pattern is None:
+            return
+        path[-1].pattern = None
+        self._size -= 1
+        for i in range(len(levels),0,-1):
+            node = path[i]
+            if node.pattern is not None or node.children:
+                break
+            del path[i-1].children[levels[i-1]]
+
+    def match(self,topic:str)->List[str]:
+        """获取与话题匹配的所有通配符话题"""
+        res = []
+        if not self._size:
+            return res
+        levels = topic.split(SEPARATOR)
+        depth = len(levels)
+        stack = [(self._root,0)]
+        while stack:
+            node,i = stack.pop()
+            multi:_TrieNode = node.children.get(MULTI_WILDCARD)
+            if multi is not None and multi.pattern is not None:
+                res.append(multi.pattern)
+            if i == depth:
+                if node.pattern is not None:
+                    res.append(node.pattern)
+                continue
+            child = node.children.get(levels[i])
+            if child is not None:
+                stack.append((child,i+1))
+            child = node.children.get(SINGLE_WILDCARD)
+            if child is not None:
+                stack.append((child,i+1))
+        return res
@@ -0,0 +1,298 @@
+"""# 持久化的话题日志
+每个话题的消息按顺序追加写入分段文件，读取时通过`mmap`映射文件。
+发布消息时只放入内存，由后台任务定时批量写入磁盘(group commit)，不会在发布路径上产生同步的磁盘写入。
+
+目录结构:
+    ```
+    path/
+        t_<话题>/
+            00000000000000000001.log     # 文件名为该分段第一条消息的序号
+            00000000000000001025.log
+    ```
+
+记录格式:
+    ```
+    length(4字节) seq(8字节) timestamp(8字节) payload(length字节，为推送消息编码后的json)
+    ```
+"""
+import os
+import time
+import mmap
+import struct
+import asyncio
+import threading
+from urllib.parse import quote, unquote
+from typing import Dict, List, Tuple
+
+from utran.log import logger
+
+
+RECORD_HEADER = struct.Struct('<IQd')
+SEGMENT_SUFFIX = '.log'
+TOPIC_PREFIX = 't_'
+
+
+class _Segment:
+    __slots__ = ('path','firstSeq','lastSeq','size')
+
+    def __init__(self,path:str,firstSeq:int,lastSeq:int=0,size:int=0) -> None:
+        self.path = path
+        self.firstSeq = firstSeq
+        self.lastSeq = lastSeq
+        self.size = size
+
+
+class _TopicFiles:
+    """一个话题的所有分段文件"""
+    __slots__ = ('dir','segments','file')
+
+    def __init__(self,dir:str) -> None:
+        self.dir = dir
+        self.segments:List[_Segment] = []
+        self.file = None        # 当前分段文件的句柄
+
+    @property
+    def lastSeq(self)->int:
+        return self.segments[-1].lastSeq if self.segments else 0
+
+    @property
+    def size(self)->int:
+        return sum(s.size for s in self.segments)
+
+
+class TopicLog:
+    """# 持久化的话题日志
+    Args:
+        path: 日志目录
+        segmentBytes: 单个分段文件的最大字节数，超过后创建新的分段
+        retentionBytes: 每个话题最多保留的字节数，超过后删除最旧的分段，0为不限制
+        retentionSeconds: 分段最长的保留时间(单位:秒)，0为不限制
+        flushInterval: 批量写入磁盘的间隔(单位:秒)
+        fsync: 每次批量写入后是否调用fsync
+    """
+    __slots__ = ('_path','_segmentBytes','_retentionBytes','_retentionSeconds','_flushInterval','_fsync',
+                 '_topics','_pending','_writing','_lock','_flushLock','_task')
+
+    def __init__(self,
+                 path:str,
+                 *,
+                 segmentBytes:int = 64*1024**2,
+                 retentionBytes:int = 0,
+                 retentionSeconds:float = 0,
+                 flushInterval:float = 0.05,
+                 fsync:bool = False) -> None:
+        self._path = os.path.abspath(path)
+        self._segmentBytes = segmentBytes
+        self._retentionBytes = retentionBytes
+        self._retentionSeconds = retentionSeconds
+        self._flushInterval = flushInterval
+        self._fsync = fsync
+        self._topics:Dict[str,_TopicFiles] = dict()
+        self._pending:list = []         # [(话题,序号,时间,EncodedResponse),...] 等待写入磁盘的消息
+        self._writing:list = []         # 正在写入磁盘的消息
+        self._lock = threading.Lock()
+        self._flushLock = asyncio.Lock()
+        self._task:asyncio.Task = None
+        os.makedirs(self._path,exist_ok=True)
+        self.__recover()
+
+    @property
+    def path(self)->str:
+        return self._path
+
+    @property
+    def topics(self)->List[str]:
+        """已持久化的话题"""
+        return list(self._topics.keys())
+
+    @property
+    def pending(self)->int:
+        """等待写入磁盘的消息数量"""
+        return len(self._pending)+len(self._writing)
+
+    def last_seq(self,topic:str)->int:
+        """话题最后一条消息的序号，包括还未写入磁盘的消息"""
+        for t,seq,_,_ in reversed(self._writing+self._pending):
+            if t == topic:
+                return seq
+        tf = self._topics.get(topic)
+        return tf.lastSeq if tf else 0
+
+    def append(self,topic:str,seq:int,frame)->None:
+        """# 追加消息
+        只放入内存，由后台任务批量写入磁盘
+        Args:
+            topic: 话题
+            seq: 消息序号
+            frame: 预编码的推送消息 EncodedResponse
+        """
+        self._pending.append((topic,seq,time.time(),frame))
+        if self._task is None:
+            self.start()
+
+    def start(self)->None:
+        """启动后台写入任务"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.__flusher())
+
+    async def close(self)->None:
+        """停止后台写入任务，写入剩余的消息并关闭文件"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        with self._lock:
+            for tf in self._topics.values():
+                if tf.file is not None:
+                    tf.file.close()
+                    tf.file = None
+
+    async def flush(self)->None:
+        """将内存中的消息写入磁盘"""
+        async with self._flushLock:
+            if not self._pending:
+                return
+            self._writing,self._pending = self._pending,[]
+            batch:Dict[str,list] = dict()
+            for topic,seq,t,frame in self._writing:
+                batch.setdefault(topic,[]).append((seq,t,frame.text.encode('utf-8')))
+            try:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None,self._write,batch)
+            finally:
+                self._writing = []
+
+    async def read(self,topic:str,afterSeq:int)->List[Tuple[int,str]]:
+        """# 从磁盘读取序号`afterSeq`之后的消息
+        Returns:
+            [(序号,推送消息的json),...]
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None,self._read,topic,afterSeq)
+
+    def read_pending(self,topic:str,afterSeq:int)->list:
+        """# 读取还未写入磁盘的消息中，序号`afterSeq`之后的消息
+        Returns:
+            [(序号,EncodedResponse),...]
+        """
+        return [(seq,frame) for t,seq,_,frame in self._writing+self._pending if t == topic and seq > afterSeq]
+
+    async def __flusher(self):
+        while True:
+            await asyncio.sleep(self._flushInterval)
+            try:
+                await asyncio.shield(self.flush())     # 关闭时不会中断正在进行的写入
+            except Exception as e:
+                logger.error(f'TopicLog write error: {e}')
+
+    def _write(self,batch:Dict[str,list])->None:
+        """在线程中批量写入，每个话题每次只调用一次write"""
+        with self._lock:
+            for topic,records in batch.items():
+                tf = self._topics.get(topic)
+                if tf is None:
+                    tf = self._topics[topic] = _TopicFiles(os.path.join(self._path,TOPIC_PREFIX+quote(topic,safe='')))
+                    os.makedirs(tf.dir,exist_ok=True)
+                if tf.file is None and tf.segments:
+                    tf.file = open(tf.segments[-1].path,'ab')
+                data = bytearray()
+                for seq,t,payload in records:
+                    seg = tf.segments[-1] if tf.segments else None
+                    if seg is None or seg.size+len(data) >= self._segmentBytes:
+                        if data:
+                            self.__write_file(tf,data)
+                            data = bytearray()
+                        self.__roll(tf,seq)
+                        seg = tf.segments[-1]
+                    data += RECORD_HEADER.pack(len(payload),seq,t)
+                    data += payload
+                    seg.lastSeq = seq
+                if data:
+                    self.__write_file(tf,data)
+                self.__retention(tf)
+
+    def __write_file(self,tf:_TopicFiles,data:bytearray)->None:
+        tf.file.write(data)
+        tf.file.flush()
+        if self._fsync:
+            os.fsync(tf.file.fileno())
+        tf.segments[-1].size += len(data)
+
+    def __roll(self,tf:_TopicFiles,firstSeq:int)->None:
+        """创建新的分段"""
+        if tf.file is not None:
+            tf.file.close()
+        path = os.path.join(tf.dir,f'{firstSeq:020d}{SEGMENT_SUFFIX}')
+        tf.file = open(path,'ab')
+        tf.segments.append(_Segment(path,firstSeq,firstSeq-1,0))
+
+    def __retention(self,tf:_TopicFiles)->None:
+        """删除超出保留大小或保留时间的旧分段，当前写入的分段不会被删除"""
+        now = time.time()
+        while len(tf.segments) > 1:
+            seg = tf.segments[0]
+            expired = self._retentionSeconds and os.path.getmtime(seg.path) < now-self._retentionSeconds
+            oversize = self._retentionBytes and tf.size > self._retentionBytes
+            if not (expired or oversize):
+                break
+            os.remove(seg.path)
+            tf.segments.pop(0)
+
+    def _read(self,topic:str,afterSeq:int)->List[Tuple[int,str]]:
+        with self._lock:
+            tf = self._topics.get(topic)
+            segments = [(s.path,s.size) for s in tf.segments if s.lastSeq > afterSeq] if tf else []
+        res = []
+        for path,size in segments:
+            try:
+                records = [(seq,payload.decode('utf-8')) for seq,_,payload in _iter_records(path,size) if seq > afterSeq]
+            except FileNotFoundError:
+                # 读取前已被保留策略删除(总是最旧的分段)，缺少的消息使重放标记为不完整
+                continue
+            res.extend(records)
+        return res
+
+    def __recover(self)->None:
+        """启动时扫描已有的分段，恢复每个话题最后的序号，截断末尾不完整的记录"""
+        for name in os.listdir(self._path):
+            dir = os.path.join(self._path,name)
+            if not name.startswith(TOPIC_PREFIX) or not os.path.isdir(dir):
+                continue
+            tf = _TopicFiles(dir)
+            files = sorted(f for f in os.listdir(dir) if f.endswith(SEGMENT_SUFFIX))
+            for f in files:
+                path = os.path.join(dir,f)
+                seg = _Segment(path,int(f[:-len(SEGMENT_SUFFIX)]))
+                seg.lastSeq = seg.firstSeq-1
+                offset = 0
+                for seq,end,_ in _iter_records(path,os.path.getsize(path),offsets=True):
+                    seg.lastSeq = seq
+                    offset = end
+                if offset != os.path.getsize(path):
+                    logger.warning(f'TopicLog truncate incomplete record: {path}')
+                    os.truncate(path,offset)
+                seg.size = offset
+                tf.segments.append(seg)
+            if tf.segments:
+                tf.file = open(tf.segments[-1].path,'ab')
+                self._topics[unquote(name[len(TOPIC_PREFIX):])] = tf
+
+
+def _iter_records(path:str,size:int,offsets:bool=False):
+    """# 通过mmap遍历分段文件中的记录
+    Returns:
+        生成 (序号,时间,payload)，offsets为True时生成 (序号,记录结束位置,payload)
+    """
+    if size <= 0:
+        return
+    with open(path,'rb') as f:
+        with mmap.mmap(f.fileno(),size,access=mmap.ACCESS_READ) as mm:
+            offset = 0
+            while offset+RECORD_HEADER.size <= size:
+                length,seq,t = RECORD_HEADER.unpack_from(mm,offset)
+                start = offset+RECORD_HEADER.size
+                end = start+length
+                if end > size:
+                    break
+                yield (seq,end if offsets else t,mm[start:end])
+                offset = end
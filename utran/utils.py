@@ -2,6 +2,7 @@
 import asyncio
 import inspect
 import re
+import time
 import ujson
 from typing import Callable, Coroutine, Union
 
@@ -20,7 +21,7 @@ def unpack_data2_utran(buffer:bytes=b'')->tuple[str,dict,int,bytes]:
 
     Utran协议:
         ```
-        rpc/subscribe/unsubscribe/publish/multicall
+        rpc/subscribe/unsubscribe/publish/multicall/multipublish/cancel/map
         length:xx
         encrypt:0/1
         message_json
@@ -36,7 +37,7 @@ def unpack_data2_utran(buffer:bytes=b'')->tuple[str,dict,int,bytes]:
     except:
         raise ValueError('The utran protocol is invalid')
     
-    if msgType not in [b'rpc',b'subscribe',b'unsubscribe',b'publish',b'multicall']:
+    if msgType not in [b'rpc',b'subscribe',b'unsubscribe',b'publish',b'multicall',b'multipublish',b'cancel',b'map']:
         raise ValueError('The utran protocol is invalid')
     
     try:
@@ -79,7 +80,9 @@ def pack_data2_utran(id:int,name:str,message:Union[dict,bytes],encrypt:bool=Fals
     """
     if type(message) == dict:
         message_json = ujson.dumps(message).encode('utf-8')
-    elif type(message) != bytes:
+    elif type(message) == bytes:
+        message_json = message
+    else:
         raise ValueError('Packaging error,The message must be a dict or bytes ')
 
     if encrypt:
@@ -187,6 +190,13 @@ def parameter_serialization(fun,*args,**kwds):
     return res_+_res
 
 
+def timed_runner(fn:Callable,args:tuple,kwds:dict)->tuple[any,float]:
+    """子进程或线程中执行同步函数，同时返回执行耗时(单位:秒)"""
+    t = time.perf_counter()
+    res = fn(*args,**kwds)
+    return res,time.perf_counter()-t
+
+
 def asyncfn_runner(fn:Union[Callable,Coroutine],*args,**kwds):
     """子进程或线程中的异步执行器"""
     if asyncio.iscoroutinefunction(fn):
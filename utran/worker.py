@@ -0,0 +1,258 @@
+"""# 进程池的工作进程
+工作进程启动时接收并保存需要在进程中执行的注册函数，之后每次调用只发送 (键,列表参数,字典参数)，
+不再为每次调用序列化函数本身(类方法会连同整个实例一起序列化)。
+每个工作进程使用一个常驻的事件循环执行异步函数，不会为每次调用创建和关闭事件循环。
+
+注册类时使用选项`pinProcess=True`，类在一个固定的工作进程中实例化，该类的所有方法都在这个进程中执行，
+实例的状态在调用之间保留，适用于较大的内存模型或缓存。固定的进程意外退出时(例如内存不足)，
+正在执行的调用失败，进程重新启动并重新实例化，之前实例的状态丢失:
+
+    ```
+    @server.register.rpc(name='model',pinProcess=True)
+    class Model:
+        def __init__(self):
+            self.table = load_table()
+        def lookup(self,key):
+            return self.table[key]
+    ```
+
+工作进程的生命周期钩子`onWorkerStart`在每个工作进程启动时执行一次，返回的资源{名称:资源}保存在进程中，
+注册函数通过默认值为`Resource(名称)`的参数获取资源，资源由工作进程注入，不需要客户端传递。
+`onWorkerStop(资源)`在工作进程退出时执行。钩子会发送到工作进程中，必须可以被pickle序列化，
+请使用模块级别的函数，不能使用lambda或嵌套函数(Windows和macOS默认以spawn方式启动进程):
+
+    ```
+    def on_start():
+        return {'model':load_model()}
+
+    def on_stop(res):
+        res['model'].close()
+
+    server = Server(workers=4,onWorkerStart=on_start,onWorkerStop=on_stop)
+
+    @server.register.rpc(useProcess=True)
+    def predict(x:list,model=Resource('model')):
+        return model.predict(x)
+    ```
+"""
+import os
+import time
+import asyncio
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker
+from multiprocessing.util import Finalize
+import ujson
+
+from utran.log import logger
+
+
+_registry:dict = dict()      # {键:可调用对象}，工作进程中的注册函数
+_loop:asyncio.AbstractEventLoop = None
+_resources:dict = dict()     # {名称:资源}，onWorkerStart创建的资源
+_inject:dict = dict()        # {键:{参数名:资源名称}}，需要注入资源的参数
+
+
+class Resource:
+    """# 工作进程中的资源
+    作为注册函数参数的默认值，在工作进程中执行时注入`onWorkerStart`创建的同名资源
+    Args:
+        name: 资源名称
+    """
+    __slots__ = ('name',)
+
+    def __init__(self,name:str) -> None:
+        self.name = name
+
+    def __json__(self)->str:
+        return ujson.dumps({'resource':self.name})
+
+    def __repr__(self) -> str:
+        return f'Resource({self.name!r})'
+
+
+def resource_params(fn)->dict:
+    """函数中需要注入资源的参数 {参数名:资源名称}"""
+    try:
+        params = inspect.signature(fn).parameters
+    except (TypeError,ValueError):
+        return dict()
+    return {k:v.default.name for k,v in params.items() if isinstance(v.default,Resource)}
+
+
+def _stop_worker(onWorkerStop)->None:
+    """工作进程退出时执行"""
+    res = onWorkerStop(_resources)
+    if asyncio.iscoroutine(res):
+        _loop.run_until_complete(res)
+
+
+def init_worker(registry:dict,publishQueue=None,onWorkerStart=None,onWorkerStop=None)->None:
+    """工作进程的初始化函数"""
+    global _registry,_loop,_resources,_inject
+    _registry = registry
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    if publishQueue is not None:
+        from utran.bridge import init_worker as init_publisher
+        init_publisher(publishQueue)
+    if onWorkerStart is not None:
+        res = onWorkerStart()
+        if asyncio.iscoroutine(res):
+            res = _loop.run_until_complete(res)
+        _resources = dict(res or {})
+    if onWorkerStop is not None:
+        Finalize(None,_stop_worker,args=(onWorkerStop,),exitpriority=10)
+    _inject = dict()
+    for key,fn in registry.items():
+        params = resource_params(fn)
+        if params:
+            _inject[key] = params
+
+
+def call(key:str,args:tuple,dicts:dict):
+    """在工作进程中执行注册函数"""
+    fn = _registry[key]
+    inject = _inject.get(key)
+    if inject:
+        dicts = dict(dicts)
+        for param,name in inject.items():
+            if name not in _resources:
+                raise RuntimeError(f'The resource "{name}" is not created by onWorkerStart')
+            dicts[param] = _resources[name]
+    if asyncio.iscoroutinefunction(fn):
+        return _loop.run_until_complete(fn(*args,**dicts))
+    return fn(*args,**dicts)
+
+
+def map_call(target,chunk:list)->list:
+    """# 在工作进程中对一组参数逐个执行注册函数
+    Args:
+        target: 工作进程中注册函数的键，或可调用对象
+        chunk: 参数列表，每个元素作为一次调用的唯一参数
+    """
+    if type(target) == str:
+        return [call(target,(x,),{}) for x in chunk]
+    if asyncio.iscoroutinefunction(target):
+        async def run():
+            return [await target(x) for x in chunk]
+        return _loop.run_until_complete(run()) if _loop is not None else asyncio.run(run())
+    return [target(x) for x in chunk]
+
+
+def timed_call(key:str,args:tuple,dicts:dict)->tuple[any,float]:
+    """在工作进程中执行注册函数，同时返回执行耗时(单位:秒)"""
+    t = time.perf_counter()
+    res = call(key,args,dicts)
+    return res,time.perf_counter()-t
+
+
+def init_pinned(target,insArgs:tuple,insKwds:dict,methods:dict,publishQueue=None)->None:
+    """固定工作进程的初始化函数，在进程中创建实例"""
+    instance = target(*insArgs,**insKwds) if inspect.isclass(target) else target
+    init_worker({key:getattr(instance,attr) for key,attr in methods.items()},publishQueue)
+
+
+def warmup(delay:float)->int:
+    """预热，返回工作进程的pid"""
+    time.sleep(delay)
+    return os.getpid()
+
+
+class WorkerPool(ProcessPoolExecutor):
+    """# 常驻注册函数的进程池
+    Args:
+        workers: 进程数量
+        registry: 需要在进程中执行的注册函数 {键:可调用对象}
+        publishQueue: 工作进程发布消息使用的队列，见`utran.bridge`
+        onWorkerStart: 每个工作进程启动时执行一次，返回资源 {名称:资源}
+        onWorkerStop: 每个工作进程退出时执行一次，参数为资源 {名称:资源}
+    """
+
+    def __init__(self,workers:int,registry:dict,publishQueue=None,onWorkerStart=None,onWorkerStop=None) -> None:
+        # 工作进程启动前先启动资源跟踪进程，工作进程与主进程共用，共享内存(见`utran.shm`)的创建和删除记录在同一处
+        resource_tracker.ensure_running()
+        super().__init__(workers,initializer=init_worker,initargs=(registry,publishQueue,onWorkerStart,onWorkerStop))
+        self._keys = frozenset(registry.keys())
+
+    def has(self,key:str)->bool:
+        """工作进程中是否存在该注册函数，启动后注册的函数不存在"""
+        return key in self._keys
+
+    async def prewarm(self,delay:float=0.05)->list:
+        """# 预先启动全部的工作进程
+        Returns:
+            工作进程的pid
+        """
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*[loop.run_in_executor(self,warmup,delay) for _ in range(self._max_workers)])
+
+
+class PinnedWorker:
+    """# 固定的工作进程
+    类在该进程中实例化，该类的所有方法都在这个进程中执行
+    Args:
+        name: 类注册的名称
+        target: 类或类实例，类实例只在进程启动时序列化一次，之后主进程中的实例不再使用
+        insArgs: 实例化的列表参数
+        insKwds: 实例化的字典参数
+    """
+    __slots__ = ('name','target','insArgs','insKwds','methods','_executor','_publishQueue')
+
+    def __init__(self,name:str,target,insArgs:tuple=tuple(),insKwds:dict=dict()) -> None:
+        self.name = name
+        self.target = target
+        self.insArgs = insArgs
+        self.insKwds = insKwds
+        self.methods = dict()        # {键:方法名}
+        self._executor:ProcessPoolExecutor = None
+        self._publishQueue = None
+
+    def add(self,key:str,attr:str)->None:
+        """添加在该进程中执行的方法，进程启动后添加的方法不生效"""
+        self.methods[key] = attr
+
+    def has(self,key:str)->bool:
+        return key in self.methods
+
+    @property
+    def executor(self)->ProcessPoolExecutor:
+        """进程的执行器，未启动时自动启动"""
+        return self.start()
+
+    def start(self,publishQueue=None)->ProcessPoolExecutor:
+        """# 启动进程
+        Args:
+            publishQueue: 工作进程发布消息使用的队列，见`utran.bridge`
+        """
+        if publishQueue is not None:
+            self._publishQueue = publishQueue
+        if self._executor is None:
+            resource_tracker.ensure_running()
+            self._executor = ProcessPoolExecutor(1,initializer=init_pinned,
+                                                 initargs=(self.target,self.insArgs,self.insKwds,dict(self.methods),self._publishQueue))
+        return self._executor
+
+    def restart(self,executor:ProcessPoolExecutor)->None:
+        """# 重新启动意外退出的进程
+        进程退出后执行器不再可用(BrokenProcessPool)，关闭后重新启动进程并重新实例化，实例的状态随之丢失
+        Args:
+            executor: 出错的执行器，已经重新启动或者已经关闭时不再重复启动
+        """
+        if executor is None or executor is not self._executor:
+            return
+        logger.warning(f'The pinned process of "{self.name}" exited unexpectedly, restart it and the instance state is lost')
+        self._executor = None
+        executor.shutdown(wait=False,cancel_futures=True)
+        self.start()
+
+    async def prewarm(self)->int:
+        """预先启动进程并创建实例，返回进程的pid"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,warmup,0)
+
+    def shutdown(self,wait:bool=False)->None:
+        """关闭进程，实例的状态随之丢失。wait为True时等待进程退出"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait,cancel_futures=True)
+            self._executor = None